@@ -42,6 +42,30 @@ def clean():
     shutil.rmtree('./build', ignore_errors=True)
 
 
+@task(description="benchmark act and batch_act of all agents on synthetic data")
+def run_benchmarks():
+    """
+    Use 'pyb run_benchmarks' to write throughput and latency of agents to build/benchmarks.
+    """
+    import sys
+    import unittest
+    sys.path.append(os.path.join(os.getcwd(), 'tests', 'benchmarks'))
+    suite = unittest.defaultTestLoader.discover('tests/benchmarks', pattern='*_benchmarks.py')
+    unittest.TextTestRunner(verbosity=2).run(suite)
+
+
+@task(description="run a hyperparameter sweep over training arguments")
+def run_sweep(project):
+    """
+    Use 'pyb -P sweep_config=<sweep.json> run_sweep' to train trials of the sweep described in sweep.json,
+    see sweep_utils for its format. Results are written to results.tsv in the directory of the sweep.
+    """
+    import json
+    import sweep_utils
+    with open(project.get_property('sweep_config')) as config_file:
+        sweep_utils.run_sweep(json.load(config_file))
+
+
 @task(description="upload archived model to the Nexus repository")
 @depends("archive_model")
 def upload_model_to_nexus(project):
@@ -24,15 +24,21 @@ TODO List:
 """
 import copy
 import math
+import multiprocessing
+import queue
 import sys
 import os
+import traceback
 
-from parlai.core.agents import create_agent
+from parlai.core.agents import Agent, create_agent, get_agent_module
 from parlai.core.params import ParlaiParser, str2class
 from parlai.core.utils import Timer
 from parlai.core.worlds import DialogPartnerWorld, create_task
 from parlai.core.dict import DictionaryAgent
 
+from deeppavlov.utils import checkpoint, example_cache, memory, prefetch, sweep
+from deeppavlov.utils.train_profiler import TrainProfiler
+
 
 def arg_parse(args=None):
     # Get command line arguments
@@ -69,6 +75,29 @@ def arg_parse(args=None):
                        help='metrics chosen to measure improvement') # custom arg
     train.add_argument('--lr-drop', '--lr-drop-patience', type=float, default=-1,
                        help='drop learning rate if validation metric is not improving') # custom arg
+    train.add_argument('--dict-workers', type=int, default=1,
+                       help='number of processes building the dictionary from shards of training data')
+    train.add_argument('--bagging-workers', type=int, default=1,
+                       help='number of processes used to train bagging folds in parallel')
+    train.add_argument('--bagging-cpu-threads', type=int, default=0,
+                       help='CPU cores given to each bagging worker, 0 splits available cores evenly')
+    train.add_argument('--cache-valid-examples', type='bool', default=None,
+                       help='agents tensorize validation examples once and reuse them in next validation rounds, '
+                            'defaults to True unless data is streamed')
+    train.add_argument('--example-cache-size', type=int, default=None,
+                       help='maximal number of validation examples cached by the agent, defaults to 10000')
+    train.add_argument('--log-memory-every-n-secs', type=float, default=600,
+                       help='log memory held by the agent and the process, -1 disables memory logging')
+    train.add_argument('--profile-train', type='bool', default=False,
+                       help='time stages of every training step and log their percentiles')
+    train.add_argument('--profile-train-file', default=None,
+                       help='file to save the training profile to, defaults to <model_file>.profile.json')
+    train.add_argument('--async-save', type='bool', default=True,
+                       help='write checkpoints of new best models in a background thread')
+    train.add_argument('--prefetch-batches', type=int, default=0,
+                       help='number of training batches prepared in a background thread, 0 disables prefetching')
+
+    sweep.add_cmdline_args(parser)
 
     opt = parser.parse_args(args=args)
 
@@ -97,32 +126,172 @@ def __build_bag_of_words(opt):
         # Dictionary already built
         print("[ dictionary already built .]")
         return
+    dictionary = __create_dictionary(opt)
+    workers = opt.get('dict_workers', 1)
+    if workers > 1:
+        results = run_in_workers(__count_dictionary_shard, [(opt, shard, workers) for shard in range(workers)],
+                                 workers, name='dictionary shard')
+        for shard, (counts, error) in enumerate(results):
+            if error is not None:
+                raise RuntimeError('dictionary shard {} failed\n{}'.format(shard + 1, error))
+            # shards are merged in order, so the dictionary does not depend on the order workers finish
+            __merge_dictionary_counts(dictionary, counts)
+    else:
+        __fill_dictionary(opt, dictionary)
+    print('[ dictionary built. ]')
+    dictionary.save(opt['dict_file'], sort=True)
+    # print('[ num words =  %d ]' % len(dictionary))
+
+
+def __create_dictionary(opt):
+    """Create an empty dictionary of the class set by --dict-class or of the agent's dictionary_class()."""
     if opt.get('dict_class'):
         # Custom dictionary class
-        dictionary = str2class(opt['dict_class'])(opt)
-    else:
-        # Default dictionary class
-        dictionary = DictionaryAgent(opt)
+        return str2class(opt['dict_class'])(opt)
+    agent_class = get_agent_module(opt['model']) if opt.get('model') else None
+    if hasattr(agent_class, 'dictionary_class'):
+        # Dictionary tokenizing text as the agent does
+        return agent_class.dictionary_class()(opt)
+    # Default dictionary class
+    return DictionaryAgent(opt)
+
+
+class _DictionaryShard(Agent):
+    """Agent passing every shards-th training example, starting from the shard-th, to a dictionary.
+
+    Used for teachers which can not read a slice of their data, every worker then reads all examples.
+    """
+
+    def __init__(self, dictionary, shard, shards):
+        super().__init__(dictionary.opt)
+        self.id = 'DictionaryShard'
+        self.dictionary = dictionary
+        self.shard = shard
+        self.shards = shards
+        self.count = 0
+
+    def observe(self, observation):
+        self.observation = observation if self.count % self.shards == self.shard else None
+        self.count += 1
+        if self.observation is not None:
+            self.dictionary.observe(observation)
+        return observation
+
+    def act(self):
+        if self.observation is not None:
+            self.dictionary.act()
+        return {'id': self.id}
+
+
+def __slices_data(world):
+    """Check if the teacher of a world reads only the slice of data set by data_shard and data_shards."""
+    return isinstance(world, DialogPartnerWorld) and getattr(world.get_agents()[0], 'slices_data', False)
+
+
+def __fill_dictionary(opt, dictionary, shard=0, shards=1):
+    """Pass examples of the training set, or of its shard, to the dictionary.
+    - opt is a dictionary returned by arg_parse
+    - shard is the index of the shard of examples taken by the dictionary
+    - shards is the number of shards
+    """
     ordered_opt = copy.deepcopy(opt)
     cnt = 0
+    max_exs = opt['dict_maxexs']
     # we use train set to build dictionary
     ordered_opt['datatype'] = 'train:ordered'
     if 'stream' in opt['datatype']:
         ordered_opt['datatype'] += ':stream'
     ordered_opt['numthreads'] = 1
     ordered_opt['batchsize'] = 1
-    world_dict = create_task(ordered_opt, dictionary)
+    ordered_opt['data_shard'] = shard
+    ordered_opt['data_shards'] = shards
+    agent = dictionary if shards == 1 else _DictionaryShard(dictionary, shard, shards)
+    world_dict = create_task(ordered_opt, agent)
+    if shards > 1 and __slices_data(world_dict):
+        # the teacher reads only the shard, so the dictionary takes all its examples
+        agent.shard, agent.shards = 0, 1
+        if max_exs > 0:
+            max_exs = math.ceil(max_exs / shards)
     # pass examples to dictionary
     for _ in world_dict:
         cnt += 1
-        if cnt > opt['dict_maxexs'] and opt['dict_maxexs'] > 0:
-            print('Processed {} exs, moving on.'.format(opt['dict_maxexs']))
+        if cnt > max_exs and max_exs > 0:
+            print('Processed {} exs, moving on.'.format(max_exs))
             # don't wait too long...
             break
         world_dict.parley()
-    print('[ dictionary built. ]')
-    dictionary.save(opt['dict_file'], sort=True)
-    # print('[ num words =  %d ]' % len(dictionary))
+
+
+def __dictionaries(dictionary):
+    """The dictionary and dictionaries it holds (e.g. labels of NERDictionaryAgent) by attribute names."""
+    dictionaries = {'': dictionary}
+    for name, value in vars(dictionary).items():
+        if isinstance(value, DictionaryAgent):
+            dictionaries[name] = value
+    return dictionaries
+
+
+def __count_dictionary_shard(opt, shard, shards):
+    """Count tokens of a shard of training examples in a worker process.
+    - opt is a dictionary returned by arg_parse
+    - shard is the index of the shard
+    - shards is the number of shards
+    Returns counts of tokens added to a new dictionary, as lists of (token, count) pairs in the order
+    tokens were added, by names of dictionaries returned by __dictionaries.
+    """
+    dictionary = __create_dictionary(opt)
+    initial = __dictionary_freqs(dictionary)
+    __fill_dictionary(opt, dictionary, shard, shards)
+    return __new_dictionary_counts(dictionary, initial)
+
+
+def __dictionary_freqs(dictionary):
+    """Copies of token frequencies of the dictionary and dictionaries it holds by names of __dictionaries."""
+    return {name: dict(d.freq) for name, d in __dictionaries(dictionary).items()}
+
+
+def __new_dictionary_counts(dictionary, initial):
+    """Counts of tokens added to the dictionary since frequencies returned by __dictionary_freqs.
+
+    Special tokens and words loaded on creation of a dictionary are in every shard, so only new
+    counts are merged. Returns lists of (token, count) pairs in the order tokens were added
+    by names of __dictionaries.
+    """
+    counts = {}
+    for name, d in __dictionaries(dictionary).items():
+        tokens = [d.ind2tok[i] for i in range(len(d.ind2tok))]
+        counts[name] = [(token, d.freq[token] - initial[name].get(token, 0)) for token in tokens
+                        if d.freq[token] > initial[name].get(token, 0)]
+    return counts
+
+
+def __merge_dictionary_counts(dictionary, counts):
+    """Add token counts returned by __count_dictionary_shard to the dictionary.
+
+    Counts are written as add_to_dict of DictionaryAgent does, tokens filtered by add_to_dict
+    of a dictionary class (e.g. words without embeddings) are not counted by workers.
+    """
+    dictionaries = __dictionaries(dictionary)
+    for name, tokens in counts.items():
+        d = dictionaries[name]
+        for token, count in tokens:
+            d.freq[token] += count
+            if token not in d.tok2ind:
+                index = len(d.tok2ind)
+                d.tok2ind[token] = index
+                d.ind2tok[index] = token
+
+
+def __valid_datatype(opt):
+    """Datatype of validation, streamed if training data is streamed."""
+    return 'valid:stream' if 'stream' in opt['datatype'].split(':') else 'valid'
+
+
+def __cache_valid_examples(opt):
+    """Whether agents cache validation examples, streamed data is not cached by default."""
+    if opt.get('cache_valid_examples') is None:
+        return 'stream' not in opt['datatype'].split(':')
+    return opt['cache_valid_examples']
 
 
 def __evaluate_model(valid_world, batchsize, datatype, display_examples, max_exs=-1):
@@ -154,12 +323,13 @@ def __evaluate_model(valid_world, batchsize, datatype, display_examples, max_exs
     return valid_report, valid_world
 
 
-def __train_log(opt, world, agent, input_train_dict):
+def __train_log(opt, world, agent, input_train_dict, profiler=None):
     """Log training procedure.
     - opt is a dictionary returned by arg_parse
     - world used for training
     - agent to be trained
     - train_dict is dictionary of parameters for training, logging, intermediate validation
+    - profiler is an optional TrainProfiler of the training loop
     """
     train_dict = copy.deepcopy(input_train_dict)
 
@@ -193,7 +363,7 @@ def __train_log(opt, world, agent, input_train_dict):
 
     # check if we should log amount of time remaining
     time_left = None
-    if opt['num_epochs'] > 0 and train_dict['total_exs'] > 0:
+    if opt['num_epochs'] > 0 and train_dict['total_exs'] > 0 and train_dict['max_exs'] > 0:
         exs_per_sec = train_dict['train_time'].time() / train_dict['total_exs']
         time_left = (train_dict['max_exs'] - train_dict['total_exs']) * exs_per_sec
     if opt['max_train_time'] > 0:
@@ -208,11 +378,23 @@ def __train_log(opt, world, agent, input_train_dict):
     # join log string and add full metrics report to end of log
     log = '[ {} ] {}'.format(' '.join(logs), train_dict['train_report'])
     print(log)
+    if profiler is not None and profiler.enabled:
+        print('[ {} ]'.format(profiler.log_line()))
+    if 0 < opt['log_memory_every_n_secs'] <= train_dict['memory_time'].time():
+        memory_report = agent.memory_report() if hasattr(agent, 'memory_report') else memory.report({})
+        print('[ {} ]'.format(memory.format_report(memory_report)))
+        train_dict['memory_time'].reset()
     train_dict['log_time'].reset()
     return world, agent, train_dict
 
 
 def __intermediate_validation(opt, valid_world, agent, input_train_dict):
+    """Validate the agent if it is time to.
+    - opt is a dictionary returned by arg_parse
+    - valid_world is the validation world of previous rounds, it is created on the first round if None
+    - agent to be validated
+    - train_dict is dictionary of parameters for training, logging, intermediate validation
+    """
     train_dict = copy.deepcopy(input_train_dict)
     if 0 < opt['validation_every_n_secs'] < train_dict['validate_time'].time() or \
             (opt['validation_every_n_epochs'] > 0 and train_dict['new_epoch'] and (
@@ -222,11 +404,14 @@ def __intermediate_validation(opt, valid_world, agent, input_train_dict):
         if iopt.get('evaltask'):
             iopt['task'] = iopt['evaltask']
             print(iopt['task'])
-        iopt['datatype'] = 'valid'
-        ivalid_world = create_task(iopt, agent)
+        iopt['datatype'] = __valid_datatype(opt)
+        if valid_world is None:
+            # teachers build and load data once, the world is reset before every round
+            valid_world = create_task(iopt, agent)
 
-        valid_report, valid_world = __evaluate_model(ivalid_world, iopt['batchsize'], 'valid',
-                                                     iopt['display_examples'], iopt['validation_max_exs'])
+        with example_cache.caching(agent, __cache_valid_examples(opt)):
+            valid_report, valid_world = __evaluate_model(valid_world, iopt['batchsize'], 'valid',
+                                                         iopt['display_examples'], iopt['validation_max_exs'])
 
         if train_dict['best_metrics'] not in valid_report and 'accuracy' in valid_report:
             train_dict['best_metrics'] = 'accuracy'
@@ -236,6 +421,8 @@ def __intermediate_validation(opt, valid_world, agent, input_train_dict):
             train_dict['lr_drop_impatience'] = 0
             print('[ new best ' + train_dict['best_metrics'] + ': ' + str(train_dict['best_metrics_value']) + ' ]')
             valid_world.save_agents()
+            if hasattr(agent, 'snapshot_weights'):
+                agent.snapshot_weights()
             train_dict['saved'] = True
         else:
             train_dict['impatience'] += 1
@@ -246,6 +433,9 @@ def __intermediate_validation(opt, valid_world, agent, input_train_dict):
         if 0 < opt['validation_patience'] <= train_dict['impatience']:
             print('[ ran out of patience! stopping training. ]')
             train_dict['break'] = True
+        if sweep.report_validation(opt, valid_report[train_dict['best_metrics']]):
+            print('[ trial is behind the median of other trials of the sweep, stopping training ]')
+            train_dict['break'] = True
         if 'lr_drop_patience' in opt and 0 < opt['lr_drop_patience'] <= train_dict['lr_drop_impatience']:
             if hasattr(agent, 'drop_lr'):
                 print('[ validation metric is decreasing, dropping learning rate ]')
@@ -263,11 +453,22 @@ def __train_single_model(opt):
     # Create model and assign it to the specified task
     agent = create_agent(opt)
     world = create_task(opt, agent)
+    profiler = TrainProfiler(enabled=opt.get('profile_train', False))
+    profiler.attach(world, agent)
+    if opt.get('prefetch_batches', 0) > 0:
+        if profiler.enabled:
+            print('[ training batches are not prefetched while training is profiled ]')
+        elif not prefetch.supported(agent):
+            print('[ agent does not act on batches, training batches are not prefetched ]')
+        else:
+            world = prefetch.PrefetchWorld(world, agent, opt['prefetch_batches'])
+    valid_world = None
     print('[ training... ]')
 
     train_dict = {'train_time': Timer(),
                   'validate_time': Timer(),
                   'log_time': Timer(),
+                  'memory_time': Timer(),
                   'new_epoch': None,
                   'epochs_done': 0,
                   'max_exs': opt['num_epochs'] * len(world),
@@ -286,37 +487,69 @@ def __train_single_model(opt):
 
     try:
         while True:
+            profiler.start_step()
             world.parley()
             train_dict['parleys'] += 1
             train_dict['new_epoch'] = world.epoch_done()
             if train_dict['new_epoch']:
                 world.reset()
                 train_dict['epochs_done'] += 1
-            world, agent, train_dict = __train_log(opt, world, agent, train_dict)
-            if opt['num_epochs'] > 0 and train_dict['parleys'] >= train_dict['max_parleys']:
+            with profiler.stage('log_valid'), prefetch.paused(world):
+                world, agent, train_dict = __train_log(opt, world, agent, train_dict, profiler)
+            # the length of streamed data is unknown, so whole epochs are counted
+            if opt['num_epochs'] > 0 and (train_dict['parleys'] >= train_dict['max_parleys'] > 0 or
+                                          train_dict['max_parleys'] == 0 and
+                                          train_dict['epochs_done'] >= opt['num_epochs']):
                 print('[ num_epochs completed: {} ]'.format(opt['num_epochs']))
                 break
             if 0 < opt['max_train_time'] < train_dict['train_time'].time():
                 print('[ max_train_time elapsed: {} ]'.format(train_dict['train_time'].time()))
                 break
-            _, agent, train_dict = __intermediate_validation(opt, world, agent, train_dict)
+            with profiler.stage('log_valid'), prefetch.paused(world):
+                valid_world, agent, train_dict = __intermediate_validation(opt, valid_world, agent, train_dict)
+            profiler.end_step()
 
             if train_dict['break']:
                 break
     except KeyboardInterrupt:
         print('Stopped training, starting testing')
 
+    if isinstance(world, prefetch.PrefetchWorld):
+        world.close()
+    profiler.detach()
+    if profiler.enabled:
+        profiler.dump(opt.get('profile_train_file') or opt['model_file'] + '.profile.json')
+
     if not train_dict['saved']:
         world.save_agents()
+    # checkpoints saved in the background must be written before the model is read back
+    checkpoint.flush()
+
+    vopt = copy.deepcopy(opt)
+    if vopt.get('evaltask'):
+        vopt['task'] = vopt['evaltask']
+    vopt['datatype'] = __valid_datatype(opt)
+
+    if hasattr(agent, 'restore_weights'):
+        # evaluate best validation weights kept in memory by the live agent
+        if train_dict['saved']:
+            agent.restore_weights()
+        if valid_world is None:
+            valid_world = create_task(vopt, agent)
+        with example_cache.caching(agent, __cache_valid_examples(opt)):
+            metrics, _ = __evaluate_model(valid_world, vopt['batchsize'], 'valid',
+                                          vopt['display_examples'], vopt['validation_max_exs'])
+        world.shutdown()
+        valid_world.shutdown()
+        agent.shutdown()
+        return metrics
 
     world.shutdown()
+    if valid_world is not None:
+        valid_world.shutdown()
     agent.shutdown()
 
     # reload best validation model
-    vopt = copy.deepcopy(opt)
-    if vopt.get('evaltask'):
-        vopt['task'] = vopt['evaltask']
-    vopt['datatype'] = 'valid'
     vopt['pretrained_model'] = vopt['model_file']
     agent = create_agent(vopt)
     valid_world = create_task(vopt, agent)
@@ -327,19 +560,125 @@ def __train_single_model(opt):
     return metrics
 
 
+def __train_fold(opt, fold):
+    """Train one bagging fold.
+    - opt is a dictionary returned by arg_parse
+    - fold is the index of the fold
+    Returns (metrics, error), where error is a formatted traceback if training failed.
+    """
+    local_opt = copy.deepcopy(opt)
+    local_opt['model_file'] = opt.get('model_file', '') + '_' + str(fold)
+    local_opt['bagging_fold_index'] = fold
+    try:
+        return __train_single_model(local_opt), None
+    except Exception:
+        return None, traceback.format_exc()
+
+
+def __worker_process(target, args, cores, index, results):
+    """Entry point of a worker process.
+    - target is a function called with args
+    - cores is a list of CPU cores the worker is pinned to. TensorFlow sizes its
+      thread pools by the number of schedulable cores, so this is the worker's thread budget
+    - results is a queue the (index, result, error) tuple is put to
+    """
+    if hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, cores)
+    os.environ['OMP_NUM_THREADS'] = str(len(cores))
+    try:
+        result, error = target(*args), None
+    except Exception:
+        result, error = None, traceback.format_exc()
+    results.put((index, result, error))
+
+
+def run_in_workers(target, jobs, workers, cpu_threads=0, name='job'):
+    """Run jobs in a pool of worker processes with their own CPU cores.
+    - target is a module level function run in a worker
+    - jobs is a list of tuples of arguments of target
+    - workers is the number of jobs run at the same time
+    - cpu_threads is the number of CPU cores given to each worker, 0 splits available cores evenly
+    - name is the name of a job for logs
+    Returns a list of (result, error) tuples ordered as jobs, where error is a formatted traceback if the job failed.
+    """
+    if hasattr(os, 'sched_getaffinity'):
+        cores = sorted(os.sched_getaffinity(0))
+    else:
+        cores = list(range(multiprocessing.cpu_count()))
+    threads = cpu_threads or max(1, len(cores) // workers)
+    budgets = [[cores[(i * threads + j) % len(cores)] for j in range(threads)] for i in range(workers)]
+    print('[ running {} {}s with {} workers, {} cpu threads each ]'.format(len(jobs), name, workers, threads))
+
+    # TensorFlow sessions are created on import, so workers must not be forked from this process
+    ctx = multiprocessing.get_context('spawn')
+    results_queue = ctx.Queue()
+    results = [None] * len(jobs)
+    pending = list(range(len(jobs)))
+    running = {}
+    while pending or running:
+        while pending and budgets:
+            index = pending.pop(0)
+            budget = budgets.pop(0)
+            print('The {} {} is being trained'.format(index + 1, name))
+            process = ctx.Process(target=__worker_process, args=(target, jobs[index], budget, index, results_queue))
+            process.start()
+            running[index] = (process, budget)
+        try:
+            finished = [results_queue.get(timeout=5)]
+        except queue.Empty:
+            finished = []
+            # a worker killed by a signal or OOM never reports back
+            dead = [index for index, (process, _) in running.items() if not process.is_alive()]
+            while True:
+                try:
+                    finished.append(results_queue.get_nowait())
+                except queue.Empty:
+                    break
+            reported = {index for index, _, _ in finished}
+            finished.extend((index, None, 'worker exited with code {}'.format(running[index][0].exitcode))
+                            for index in dead if index not in reported)
+        for index, result, error in finished:
+            process, budget = running.pop(index)
+            process.join()
+            budgets.append(budget)
+            results[index] = (result, error)
+    return results
+
+
+def __train_folds_in_parallel(opt, folds, workers):
+    """Train bagging folds in a pool of worker processes.
+    - opt is a dictionary returned by arg_parse
+    - folds is the number of folds
+    - workers is the number of folds trained at the same time
+    Returns a list of (metrics, error) tuples ordered by fold.
+    """
+    results = run_in_workers(__train_fold, [(opt, fold) for fold in range(folds)], workers,
+                             opt['bagging_cpu_threads'], 'fold')
+    return [result if error is None else (None, error) for result, error in results]
+
+
 def __create_ensemble_model(opt):
     """Create a (set of) model(s).
     opt is a dictionary returned by arg_parse
     """
-    metrics_list = []
     folds = opt['bagging_folds_number']
+    workers = min(opt.get('bagging_workers', 1), folds)
     print('The number of folds is', folds)
-    for fold in range(folds):
-        print('The {} fold is being trained'.format(fold + 1))
-        local_opt = copy.deepcopy(opt)
-        local_opt['model_file'] = opt.get('model_file', '') + '_' + str(fold)
-        local_opt['bagging_fold_index'] = fold
-        metrics_list.append(__train_single_model(local_opt))
+    if workers > 1:
+        results = __train_folds_in_parallel(opt, folds, workers)
+    else:
+        results = []
+        for fold in range(folds):
+            print('The {} fold is being trained'.format(fold + 1))
+            results.append(__train_fold(opt, fold))
+
+    metrics_list = []
+    for fold, (metrics, error) in enumerate(results):
+        if error is not None:
+            print('[ fold {} failed ]\n{}'.format(fold + 1, error))
+        metrics_list.append(metrics)
+    if all(metrics is None for metrics in metrics_list):
+        raise RuntimeError('All {} bagging folds failed'.format(folds))
     return metrics_list
 
 
@@ -13,13 +13,15 @@
 # limitations under the License.
 
 
-import copy
 import time
 import tensorflow as tf
 from parlai.core.agents import Agent
 from . import config
 from .models import CorefModel
 from . import utils
+from ...utils import memory, tf_session
+from ...utils.example_cache import ExampleCache
+from ...utils.observation import keep_observation
 import parlai.core.build_data as build_data
 from os.path import join, isdir, isfile
 import os
@@ -127,6 +129,8 @@ class CoreferenceAgent(Agent):
         
         self.id = 'Coreference_Agent'
         self.episode_done = True
+        self.strict_observation_copy = opt.get('strict_observation_copy', False)
+        self.example_cache = ExampleCache(max_size=opt.get('example_cache_size'))
         super().__init__(opt, shared)
 
         if shared is not None:
@@ -142,8 +146,15 @@ class CoreferenceAgent(Agent):
         self.rep_iter = opt['rep_iter']
         self.nitr = opt['nitr']
         self.model = CorefModel(opt)
-        self.saver = tf.train.Saver()
-        if self.opt['pretrained_model']:
+        self.best_weights = None
+        # a frozen graph has no variables to save
+        self.saver = None
+        if self.model.frozen is None:
+            with tf_session.scope(self.model.sess):
+                self.saver = tf.train.Saver()
+        if self.model.frozen is not None:
+            print('[ Initializing model from frozen graph {0} ]'.format(opt['frozen_model']))
+        elif self.opt['pretrained_model']:
             print('[ Initializing model from checkpoint {0}]'.format(join(opt['model_file'],
                                                                           opt['language'], 'agent/logs', opt['name'])))
             self.model.init_from_saved(self.saver)
@@ -162,8 +173,12 @@ class CoreferenceAgent(Agent):
 
 
         """
-        self.observation = copy.deepcopy(observation)
-        self.obs_dict = utils.conll2modeldata(self.observation)
+        self.observation = keep_observation(observation, self.strict_observation_copy)
+        if self.observation['mode'] == 'train':
+            self.obs_dict = utils.conll2modeldata(self.observation)
+        else:
+            self.obs_dict = self.example_cache.get(self.observation['conll_str'], utils.conll2modeldata,
+                                                   self.observation)
         return self.obs_dict
 
     def act(self):
@@ -212,6 +227,30 @@ class CoreferenceAgent(Agent):
         utils.dict2conll(y, path)
         return None
 
+    def snapshot_weights(self):
+        """Keep current weights of the model in memory."""
+        self.best_weights = self.model.get_weights()
+
+    def restore_weights(self):
+        """Load weights kept by snapshot_weights into the model."""
+        if self.best_weights is not None:
+            self.model.set_weights(self.best_weights)
+
+    def memory_report(self):
+        """Memory held by the agent in megabytes, see deeppavlov.utils.memory."""
+        if self.model.frozen is not None:
+            network = self.model.frozen.nbytes()
+        else:
+            network = memory.graph_variables_bytes(self.model.sess.graph)
+        return memory.report({'example_cache': memory.nbytes(self.example_cache.examples),
+                              'model_example_cache': memory.nbytes(self.model.example_cache.examples),
+                              'network': network,
+                              'best_weights': memory.nbytes(self.best_weights)})
+
+    def export_frozen(self, path):
+        """Write the inference graph of the model as a frozen graph, see deeppavlov.utils.frozen_graph."""
+        self.model.export_frozen(path)
+
     def save(self):
         """Save model checkpoint"""
         self.model.save(self.saver)
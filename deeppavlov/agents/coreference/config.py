@@ -12,6 +12,8 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+from ...utils import frozen_graph, observation, tf_session
+
 
 def add_cmdline_args(parser):
     """
@@ -22,6 +24,10 @@ def add_cmdline_args(parser):
     Returns:
         nothing
     """
+    observation.add_cmdline_args(parser)
+    frozen_graph.add_cmdline_args(parser)
+    tf_session.add_cmdline_args(parser)
+
     # Runtime environment
     agent = parser.add_argument_group('Coreference Arguments')
 
@@ -20,6 +20,8 @@ import numpy as np
 import tensorflow as tf
 from . import utils
 from os.path import isdir, join
+from ...utils import bundle, checkpoint, frozen_graph, tf_session
+from ...utils.example_cache import ExampleCache
 
 tf.NotDifferentiable("Spans")
 tf.NotDifferentiable("Antecedents")
@@ -29,6 +31,10 @@ tf.NotDifferentiable("DistanceBins")
 seed = 5
 tf.set_random_seed(seed)
 
+# names of inputs of the model in the order of tensorize_example
+INPUT_NAMES = ['word_emb', 'char_index', 'text_len', 'speaker_ids', 'genre', 'is_training', 'gold_starts',
+               'gold_ends', 'cluster_ids']
+
 
 class CorefModel(object):
     """
@@ -40,10 +46,6 @@ class CorefModel(object):
         """Initialize the class and model according to the given parameters in opt."""
         self.opt = copy.deepcopy(opt)
 
-        tf.set_random_seed(opt['random_seed'])
-        config = tf.ConfigProto()
-        config.gpu_options.per_process_gpu_memory_fraction = 0.8
-        
         coref_op_library = tf.load_op_library(join(opt['model_file'], "coref_kernels.so"))
         self.spans = coref_op_library.spans
         self.distance_bins = coref_op_library.distance_bins
@@ -69,6 +71,7 @@ class CorefModel(object):
 
         self.max_mention_width = self.opt["max_mention_width"]
         self.genres = {g: i for i, g in enumerate(self.opt["genres"])}
+        self.example_cache = ExampleCache(max_size=self.opt.get('example_cache_size'))
 
         input_props = list()
         input_props.append((tf.float64, [None, None, self.embedding_size]))  # Text embeddings.
@@ -80,18 +83,34 @@ class CorefModel(object):
         input_props.append((tf.int32, [None]))  # Gold starts.
         input_props.append((tf.int32, [None]))  # Gold ends.
         input_props.append((tf.int32, [None]))  # Cluster ids.
+        self.input_props = input_props
+
+        self.frozen = None
+        if self.opt.get('frozen_model'):
+            # ops of coref_kernels used by the graph are loaded above
+            self.frozen = frozen_graph.FrozenGraph(self.opt['frozen_model'], self.opt, gpu_memory_fraction=0.8)
+            return
+
+        # the model is built in its own graph, so other agents of the process keep theirs
+        self.sess = tf_session.create_graph_session(self.opt, gpu_memory_fraction=0.8)
+        with tf_session.scope(self.sess):
+            tf.set_random_seed(opt['random_seed'])
+            self.build_train_graph()
+
+    def build_train_graph(self):
+        """
+        Build the network fed from the input queue, its optimizer, and initialize variables in the default graph.
 
-        self.queue_input_tensors = [tf.placeholder(dtype, shape) for dtype, shape in input_props]
-        dtypes, shapes = zip(*input_props)
+        Returns: Nothing
+
+        """
+        self.queue_input_tensors = [tf.placeholder(dtype, shape) for dtype, shape in self.input_props]
+        dtypes, shapes = zip(*self.input_props)
         queue = tf.PaddingFIFOQueue(capacity=1, dtypes=dtypes, shapes=shapes)
         self.enqueue_op = queue.enqueue(self.queue_input_tensors)
         self.input_tensors = queue.dequeue()
 
-        # train type trigger
-        if self.opt['train_on_gold']:
-            self.predictions, self.loss = self.get_predictions_and_loss_on_gold(*self.input_tensors)
-        else:
-            self.predictions, self.loss = self.get_predictions_and_loss(*self.input_tensors)
+        self.predictions, self.loss = self.build_predictions(self.input_tensors)
 
         self.global_step = tf.Variable(0, name="global_step", trainable=False)
         self.reset_global_step = tf.assign(self.global_step, 0)
@@ -99,8 +118,8 @@ class CorefModel(object):
                                                    self.opt["decay_frequency"], self.opt["decay_rate"],
                                                    staircase=True)
         
-        learning_rate = tf.cond(learning_rate < opt['final_rate'],
-                                lambda: tf.Variable(opt['final_rate'], tf.float32),
+        learning_rate = tf.cond(learning_rate < self.opt['final_rate'],
+                                lambda: tf.Variable(self.opt['final_rate'], tf.float32),
                                 lambda: learning_rate)
         
         trainable_params = tf.trainable_variables()
@@ -114,12 +133,39 @@ class CorefModel(object):
         }
         optimizer = optimizers[self.opt["optimizer"]](learning_rate)
         self.train_op = optimizer.apply_gradients(zip(gradients, trainable_params), global_step=self.global_step)
-        
-        self.sess = tf.Session(config=config)
 
         self.init_op = tf.global_variables_initializer()
         self.sess.run(self.init_op)
         
+    def build_predictions(self, input_tensors):
+        """
+        Connects the network to input tensors, using gold mentions if the model is trained on gold.
+        Args:
+            input_tensors: list of input tensors in the order of INPUT_NAMES, is_training may be a python bool
+
+        Returns: list of predictions and scores, and Loss function value
+
+        """
+        # train type trigger
+        if self.opt['train_on_gold']:
+            return self.get_predictions_and_loss_on_gold(*input_tensors)
+        return self.get_predictions_and_loss(*input_tensors)
+
+    @staticmethod
+    def keep_probability(is_training, dropout_rate):
+        """
+        Keep probability of dropout.
+        Args:
+            is_training: tf.bool tensor, or False to build the graph without dropout
+            dropout_rate: rate of dropout in training
+
+        Returns: tf.float64 tensor, or 1.0 for which tf.nn.dropout adds no ops
+
+        """
+        if is_training is False:
+            return 1.0
+        return 1 - (tf.cast(is_training, tf.float64) * dropout_rate)
+
     def start_enqueue_thread(self, train_example, is_training, returning=False):
         """
         Initialize queue of tensors that feed one at the input of the model.
@@ -548,8 +594,8 @@ class CorefModel(object):
                 antecedent_scores], loss
         List of predictions and scores, and Loss function value
         """
-        self.dropout = 1 - (tf.cast(is_training, tf.float64) * self.opt["dropout_rate"])
-        self.lexical_dropout = 1 - (tf.cast(is_training, tf.float64) * self.opt["lexical_dropout_rate"])
+        self.dropout = self.keep_probability(is_training, self.opt["dropout_rate"])
+        self.lexical_dropout = self.keep_probability(is_training, self.opt["lexical_dropout_rate"])
 
         num_sentences = tf.shape(word_emb)[0]
         max_sentence_length = tf.shape(word_emb)[1]
@@ -684,15 +730,66 @@ class CorefModel(object):
         """
         # checkpoint_path = join(self.log_root, self.opt['name'])
         checkpoint_path = self.opt['model_file']
-        if os.path.isfile(join(checkpoint_path, "model.max.ckpt.meta")):
+        weights = bundle.registered_weights(join(checkpoint_path, "model.max.ckpt"))
+        if weights is not None:
+            self.set_weights(weights)
+        elif os.path.isfile(join(checkpoint_path, "model.max.ckpt.meta")):
             saver.restore(self.sess, join(checkpoint_path, "model.max.ckpt"))
         else:
             print('{0} not found'.format(checkpoint_path))
             print('Init from scratch')
 
+    def get_weights(self):
+        """
+        Get values of all variables of the model.
+
+        Returns: list of numpy arrays
+
+        """
+        return self.sess.run(self.sess.graph.get_collection(tf.GraphKeys.GLOBAL_VARIABLES))
+
+    def set_weights(self, weights):
+        """
+        Load values into all variables of the model.
+        Args:
+            weights: list of numpy arrays returned by get_weights
+
+        Returns: Nothing
+
+        """
+        variables = self.sess.graph.get_collection(tf.GraphKeys.GLOBAL_VARIABLES)
+        for variable, value in zip(variables, weights):
+            variable.load(value, self.sess)
+
+    def export_frozen(self, path):
+        """
+        Write the prediction graph as a frozen graph. The graph is built again from placeholders instead of the
+        input queue, without dropout, and has no loss and optimizer.
+        Args:
+            path: path to the frozen graph
+
+        Returns: Nothing
+
+        """
+        variables = self.sess.graph.get_collection(tf.GraphKeys.GLOBAL_VARIABLES)
+        values = dict(zip([v.op.name for v in variables], self.sess.run(variables)))
+        graph = tf.Graph()
+        with graph.as_default():
+            inputs = [tf.placeholder(dtype, shape, name=name)
+                      for name, (dtype, shape) in zip(INPUT_NAMES, self.input_props)]
+            predictions, _ = self.build_predictions(inputs[:5] + [False] + inputs[6:])
+            with tf_session.create_session(self.opt, graph=graph, use_gpu=False) as sess:
+                for variable in graph.get_collection(tf.GraphKeys.GLOBAL_VARIABLES):
+                    variable.load(values[variable.op.name], sess)
+                frozen_graph.freeze(sess, list(zip(INPUT_NAMES, inputs)),
+                                    [('prediction_{}'.format(i), p) for i, p in enumerate(predictions)], path)
+
     def shutdown(self):
-        """Reset the model"""
-        tf.reset_default_graph()
+        """Close the session of the model"""
+        if self.frozen is not None:
+            self.frozen.close()
+        else:
+            self.sess.close()
 
     def save(self, saver):
         """Save model checkpoint"""
@@ -716,8 +813,10 @@ class CorefModel(object):
         #         saver.save(self.sess, join(log_dir, self.opt['name'], 'model.max.ckpt'))
 
         # save in root folder
-        print('saving path ' + join(self.opt['model_file'], 'model.max.ckpt'))
-        saver.save(self.sess, join(self.opt['model_file'], 'model.max.ckpt'))
+        path = join(self.opt['model_file'], 'model.max.ckpt')
+        print('saving path ' + path)
+        variables = checkpoint.tf_variables(self.sess, saver)
+        checkpoint.save(self.opt, path, lambda: checkpoint.write_tf_checkpoint(path, variables))
 
     def train(self, batch):
         """
@@ -728,6 +827,8 @@ class CorefModel(object):
         Returns: Loss functions value and tf.global_step
 
         """
+        if self.frozen is not None:
+            raise RuntimeError('model loaded from a frozen graph can not be trained')
         self.start_enqueue_thread(batch, True)
         self.tf_loss, tf_global_step, _ = self.sess.run([self.loss, self.global_step, self.train_op])
         return self.tf_loss, tf_global_step
@@ -742,13 +843,19 @@ class CorefModel(object):
         Returns: str with new conll document, with new coreference clusters
 
         """
-        self.start_enqueue_thread(batch, False)
+        # documents are tensorized once and reused on next validations
+        tensorized_example = self.example_cache.get(out_file['conll_str'], self.tensorize_example, batch, False)
+        if self.frozen is not None:
+            predictions = self.frozen.predict(dict(zip(INPUT_NAMES, tensorized_example)))
+        else:
+            self.sess.run(self.enqueue_op, feed_dict=dict(zip(self.queue_input_tensors, tensorized_example)))
+            predictions = self.sess.run(self.predictions)
 
         if self.opt['train_on_gold']:
-            _, mention_starts, mention_ends, antecedents, antecedent_scores = self.sess.run(self.predictions)
+            _, mention_starts, mention_ends, antecedents, antecedent_scores = predictions
 
         else:
-            _, _, _, mention_starts, mention_ends, antecedents, antecedent_scores = self.sess.run(self.predictions)
+            _, _, _, mention_starts, mention_ends, antecedents, antecedent_scores = predictions
 
         predicted_antecedents = self.get_predicted_antecedents(antecedents, antecedent_scores)
 
@@ -783,8 +890,8 @@ class CorefModel(object):
                 antecedent_scores], loss
         List of predictions and scores, and Loss function value
         """
-        self.dropout = 1 - (tf.cast(is_training, tf.float64) * self.opt["dropout_rate"])
-        self.lexical_dropout = 1 - (tf.cast(is_training, tf.float64) * self.opt["lexical_dropout_rate"])
+        self.dropout = self.keep_probability(is_training, self.opt["dropout_rate"])
+        self.lexical_dropout = self.keep_probability(is_training, self.opt["lexical_dropout_rate"])
 
         # assert gold_ends.shape == gold_starts.shape,\
         #     ('Amount of starts and ends of gold mentions are not equal: '
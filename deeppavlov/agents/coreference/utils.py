@@ -17,7 +17,8 @@ import numpy as np
 import collections
 import tensorflow as tf
 import operator
-import fasttext
+
+from ...utils import fasttext_mmap
 
 seed = 5
 np.random.seed(seed)
@@ -89,7 +90,7 @@ def load_embedding_dict(embedding_path, embedding_size, embedding_format):
                 embedding = np.array([float(s) for s in splits[1:]])
                 embedding_dict[word] = embedding
     elif embedding_format == 'bin':
-        embedding_dict = fasttext.load_model(embedding_path)
+        embedding_dict = fasttext_mmap.load_model(embedding_path)
     else:
         raise ValueError('Not supported embeddings format {}'.format(embedding_format))
     print("Done loading word embeddings.")
@@ -16,7 +16,6 @@
 import os
 from multiprocessing import Pool
 
-import fasttext
 import numpy as np
 import tensorflow as tf
 from parlai.core.agents import Agent
@@ -25,7 +24,11 @@ from tqdm import tqdm
 
 from . import utils
 from .model import MentionScorerModel
+from ...utils import checkpoint
 from ...utils import coreference_utils
+from ...utils import fasttext_mmap
+from ...utils import memory
+from ...utils import tf_session
 
 
 class EchoAgent(Agent):
@@ -54,6 +57,7 @@ class CoreferenceAgent(Agent):
     @staticmethod
     def add_cmdline_args(argparser):
         """parameters of agent"""
+        tf_session.add_cmdline_args(argparser)
         group = argparser.add_argument_group('Coreference Agent')
 
         group.add_argument('--batch_size', type=int, default=128, help='batch size')
@@ -118,7 +122,7 @@ class CoreferenceAgent(Agent):
 
         utils.download_embeddings(self.embeddings_url, self.embeddings_path)
 
-        self.embeddings = fasttext.load_model(self.embeddings_path)
+        self.embeddings = fasttext_mmap.load_model(self.embeddings_path)
 
         self.data = None
         self.data_valid = None
@@ -126,8 +130,6 @@ class CoreferenceAgent(Agent):
         # create model and batch_generator on first observe call
         self.model = None
         self.session = None
-        self.tf_config = tf.ConfigProto()
-        self.tf_config.gpu_options.allow_growth = True
         self.data_bg = None
         self.valid_bg = None
 
@@ -241,40 +243,62 @@ class CoreferenceAgent(Agent):
 
         # create model
         if self.model is None:
-            tf.reset_default_graph()
-            self.model = MentionScorerModel(hidden_size=self.opt['dense_hidden_size'], lr=self.opt['lr'],
-                                            keep_prob_input=self.opt['keep_prob_input'],
-                                            keep_prob_dense=self.opt['keep_prob_dense'],
-                                            features_size=self.valid_bg.dl.features_size)
-            self.session = tf.Session(config=self.tf_config)
-            tf.global_variables_initializer().run(session=self.session)
+            # the model is built in its own graph, so other agents of the process keep theirs
+            self.session = tf_session.create_graph_session(self.opt, allow_growth=True)
+            with tf_session.scope(self.session):
+                self.model = MentionScorerModel(hidden_size=self.opt['dense_hidden_size'], lr=self.opt['lr'],
+                                                keep_prob_input=self.opt['keep_prob_input'],
+                                                keep_prob_dense=self.opt['keep_prob_dense'],
+                                                features_size=self.valid_bg.dl.features_size)
+                tf.global_variables_initializer().run(session=self.session)
             if self.opt['pretrained_model'] != '':
                 checkpoint = tf.train.latest_checkpoint(self.opt['pretrained_model'])
                 print('Initializing model from checkpoint: {}'.format(checkpoint))
-                saver = tf.train.Saver()
+                with tf_session.scope(self.session):
+                    saver = tf.train.Saver()
                 # print('Loading from:', checkpoint)
                 saver.restore(self.session, checkpoint)
                 with open(os.path.join(self.agent_dir, 'threshold'), 'r') as fin:
                     self.best_threshold = float(fin.readline().strip())
                     self.best_conll_f1 = float(fin.readline().strip().split()[-1])
 
+    def memory_report(self):
+        """memory held by the agent in megabytes, see deeppavlov.utils.memory"""
+        parts = {'embeddings': memory.nbytes(self.embeddings),
+                 'train_features': memory.nbytes(self.data_bg),
+                 'valid_features': memory.nbytes(self.valid_bg)}
+        for name in ['data', 'data_smpl', 'data_emb', 'data_valid', 'data_valid_smpl', 'data_valid_emb']:
+            parts[name] = memory.nbytes(getattr(self, name, None))
+        if self.session is not None:
+            parts['network'] = memory.graph_variables_bytes(self.session.graph)
+        return memory.report(parts)
+
     def save(self):
         """saves model and current best threshold"""
         if self.session is not None:
-            saver = tf.train.Saver()
-            saver.save(self.session, os.path.join(self.agent_dir, 'model'))
-            with open(os.path.join(self.agent_dir, 'threshold'), 'w') as fout:
-                fout.write('{}\n'.format(self.best_threshold))
-                fout.write('conll-f-1: {:.5f}\n'.format(self.best_conll_f1))
+            with tf_session.scope(self.session):
+                saver = tf.train.Saver()
+            path = os.path.join(self.agent_dir, 'model')
+            variables = checkpoint.tf_variables(self.session, saver)
+            threshold = '{}\nconll-f-1: {:.5f}\n'.format(self.best_threshold, self.best_conll_f1)
+
+            def write():
+                checkpoint.write_tf_checkpoint(path, variables)
+                with checkpoint.atomic_file(os.path.join(self.agent_dir, 'threshold')) as fout:
+                    fout.write(threshold)
+
+            checkpoint.save(self.opt, path, write)
 
     def shutdown(self):
         """free resources"""
-        tf.reset_default_graph()
+        if self.session is not None:
+            self.session.close()
 
     def _train_scorer(self):
         """trains scorer model on observation"""
         summary_writer = tf.summary.FileWriter(self.run_path, graph=self.session.graph)
-        saver = tf.train.Saver(max_to_keep=None)
+        with tf_session.scope(self.session):
+            saver = tf.train.Saver(max_to_keep=None)
 
         while self.data_bg.epoch < self.inner_epochs:
             A, A_f, B, B_f, AB_f, C = self.data_bg.get_batch(self.batch_size)
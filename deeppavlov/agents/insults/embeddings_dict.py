@@ -15,9 +15,9 @@
 
 import os
 import copy
-import numpy as np
 import urllib.request
-import fasttext
+
+from ...utils import embeddings_store, fasttext_mmap
 
 
 class EmbeddingsDict(object):
@@ -33,7 +33,6 @@ class EmbeddingsDict(object):
     """
     def __init__(self, opt, embedding_dim):
         """Initialize the class according to given parameters."""
-        self.tok2emb = {}
         self.embedding_dim = embedding_dim
         self.opt = copy.deepcopy(opt)
         self.load_items()
@@ -53,7 +52,7 @@ class EmbeddingsDict(object):
                 print('Downloaded a fasttext model')
             except Exception as e:
                 raise RuntimeError('Looks like the `EMBEDDINGS_URL` variable is set incorrectly', e)
-        self.fasttext_model = fasttext.load_model(self.fasttext_model_file)
+        self.fasttext_model = fasttext_mmap.load_model(self.fasttext_model_file)
 
     def add_items(self, sentence_li):
         """Add new items to tok2emb dictionary from given text."""
@@ -66,19 +65,16 @@ class EmbeddingsDict(object):
 
     def save_items(self, fname):
         """Save dictionary tok2emb to file."""
+        self.items_saver(fname)()
+
+    def items_saver(self, fname):
+        """Snapshot the dictionary tok2emb, return a function saving the snapshot to the file."""
         if self.opt.get('fasttext_embeddings_dict') is not None:
             fname = self.opt['fasttext_embeddings_dict']
         else:
             fname += '.emb'
-        f = open(fname, 'w')
-        string = '\n'.join([el[0] + ' ' + self.emb2str(el[1]) for el in self.tok2emb.items()])
-        f.write(string)
-        f.close()
-
-    def emb2str(self, vec):
-        """Return string corresponding to the given embedding vectors"""
-        string = ' '.join([str(el) for el in vec])
-        return string
+        tok2emb = self.tok2emb.snapshot()
+        return lambda: tok2emb.save(fname)
 
     def load_items(self):
         """Initialize embeddings from file."""
@@ -90,14 +86,9 @@ class EmbeddingsDict(object):
         elif self.opt.get('model_file') is not None:
             fname = self.opt['model_file']+'.emb'
 
-        if fname is None or not os.path.isfile(fname):
+        if fname is None or not embeddings_store.exists(fname):
             print('There is no %s file provided. Initializing new dictionary.' % fname)
+            self.tok2emb = embeddings_store.EmbeddingsStore()
         else:
             print('Loading existing dictionary from %s.' % fname)
-            with open(fname, 'r') as f:
-                for line in f:
-                    values = line.rsplit(sep=' ', maxsplit=self.embedding_dim)
-                    assert(len(values) == self.embedding_dim + 1)
-                    word = values[0]
-                    coefs = np.asarray(values[1:], dtype='float32')
-                    self.tok2emb[word] = coefs
+            self.tok2emb = embeddings_store.load(fname, self.embedding_dim)
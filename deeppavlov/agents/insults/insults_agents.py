@@ -19,6 +19,8 @@ from . import config
 from .model import InsultsModel
 from .utils import create_vectorizer_selector, get_vectorizer_selector
 from .embeddings_dict import EmbeddingsDict
+from ...utils import memory
+from ...utils.observation import join_episode_text
 
 
 class EnsembleInsultsAgent(Agent):
@@ -55,10 +57,13 @@ class EnsembleInsultsAgent(Agent):
         """Initialize the class according to the given parameters in opt."""
         self.id = 'InsultsAgent'
         self.episode_done = True
+        self.strict_observation_copy = opt.get('strict_observation_copy', False)
         super().__init__(opt, shared)
         if shared is not None:
             self.is_shared = True
             return
+        if opt.get('frozen_model'):
+            raise ValueError('--frozen-model is not supported by ensembles, every model would load the same graph')
         # Set up params/logging/dicts
         self.is_shared = False
 
@@ -87,12 +92,10 @@ class EnsembleInsultsAgent(Agent):
 
     def observe(self, observation):
         """Gather obtained observation (sample) with previous observations."""
-        observation = copy.deepcopy(observation)
-        if not self.episode_done:
-            # if the last example wasn't the end of an episode, then we need to
-            # recall what was said in that example
-            prev_dialogue = self.observation['text']
-            observation['text'] = prev_dialogue + '\n' + observation['text']
+        # if the last example wasn't the end of an episode, then we need to
+        # recall what was said in that example
+        prev_observation = None if self.episode_done else self.observation
+        observation = join_episode_text(observation, prev_observation, strict=self.strict_observation_copy)
         self.observation = observation
         self.episode_done = observation['episode_done']
         return observation
@@ -157,6 +160,12 @@ class EnsembleInsultsAgent(Agent):
         result = result / sum(self.model_coefs)
         return result
 
+    def shutdown(self):
+        """Close sessions of the models."""
+        if not self.is_shared:
+            for model in self.models:
+                model.shutdown()
+
 
 class BoostEnsembleInsultsAgent(Agent):
     """BoostEnsembleInsultsAgent
@@ -192,10 +201,13 @@ class BoostEnsembleInsultsAgent(Agent):
         """Initialize the class according to the given parameters in opt."""
         self.id = 'InsultsAgent'
         self.episode_done = True
+        self.strict_observation_copy = opt.get('strict_observation_copy', False)
         super().__init__(opt, shared)
         if shared is not None:
             self.is_shared = True
             return
+        if opt.get('frozen_model'):
+            raise ValueError('--frozen-model is not supported by ensembles, every model would load the same graph')
         # Set up params/logging/dicts
         self.is_shared = False
 
@@ -224,12 +236,10 @@ class BoostEnsembleInsultsAgent(Agent):
 
     def observe(self, observation):
         """Gather obtained observation (sample) with previous observations."""
-        observation = copy.deepcopy(observation)
-        if not self.episode_done:
-            # if the last example wasn't the end of an episode, then we need to
-            # recall what was said in that example
-            prev_dialogue = self.observation['text']
-            observation['text'] = prev_dialogue + '\n' + observation['text']
+        # if the last example wasn't the end of an episode, then we need to
+        # recall what was said in that example
+        prev_observation = None if self.episode_done else self.observation
+        observation = join_episode_text(observation, prev_observation, strict=self.strict_observation_copy)
         self.observation = observation
         self.episode_done = observation['episode_done']
         return observation
@@ -294,6 +304,12 @@ class BoostEnsembleInsultsAgent(Agent):
         result = result / sum(self.model_coefs)
         return result
 
+    def shutdown(self):
+        """Close sessions of the models."""
+        if not self.is_shared:
+            for model in self.models:
+                model.shutdown()
+
 
 class InsultsAgent(Agent):
     """insultsAgent
@@ -322,6 +338,7 @@ class InsultsAgent(Agent):
         """Initialize the class according to given parameters from opt."""
         self.id = 'InsultsAgent'
         self.episode_done = True
+        self.strict_observation_copy = opt.get('strict_observation_copy', False)
         super().__init__(opt, shared)
         if shared is not None:
             self.is_shared = True
@@ -342,6 +359,7 @@ class InsultsAgent(Agent):
 
         print('create model', self.model_name)
         self.model = InsultsModel(self.model_name, self.word_dict, embedding_dict, opt)
+        self.best_weights = None
         self.n_examples = 0
 
         if (self.model.from_saved == True and self.model.model_type == 'ngrams'):
@@ -350,12 +368,10 @@ class InsultsAgent(Agent):
 
     def observe(self, observation):
         """Gather obtained observation (sample) with previous observations."""
-        observation = copy.deepcopy(observation)
-        if not self.episode_done:
-            # if the last example wasn't the end of an episode, then we need to
-            # recall what was said in that example
-            prev_dialogue = self.observation['text']
-            observation['text'] = prev_dialogue + '\n' + observation['text']
+        # if the last example wasn't the end of an episode, then we need to
+        # recall what was said in that example
+        prev_observation = None if self.episode_done else self.observation
+        observation = join_episode_text(observation, prev_observation, strict=self.strict_observation_copy)
         self.observation = observation
         self.episode_done = observation['episode_done']
         return observation
@@ -364,33 +380,41 @@ class InsultsAgent(Agent):
         """Call batch act with batch of one sample."""
         return self.batch_act([self.observation])[0]
 
-    def batch_act(self, observations):
-        """Train model or predict for given batch of observations."""
+    def prepare_batch(self, observations):
+        """Build a batch of model inputs for given observations.
+
+        Returns:
+            indices of valid observations and the batch
+        """
+        examples = [self._build_ex(obs) for obs in observations]
+        valid_inds = [i for i in range(len(observations)) if examples[i] is not None]
+        examples = [ex for ex in examples if ex is not None]
+        return valid_inds, self.model._batchify(examples)
+
+    def batch_act(self, observations, batch=None):
+        """Train model or predict for given batch of observations.
+
+        Args:
+            observations: batch of observations
+            batch: result of prepare_batch for the observations, computed if None
+        """
         if self.is_shared:
             raise RuntimeError("Parallel act is not supported.")
 
         batch_size = len(observations)
         # initialize a table of replies with this agent's id
         batch_reply = [{'id': self.getID()} for _ in range(batch_size)]
-        examples = [self._build_ex(obs) for obs in observations]
-        valid_inds = [i for i in range(batch_size) if examples[i] is not None]
-        examples = [ex for ex in examples if ex is not None]
+        valid_inds, batch = self.prepare_batch(observations) if batch is None else batch
 
         if 'labels' in observations[0]:
-            self.n_examples += len(examples)
-            batch = self.model._batchify(examples)
+            self.n_examples += len(valid_inds)
             predictions = self.model.update(batch)
-            predictions_text = self._predictions2text(predictions)
-            for i in range(len(predictions)):
-                batch_reply[valid_inds[i]]['text'] = predictions_text[i]
-                batch_reply[valid_inds[i]]['score'] = predictions[i]
         else:
-            batch = self.model._batchify(examples)
             predictions = self.model.predict(batch)
-            predictions_text = self._predictions2text(predictions)
-            for i in range(len(predictions)):
-                batch_reply[valid_inds[i]]['text'] = predictions_text[i]
-                batch_reply[valid_inds[i]]['score'] = predictions[i]
+        predictions_text = self._predictions2text(predictions)
+        for i in range(len(predictions)):
+            batch_reply[valid_inds[i]]['text'] = predictions_text[i]
+            batch_reply[valid_inds[i]]['score'] = predictions[i]
 
         return batch_reply
 
@@ -425,10 +449,51 @@ class InsultsAgent(Agent):
         report['auc'] = self.model.train_auc
         return report
 
+    def memory_report(self):
+        """Memory held by the agent in megabytes, see deeppavlov.utils.memory."""
+        parts = {'example_cache': memory.nbytes(self.model.example_cache.examples),
+                 'batch_buffers': memory.nbytes(self.model.batch_buffers.storage),
+                 'best_weights': memory.nbytes(self.best_weights)}
+        if self.model.model_type == 'nn':
+            tok2emb = self.model.embedding_dict.tok2emb
+            parts['embeddings_added'] = memory.nbytes(tok2emb.added)
+            parts['embeddings_index'] = memory.nbytes(tok2emb.index)
+            parts['embeddings_mapped'] = memory.mapped_bytes(tok2emb.matrix)
+            if self.model.frozen is not None:
+                parts['network'] = self.model.frozen.nbytes()
+            else:
+                parts['network'] = memory.variables_bytes(self.model.model.weights)
+        return memory.report(parts)
+
+    def export_frozen(self, path):
+        """Write the inference graph of the model as a frozen graph, see deeppavlov.utils.frozen_graph."""
+        self.model.export_frozen(path)
+
     def save(self):
         """Save trained model."""
         self.model.save()
 
+    def snapshot_weights(self):
+        """Keep current weights (fitted estimator for sklearn models) in memory."""
+        if self.model.model_type == 'nn':
+            self.best_weights = self.model.get_weights()
+        else:
+            self.best_weights = copy.deepcopy(self.model.model)
+
+    def restore_weights(self):
+        """Load weights kept by snapshot_weights into the model."""
+        if self.best_weights is None:
+            return
+        if self.model.model_type == 'nn':
+            self.model.set_weights(self.best_weights)
+        else:
+            self.model.model = copy.deepcopy(self.best_weights)
+
+    def shutdown(self):
+        """Close the session of the model."""
+        if not self.is_shared:
+            self.model.shutdown()
+
 
 class OneEpochAgent(InsultsAgent):
     """OneEpochAgent
@@ -449,7 +514,11 @@ class OneEpochAgent(InsultsAgent):
         self.observation = ''
         self.observations_ = []
 
-    def batch_act(self, observations):
+    def prepare_batch(self, observations):
+        """Train observations are only collected, nothing to prepare."""
+        return None
+
+    def batch_act(self, observations, batch=None):
         """Collect train observations, do not train."""
         self.observations_ += observations
 
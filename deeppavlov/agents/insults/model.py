@@ -14,12 +14,6 @@
 
 
 import tensorflow as tf
-from keras.backend.tensorflow_backend import set_session
-config = tf.ConfigProto()
-#config.gpu_options.per_process_gpu_memory_fraction = 0.95
-config.gpu_options.allow_growth=True
-config.gpu_options.visible_device_list = '0'
-set_session(tf.Session(config=config))
 
 from .metrics import roc_auc_score
 import os
@@ -46,6 +40,9 @@ import pickle
 from .utils import vectorize_select_from_data
 
 from .embeddings_dict import EmbeddingsDict
+from ...utils import bundle, checkpoint, frozen_graph, keras_train, tf_session
+from ...utils.batch_buffers import BatchBuffers
+from ...utils.example_cache import ExampleCache
 
 SEED = 23
 np.random.seed(SEED)
@@ -77,6 +74,8 @@ class InsultsModel(object):
         valid_acc: accuracy on validation batch
         valid_auc: AUC-ROC on validation batch
         model: chosen model to fit
+        frozen: frozen inference graph used instead of the model (for nn models)
+        example_cache: embedded examples without labels (for nn models)
     """
 
     def __init__(self, model_name, word_index, embedding_dict, opt):
@@ -88,8 +87,13 @@ class InsultsModel(object):
         self.pool_sizes = [int(x) for x in opt['pool_sizes_cnn'].split(' ')]
         self.model_type = None
         self.from_saved = False
+        self.example_cache = ExampleCache(max_size=opt.get('example_cache_size'))
+        self.batch_buffers = BatchBuffers()
+        # keras ops of the model, also of metrics of ngrams models, are in its own graph
+        self.sess = tf_session.create_keras_session(self.opt, allow_growth=True)
         np.random.seed(opt['model_seed'])
-        tf.set_random_seed(opt['model_seed'])
+        with tf_session.scope(self.sess):
+            tf.set_random_seed(opt['model_seed'])
 
         if self.model_name == 'cnn_word' or self.model_name == 'lstm_word':
             self.model_type = 'nn'
@@ -101,7 +105,16 @@ class InsultsModel(object):
             self.vectorizers = None
             self.selectors = None
 
-        if self.opt.get('model_file') and \
+        self.frozen = None
+        if self.opt.get('frozen_model'):
+            if self.model_type != 'nn':
+                raise ValueError('frozen graphs are exported for neural models only')
+            print('[ Initializing model from frozen graph ]')
+            self.model = None
+            self.frozen = frozen_graph.FrozenGraph(self.opt['frozen_model'], self.opt, allow_growth=True)
+            # inputs are padded as in the trained model
+            self.opt.update(self.frozen.params)
+        elif self.opt.get('model_file') and \
                 ( (os.path.isfile(opt['model_file'] + '.h5') and self.model_type == 'nn')
                  or (os.path.isfile(opt['model_file'] + '_opt.json') and
                      os.path.isfile(opt['model_file'] + '_cls.pkl') and
@@ -115,15 +128,18 @@ class InsultsModel(object):
                              self.model_type == 'ngrams') ):
             print('[Initializing model from saved]')
             self.from_saved = True
-            self._init_from_saved(opt['model_file'])
+            with tf_session.scope(self.sess):
+                self._init_from_saved(opt['model_file'])
         else:
             if self.opt.get('pretrained_model'):
                 print('[Initializing model from pretrained]')
                 self.from_saved = True
-                self._init_from_saved(opt['pretrained_model'])
+                with tf_session.scope(self.sess):
+                    self._init_from_saved(opt['pretrained_model'])
             else:
                 print('[ Initializing model from scratch ]')
-                self._init_from_scratch()
+                with tf_session.scope(self.sess):
+                    self._init_from_scratch()
 
         self.opt['cuda'] = not self.opt['no_cuda']
 
@@ -157,18 +173,28 @@ class InsultsModel(object):
         fname = self.opt.get('model_file', None) if fname is None else fname
 
         if fname:
+            print("[ saving model: " + fname + " ]")
+            # snapshot everything on this thread, write files in the background
+            writes = []
             if self.model_type == 'nn':
-                print("[ saving model: " + fname + " ]")
-                self.model.save_weights(fname + '.h5')
-                self.embedding_dict.save_items(fname)
+                with tf_session.scope(self.sess):
+                    weights = checkpoint.keras_weights(self.model)
+                writes.append(lambda: checkpoint.write_keras_weights(fname + '.h5', weights))
+                writes.append(self.embedding_dict.items_saver(fname))
 
             if self.model_type == 'ngrams':
-                print("[ saving model: " + fname + " ]")
-                with open(fname + '_cls.pkl', 'wb') as model_file:
-                    pickle.dump(self.model, model_file)
+                model_data = pickle.dumps(self.model)
+                writes.append(lambda: checkpoint.write_bytes(fname + '_cls.pkl', model_data))
 
-            with open(fname + '_opt.json', 'w') as opt_file:
-                json.dump(self.opt, opt_file)
+            opt = copy.deepcopy(self.opt)
+
+            def write():
+                for w in writes:
+                    w()
+                with checkpoint.atomic_file(fname + '_opt.json') as opt_file:
+                    json.dump(opt, opt_file)
+
+            checkpoint.save(self.opt, fname, write)
 
     def _init_from_saved(self, fname):
 
@@ -186,7 +212,7 @@ class InsultsModel(object):
                                optimizer=optimizer,
                                metrics=['binary_accuracy'])
             print('[ Loading model weights %s ]' % fname)
-            self.model.load_weights(fname + '.h5')
+            bundle.restore_keras_weights(self.model, fname + '.h5')
 
         if self.model_type == 'ngrams':
             with open(fname + '_cls.pkl', 'rb') as model_file:
@@ -217,14 +243,15 @@ class InsultsModel(object):
             question = []
             for ex in batch:
                 question.append(ex['question'])
-            self.embedding_dict.add_items(question)
-            embedding_batch = self.create_batch(question)
 
             if len(batch[0]) == 2:
+                self.embedding_dict.add_items(question)
+                embedding_batch = self.create_batch(question)
                 y = [1 if ex['labels'][0] == 'Insult' else 0 for ex in batch]
                 return embedding_batch, y
             else:
-                return embedding_batch
+                return self.batch_buffers.stack('x', [self.example_cache.get(sen, self._embed_sentence, sen)
+                                                      for sen in question])
 
         if self.model_type == 'ngrams':
             question = []
@@ -237,57 +264,84 @@ class InsultsModel(object):
             else:
                 return question
 
-    def create_batch(self, sentence_li):
-        embeddings_batch = []
-        for sen in sentence_li:
-            embeddings = []
+    def _embed_sentence(self, sen):
+        self.embedding_dict.add_items([sen])
+        return self.create_batch([sen], 'sentence')[0].copy()
+
+    def create_batch(self, sentence_li, buffer_name='x'):
+        max_len = self.opt['max_sequence_length']
+        embeddings_batch = self.batch_buffers.get(buffer_name, (len(sentence_li), max_len, self.opt['embedding_dim']))
+        for i, sen in enumerate(sentence_li):
             tokens = sen.split(' ')
             tokens = [el for el in tokens if el != '']
-            if len(tokens) > self.opt['max_sequence_length']:
-                tokens = tokens[:self.opt['max_sequence_length']]
-            for tok in tokens:
-                embeddings.append(self.embedding_dict.tok2emb.get(tok))
-            if len(tokens) < self.opt['max_sequence_length']:
-                pads = [np.zeros(self.opt['embedding_dim'])
-                        for _ in range(self.opt['max_sequence_length'] - len(tokens))]
-                embeddings = pads + embeddings
-            embeddings = np.asarray(embeddings)
-            embeddings_batch.append(embeddings)
-        embeddings_batch = np.asarray(embeddings_batch)
+            if len(tokens) > max_len:
+                tokens = tokens[:max_len]
+            # sentences are padded from the left
+            for j, tok in enumerate(tokens, max_len - len(tokens)):
+                embeddings_batch[i, j] = self.embedding_dict.tok2emb.get(tok)
         return embeddings_batch
 
     def update(self, batch):
         x, y = batch
         y = np.array(y)
         y_pred = None
+        if self.frozen is not None:
+            raise RuntimeError('model loaded from a frozen graph can not be trained')
 
         if self.model_type == 'nn':
-            self.train_loss, self.train_acc = self.model.train_on_batch(x, y)
-            y_pred = self.model.predict_on_batch(x).reshape(-1)
+            with tf_session.scope(self.sess):
+                (self.train_loss, self.train_acc), (y_pred,) = \
+                    keras_train.train_on_batch_with_predictions(self.model, x, y)
+            y_pred = y_pred.reshape(-1)
             self.train_auc = roc_auc_score(y, y_pred)
 
         if self.model_type == 'ngrams':
             x = vectorize_select_from_data(x, self.vectorizers, self.selectors)
             self.model.fit(x, y.reshape(-1))
             y_pred = np.array(self.model.predict_proba(x)[:,1]).reshape(-1)
-            y_pred_tensor = K.constant(y_pred, dtype='float64')
-            self.train_loss = K.eval(binary_crossentropy(y.astype('float'), y_pred_tensor))
-            self.train_acc = K.eval(binary_accuracy(y.astype('float'), y_pred_tensor))
+            with tf_session.scope(self.sess):
+                y_pred_tensor = K.constant(y_pred, dtype='float64')
+                self.train_loss = K.eval(binary_crossentropy(y.astype('float'), y_pred_tensor))
+                self.train_acc = K.eval(binary_accuracy(y.astype('float'), y_pred_tensor))
             self.train_auc = roc_auc_score(y, y_pred)
         self.updates += 1
         return y_pred
 
     def predict(self, batch):
+        if self.frozen is not None:
+            return np.array(self.frozen.predict([batch])[0]).reshape(-1)
         if self.model_type == 'nn':
-            y_pred = np.array(self.model.predict_on_batch(batch)).reshape(-1)
+            with tf_session.scope(self.sess):
+                y_pred = np.array(self.model.predict_on_batch(batch)).reshape(-1)
             return y_pred
         if self.model_type == 'ngrams':
             x = vectorize_select_from_data(batch, self.vectorizers, self.selectors)
             predictions = np.array(self.model.predict_proba(x)[:,1]).reshape(-1)
             return predictions
 
+    def export_frozen(self, path):
+        """Write the network rebuilt for inference as a frozen graph."""
+        if self.model_type != 'nn':
+            raise RuntimeError('{} model can not be exported as a frozen graph'.format(self.model_name))
+        build_model = self.cnn_word_model if self.model_name == 'cnn_word' else self.lstm_word_model
+        params = {key: self.opt[key] for key in ('max_sequence_length', 'embedding_dim')}
+        frozen_graph.export_keras(build_model, self.get_weights(), path, self.opt, params)
+
+    def get_weights(self):
+        """Get values of weights of a neural model."""
+        with tf_session.scope(self.sess):
+            return self.model.get_weights()
+
+    def set_weights(self, weights):
+        """Load values returned by get_weights into weights of a neural model."""
+        with tf_session.scope(self.sess):
+            self.model.set_weights(weights)
+
     def shutdown(self):
         self.embedding_dict = None
+        if self.frozen is not None:
+            self.frozen.close()
+        self.sess.close()
 
     def log_reg_model(self):
         model = linear_model.LogisticRegression(C=10.)
@@ -12,9 +12,15 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+from ...utils import frozen_graph, observation, tf_session
+
 
 def add_cmdline_args(parser):
     """Add command line arguments for NER model"""
+    observation.add_cmdline_args(parser)
+    frozen_graph.add_cmdline_args(parser)
+    tf_session.add_cmdline_args(parser)
+
     # Runtime environment
     agent = parser.add_argument_group('NER Agent Arguments')
     agent.add_argument('--pretrained-model', type=str)
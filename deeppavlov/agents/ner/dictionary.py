@@ -20,6 +20,8 @@ from collections import defaultdict
 from parlai.core.dict import DictionaryAgent
 from parlai.core.params import class2str
 
+from ...utils.observation import copy_observation
+
 
 def get_char_dict():
     """Create character dict from predefined set of characters
@@ -64,8 +66,9 @@ class NERDictionaryAgent(DictionaryAgent):
 
     def observe(self, observation):
         """Get the data from the observation"""
-        observation = copy.deepcopy(observation)
-        labels_observation = copy.deepcopy(observation)
+        strict = self.opt.get('strict_observation_copy', False)
+        labels_observation = copy_observation(observation, strict)
+        observation = copy_observation(observation, strict)
         labels_observation['text'] = None
         observation['labels'] = None
         self.labels_dict.observe(labels_observation)
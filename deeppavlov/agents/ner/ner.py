@@ -13,7 +13,6 @@
 # limitations under the License.
 
 
-import copy
 import numpy as np
 from parlai.core.agents import Agent
 
@@ -21,6 +20,10 @@ from . import config
 from .dictionary import NERDictionaryAgent
 from .ner_tagger import NERTagger
 from .dictionary import get_char_dict
+from ...utils import memory
+from ...utils.batch_buffers import BatchBuffers
+from ...utils.example_cache import ExampleCache
+from ...utils.observation import copy_observation, keep_observation
 
 
 CHAR_DICT = get_char_dict()
@@ -45,6 +48,7 @@ class NERAgent(Agent):
         self.id = 'NERAgent'
         self.episode_done = True
         self.loss = None
+        self.strict_observation_copy = opt.get('strict_observation_copy', False)
 
         # Only create an empty dummy class when sharing
         if shared is not None:
@@ -53,16 +57,21 @@ class NERAgent(Agent):
         self.is_shared = False
         self.word_dict = NERAgent.dictionary_class()(opt)
         self.network = NERTagger(opt, self.word_dict)
+        self.example_cache = ExampleCache(max_size=opt.get('example_cache_size'))
+        self.batch_buffers = BatchBuffers()
+        self.best_weights = None
 
         super().__init__(opt, shared)
 
     def observe(self, observation):
         """Observe the data from the teacher"""
-        observation = copy.deepcopy(observation)
         if not self.episode_done:
+            observation = copy_observation(observation, self.strict_observation_copy)
             dialogue = self.observation['text'].split(' ')[:-1]
             dialogue.extend(observation['text'].split(' '))
             observation['text'] = ' '.join(dialogue)
+        else:
+            observation = keep_observation(observation, self.strict_observation_copy)
         self.observation = observation
         self.episode_done = observation['episode_done']
         return observation
@@ -71,11 +80,16 @@ class NERAgent(Agent):
         """Perform action on the observations"""
         return self.batch_act([self.observation])[0]
 
-    def batch_act(self, observations):
+    def prepare_batch(self, observations):
+        """Create numpy ndarray from the given observations, see batchify"""
+        return self.batchify(observations)
+
+    def batch_act(self, observations, batch=None):
         """Perform action on observations
 
         Args:
             observations: batch of observations
+            batch: result of prepare_batch for the observations, computed if None
 
         Returns:
             batch_response: predicted tags for observatoins
@@ -83,12 +97,12 @@ class NERAgent(Agent):
         if self.is_shared:
             raise RuntimeError("Parallel act is not supported.")
 
-        batch = self.batchify(observations)
+        if batch is None:
+            batch = self.prepare_batch(observations)
         (x, xc), y = batch
         if 'labels' in observations[0]:
-
-            self.loss = self.network.train_on_batch(x, xc, y)
-            responses = self.network.predict(x, xc)
+            # tags predicted before the update are returned by the train step itself
+            self.loss, responses = self.network.train_on_batch(x, xc, y, return_predictions=True)
         else:
             responses = self.network.predict(x, xc)
 
@@ -121,33 +135,73 @@ class NERAgent(Agent):
             if 'text' in observation:
                 text = observation['text']
 
-                current_char_list = []
-                tokens = text.split()
-                for token in tokens:
-                    characters = [self.word_dict.char_dict[ch] for ch in token]
-                    current_char_list.append(characters)
-                    max_len_char = max(max_len_char, len(token))
+                if 'labels' in observation:
+                    tokens, current_char_list = self.text2ids(text)
+                else:
+                    tokens, current_char_list = self.example_cache.get(text, self.text2ids, text)
+                for characters in current_char_list:
+                    max_len_char = max(max_len_char, len(characters))
                 x_char_list.append(current_char_list)
 
-                tokens = self.word_dict.txt2vec(text)
                 tags = self.word_dict.labels_dict.txt2vec(observation['labels'][0]) if 'labels' in observation else None
                 max_len = max(len(tokens), max_len)
                 x_list.append(tokens)
                 y_list.append(tags)
         # Handle the case of incomplete batch in the end of the dataset
         current_batch_size = len(x_list)
-        x = np.ones([current_batch_size, max_len]) * self.word_dict[self.word_dict.null_token]
-        xc = np.ones([current_batch_size, max_len, max_len_char]) * CHAR_DICT['<PAD>']
-        y = np.ones([current_batch_size, max_len]) * self.word_dict.labels_dict[self.word_dict.labels_dict.null_token]
+        x = self.batch_buffers.get('x', [current_batch_size, max_len], np.int32,
+                                   self.word_dict[self.word_dict.null_token])
+        xc = self.batch_buffers.get('xc', [current_batch_size, max_len, max_len_char], np.int32, CHAR_DICT['<PAD>'])
+        y = self.batch_buffers.get('y', [current_batch_size, max_len], np.int32,
+                                   self.word_dict.labels_dict[self.word_dict.labels_dict.null_token])
 
         for n, (x_item, x_char, y_item) in enumerate(zip(x_list, x_char_list, y_list)):
             n_tokens = len(x_item)
             x[n, :n_tokens] = x_item
-            y[n, :n_tokens] = y_item
+            if y_item is not None:
+                y[n, :n_tokens] = y_item
             for k, characters in enumerate(x_char):
                 xc[n, k, :len(characters)] = characters
         return (x, xc), y
 
+    def text2ids(self, text):
+        """Convert text to indices of tokens and characters
+
+        Args:
+            text: space separated tokens
+
+        Returns:
+            tokens - list of token indices
+            characters - list of lists of character indices for every token
+        """
+        characters = [[self.word_dict.char_dict[ch] for ch in token] for token in text.split()]
+        return self.word_dict.txt2vec(text), characters
+
+    def snapshot_weights(self):
+        """Keep current weights of the network in memory"""
+        self.best_weights = self.network.get_weights()
+
+    def restore_weights(self):
+        """Load weights kept by snapshot_weights into the network"""
+        if self.best_weights is not None:
+            self.network.set_weights(self.best_weights)
+
+    def export_frozen(self, path):
+        """Write the inference graph of the network as a frozen graph, see deeppavlov.utils.frozen_graph"""
+        self.network.export_frozen(path)
+
+    def memory_report(self):
+        """Memory held by the agent in megabytes, see deeppavlov.utils.memory"""
+        if self.network.frozen is not None:
+            network = self.network.frozen.nbytes()
+        else:
+            network = memory.graph_variables_bytes(self.network.sess.graph)
+        return memory.report({'word_dict': memory.nbytes(self.word_dict),
+                              'example_cache': memory.nbytes(self.example_cache.examples),
+                              'batch_buffers': memory.nbytes(self.batch_buffers.storage),
+                              'network': network,
+                              'best_weights': memory.nbytes(self.best_weights)})
+
     def save(self, fname=None):
         """Save the parameters of the agent to a file"""
         fname = self.opt.get('model_file', None) if fname is None else fname
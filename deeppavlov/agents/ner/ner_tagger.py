@@ -21,6 +21,8 @@ from tensorflow.contrib.layers import xavier_initializer
 import os
 import pickle
 
+from ...utils import bundle, checkpoint, frozen_graph, tf_session
+
 
 class NERTagger:
     """Neural Network model for Named Entity Recognition"""
@@ -46,14 +48,30 @@ class NERTagger:
                     learning_rate: learning rate
                     n_layers: number of convolutional layers
         """
-        tf.reset_default_graph()
         seed = opt.get('random_seed')
         np.random.seed(seed)
-        tf.set_random_seed(seed)
         self.token_emb_dim = token_emb_dim
         self.char_emb_dim = char_emb_dim
         self.n_char_cnn_filters = n_char_cnn_filters
         self.opt = copy.deepcopy(opt)
+        self.word_dict = word_dict
+        self.frozen = None
+        if self.opt.get('frozen_model'):
+            # only the prediction graph is loaded, there is nothing to train
+            self.frozen = frozen_graph.FrozenGraph(self.opt['frozen_model'], self.opt)
+            return
+        # the model is built in its own graph, so other agents of the process keep theirs
+        self.sess = tf_session.create_graph_session(self.opt)
+        with tf_session.scope(self.sess):
+            tf.set_random_seed(seed)
+            self._build(learning_rate, n_layers, filter_width)
+
+    def _build(self, learning_rate, n_layers, filter_width):
+        """Build the network in the default graph and initialize its variables"""
+        word_dict = self.word_dict
+        token_emb_dim = self.token_emb_dim
+        char_emb_dim = self.char_emb_dim
+        n_char_cnn_filters = self.n_char_cnn_filters
         vocab_size = len(word_dict)
         char_vocab_size = len(word_dict.char_dict)
         tag_vocab_size = len(word_dict.labels_dict)
@@ -104,8 +122,6 @@ class NERTagger:
         self.loss = loss
         self.train_op = tf.train.AdamOptimizer(lr).minimize(loss)
 
-        self.sess = tf.Session()
-        self.word_dict = word_dict
         self.x = x_w
         self.xc = x_c
         self.y_ground_truth = y_t
@@ -141,18 +157,26 @@ class NERTagger:
             units = tf.nn.relu(units)
         return units, auxiliary_outputs
 
-    def train_on_batch(self, x, xc, y):
+    def train_on_batch(self, x, xc, y, return_predictions=False):
         """Perform one step of training
 
         Args:
             x: tokens batch indices 2-D
             xc: character batch indices 3-D
             y: tags batch indices 2-D
+            return_predictions: also return tags predicted by the forward pass of the train step
 
         Returns:
             loss: value of loss for the current train step
+            y_predicted: predicted tags batch indices 2-D (if return_predictions)
         """
-        loss, _ = self.sess.run([self.loss, self.train_op], feed_dict={self.x: x, self.xc: xc, self.y_ground_truth: y})
+        if self.frozen is not None:
+            raise RuntimeError('model loaded from a frozen graph can not be trained')
+        feed_dict = {self.x: x, self.xc: xc, self.y_ground_truth: y}
+        if return_predictions:
+            loss, y_predicted, _ = self.sess.run([self.loss, self.y_predicted, self.train_op], feed_dict=feed_dict)
+            return loss, y_predicted
+        loss, _ = self.sess.run([self.loss, self.train_op], feed_dict=feed_dict)
         return loss
 
     def eval(self, x, y):
@@ -178,18 +202,32 @@ class NERTagger:
         Returns:
             y: predicted tags batch indices 2-D
         """
+        if self.frozen is not None:
+            return self.frozen.predict([x, xc])[0]
         y = self.sess.run(self.y_predicted, feed_dict={self.x: x, self.xc: xc})
         return y
 
+    def export_frozen(self, path):
+        """Write the prediction graph without the loss and the optimizer as a frozen graph
+
+        Args:
+            path: path to the frozen graph
+        """
+        frozen_graph.freeze(self.sess, [('x_word', self.x), ('x_char', self.xc)],
+                            [('y_predicted', self.y_predicted)], path)
+
     def save(self, file_path):
         """Save the model parameters
 
         Args:
             file_path: saving path of the model
         """
-        saver = tf.train.Saver()
-        print('saving path ' + os.path.join(file_path, 'model.ckpt'))
-        saver.save(self.sess, os.path.join(file_path, 'model.ckpt'))
+        with tf_session.scope(self.sess):
+            saver = tf.train.Saver()
+        path = os.path.join(file_path, 'model.ckpt')
+        print('saving path ' + path)
+        variables = checkpoint.tf_variables(self.sess, saver)
+        checkpoint.save(self.opt, path, lambda: checkpoint.write_tf_checkpoint(path, variables))
 
     def load(self, file_path):
         """Load the model parameters
@@ -197,10 +235,36 @@ class NERTagger:
             Args:
                 file_path: loading path of the model
         """
-        saver = tf.train.Saver()
         print('loading path ' + os.path.join(file_path, 'model.ckpt'))
+        weights = bundle.registered_weights(os.path.join(file_path, 'model.ckpt'))
+        if weights is not None:
+            self.set_weights(weights)
+            return
+        with tf_session.scope(self.sess):
+            saver = tf.train.Saver()
         saver.restore(self.sess, os.path.join(file_path, 'model.ckpt'))
 
+    def get_weights(self):
+        """Get values of all variables of the model
+
+        Returns:
+            weights: list of numpy arrays
+        """
+        return self.sess.run(self.sess.graph.get_collection(tf.GraphKeys.GLOBAL_VARIABLES))
+
+    def set_weights(self, weights):
+        """Load values into all variables of the model
+
+        Args:
+            weights: list of numpy arrays returned by get_weights
+        """
+        variables = self.sess.graph.get_collection(tf.GraphKeys.GLOBAL_VARIABLES)
+        for variable, value in zip(variables, weights):
+            variable.load(value, self.sess)
+
     def shutdown(self):
-        """Reset the model"""
-        tf.reset_default_graph()
+        """Close the session of the model"""
+        if self.frozen is not None:
+            self.frozen.close()
+        else:
+            self.sess.close()
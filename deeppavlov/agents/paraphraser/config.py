@@ -12,10 +12,16 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+from ...utils import frozen_graph, observation, tf_session
+
 
 def add_cmdline_args(parser):
     """Add parameters from command line."""
 
+    observation.add_cmdline_args(parser)
+    frozen_graph.add_cmdline_args(parser)
+    tf_session.add_cmdline_args(parser)
+
     # Runtime environment
     agent = parser.add_argument_group('Paraphraser Arguments')
     agent.add_argument('--no_cuda', type='bool', default=False)
@@ -17,12 +17,6 @@ import os
 import numpy as np
 import copy
 import json
-import tensorflow as tf
-from keras.backend.tensorflow_backend import set_session
-config = tf.ConfigProto()
-config.gpu_options.per_process_gpu_memory_fraction = 0.8
-config.gpu_options.visible_device_list = '0'
-set_session(tf.Session(config=config))
 
 from .metrics import fbeta_score
 from .embeddings_dict import EmbeddingsDict
@@ -34,6 +28,16 @@ from keras import backend as K
 from keras.optimizers import Adam
 from nltk.tokenize import sent_tokenize, word_tokenize
 
+from ...utils import bundle, checkpoint, frozen_graph, tf_session
+from ...utils.batch_buffers import BatchBuffers
+from ...utils.example_cache import ExampleCache
+
+# parameters of a model saved with it, see _init_params
+MODEL_PARAMS = ('max_sequence_length', 'embedding_dim', 'learning_rate', 'batch_size', 'epoch_num', 'seed',
+                'hidden_dim', 'attention_dim', 'perspective_num', 'aggregation_dim', 'dense_dim', 'ldrop_val',
+                'dropout_val', 'recdrop_val', 'inpdrop_val', 'ldropagg_val', 'dropoutagg_val', 'recdropagg_val',
+                'inpdropagg_val', 'model_name')
+
 
 class ParaphraserModel(object):
     """The class defines models for the task of paraphrase identification.
@@ -69,21 +73,38 @@ class ParaphraserModel(object):
         recdropagg_val: a parameter of a model defining a value of dropout
         inpdropagg_val: a parameter of a model defining a value of dropout
         model_name: a name of a model
+        params: parameters of a model, saved with a frozen graph
+        frozen: a frozen inference graph used instead of the model.
+        example_cache: embeddings of sentences from samples without labels.
     """
 
     def __init__(self, opt, embdict=None):
         """Initialize a model from scratch or from saved files."""
 
         self.opt = copy.deepcopy(opt)
-
-        if self.opt.get('pretrained_model'):
-            self._init_from_saved()
+        self.frozen = None
+        self.sess = None
+
+        if self.opt.get('frozen_model'):
+            print('[ Initializing model from frozen graph ]')
+            self.model = None
+            self.frozen = frozen_graph.FrozenGraph(self.opt['frozen_model'], self.opt, gpu_memory_fraction=0.8)
+            # inputs are padded as in the trained model, graphs exported without params use the options
+            self._init_params(dict(self.opt, **self.frozen.params))
+        elif self.opt.get('pretrained_model'):
+            self.sess = tf_session.create_keras_session(self.opt, gpu_memory_fraction=0.8)
+            with tf_session.scope(self.sess):
+                self._init_from_saved()
         else:
+            self.sess = tf_session.create_keras_session(self.opt, gpu_memory_fraction=0.8)
             print('[ Initializing model from scratch ]')
             self._init_params()
-            self._init_from_scratch()
+            with tf_session.scope(self.sess):
+                self._init_from_scratch()
 
         self.embdict = embdict if embdict is not None else EmbeddingsDict(opt, self.embedding_dim)
+        self.example_cache = ExampleCache(max_size=opt.get('example_cache_size'))
+        self.batch_buffers = BatchBuffers()
 
         self.n_examples = 0
         self.updates = 0
@@ -107,10 +128,13 @@ class ParaphraserModel(object):
         self.val_f1 = 0.0
 
     def shutdown(self):
-        """Reset an embdict attribute of the class."""
+        """Reset an embdict attribute of the class and close the session."""
 
         self.embdict = None
-        # tf.reset_default_graph()
+        if self.frozen is not None:
+            self.frozen.close()
+        if self.sess is not None:
+            self.sess.close()
 
     def _init_params(self, param_dict=None):
         """Initialize parameters of a model."""
@@ -137,24 +161,31 @@ class ParaphraserModel(object):
         self.recdropagg_val = param_dict['recdropagg_val']
         self.inpdropagg_val = param_dict['inpdropagg_val']
         self.model_name = param_dict['model_name']
+        self.params = {key: param_dict[key] for key in MODEL_PARAMS}
 
-    def _init_from_scratch(self):
-        """Initialize a model from scratch."""
+    def _build_model(self):
+        """Build an uncompiled network chosen by the model name."""
 
         if self.model_name == 'bmwacor':
-            self.model = self.bmwacor_model()
+            return self.bmwacor_model()
         if self.model_name == 'bilstm_split':
-            self.model = self.bilstm_split_model()
+            return self.bilstm_split_model()
         if self.model_name == 'full_match':
-            self.model = self.full_match_model()
+            return self.full_match_model()
         if self.model_name == 'maxpool_match':
-            self.model = self.maxpool_match_model()
+            return self.maxpool_match_model()
         if self.model_name == 'att_match':
-            self.model = self.att_match_model()
+            return self.att_match_model()
         if self.model_name == 'maxatt_match':
-            self.model = self.maxatt_match_model()
+            return self.maxatt_match_model()
         if self.model_name == 'bilstm_woatt':
-            self.model = self.bilstm_woatt_model()
+            return self.bilstm_woatt_model()
+        raise ValueError('There is no model with name: {}'.format(self.model_name))
+
+    def _init_from_scratch(self):
+        """Initialize a model from scratch."""
+
+        self.model = self._build_model()
         optimizer = Adam(lr=self.learning_rate)
         self.model.compile(loss='binary_crossentropy',
                            optimizer=optimizer,
@@ -163,10 +194,18 @@ class ParaphraserModel(object):
     def save(self, fname):
         """Save a model."""
 
-        self.model.save_weights(fname+'.h5')
-        with open(fname+'.json', 'w') as f:
-            json.dump(self.opt, f)
-        self.embdict.save_items(fname)
+        with tf_session.scope(self.sess):
+            weights = checkpoint.keras_weights(self.model)
+        opt = copy.deepcopy(self.opt)
+        save_items = self.embdict.items_saver(fname)
+
+        def write():
+            checkpoint.write_keras_weights(fname+'.h5', weights)
+            with checkpoint.atomic_file(fname+'.json') as f:
+                json.dump(opt, f)
+            save_items()
+
+        checkpoint.save(self.opt, fname, write)
 
     def _init_from_saved(self):
         """Initialize a model from saved files."""
@@ -182,7 +221,7 @@ class ParaphraserModel(object):
             exit()
         if os.path.isfile(fname+'.h5'):
             self._init_from_scratch()
-            self.model.load_weights(fname+'.h5')
+            bundle.restore_keras_weights(self.model, fname + '.h5')
         else:
             print('Error. There is no %s.h5 file provided.' % fname)
             exit()
@@ -190,14 +229,37 @@ class ParaphraserModel(object):
     def update(self, batch):
         """Train a model on a batch of samples."""
 
+        if self.frozen is not None:
+            raise RuntimeError('model loaded from a frozen graph can not be trained')
         x, y = batch
-        self.train_loss, self.train_acc, self.train_f1 = self.model.train_on_batch(x, y)
+        with tf_session.scope(self.sess):
+            self.train_loss, self.train_acc, self.train_f1 = self.model.train_on_batch(x, y)
         self.updates += 1
 
     def predict(self, batch):
         """Make prediction for a batch of samples."""
 
-        return self.model.predict_on_batch(batch)
+        if self.frozen is not None:
+            return self.frozen.predict(batch)[0]
+        with tf_session.scope(self.sess):
+            return self.model.predict_on_batch(batch)
+
+    def get_weights(self):
+        """Get values of all weights of a model."""
+
+        with tf_session.scope(self.sess):
+            return self.model.get_weights()
+
+    def set_weights(self, weights):
+        """Load values returned by get_weights into weights of a model."""
+
+        with tf_session.scope(self.sess):
+            self.model.set_weights(weights)
+
+    def export_frozen(self, path):
+        """Write the network rebuilt for inference as a frozen graph."""
+
+        frozen_graph.export_keras(self._build_model, self.get_weights(), path, self.opt, self.params)
 
     def build_ex(self, ex):
         """Extract data from an observation."""
@@ -224,37 +286,41 @@ class ParaphraserModel(object):
         for ex in batch:
             question1.append(ex['question1'])
             question2.append(ex['question2'])
-        self.embdict.add_items(question1)
-        self.embdict.add_items(question2)
-        b1 = self.create_batch(question1)
-        b2 = self.create_batch(question2)
 
         if len(batch[0]) == 3:
+            self.embdict.add_items(question1)
+            self.embdict.add_items(question2)
+            b1 = self.create_batch(question1, 'x1')
+            b2 = self.create_batch(question2, 'x2')
             y = [1 if ex['labels'][0] == 'Да' else 0 for ex in batch]
             return [b1, b2], y
         else:
+            b1 = self.batch_buffers.stack('x1', [self.example_cache.get(sen, self._embed_sentence, sen)
+                                                 for sen in question1])
+            b2 = self.batch_buffers.stack('x2', [self.example_cache.get(sen, self._embed_sentence, sen)
+                                                 for sen in question2])
             return [b1, b2], None
 
-    def create_batch(self, sentence_li):
-        """Create a batch for a list of sentences."""
+    def _embed_sentence(self, sen):
+        """Create embeddings of a single sentence."""
+
+        self.embdict.add_items([sen])
+        return self.create_batch([sen], 'sentence')[0].copy()
+
+    def create_batch(self, sentence_li, buffer_name='x1'):
+        """Create a batch for a list of sentences in a reused buffer."""
 
-        embeddings_batch = []
-        for sen in sentence_li:
-            embeddings = []
+        embeddings_batch = self.batch_buffers.get(buffer_name,
+                                                  (len(sentence_li), self.max_sequence_length, self.embedding_dim))
+        for i, sen in enumerate(sentence_li):
             sent_toks = sent_tokenize(sen)
             word_toks = [word_tokenize(el) for el in sent_toks]
             tokens = [val for sublist in word_toks for val in sublist]
             tokens = [el for el in tokens if el != '']
-            for tok in tokens:
-                embeddings.append(self.embdict.tok2emb.get(tok))
-            if len(tokens) < self.max_sequence_length:
-                pads = [np.zeros(self.embedding_dim) for _ in range(self.max_sequence_length - len(tokens))]
-                embeddings = pads + embeddings
-            else:
-                embeddings = embeddings[-self.max_sequence_length:]
-            embeddings = np.asarray(embeddings)
-            embeddings_batch.append(embeddings)
-        embeddings_batch = np.asarray(embeddings_batch)
+            # sentences are padded from the left and truncated from the right
+            tokens = tokens[-self.max_sequence_length:]
+            for j, tok in enumerate(tokens, self.max_sequence_length - len(tokens)):
+                embeddings_batch[i, j] = self.embdict.tok2emb.get(tok)
         return embeddings_batch
 
     def create_lstm_layer(self, input_dim):
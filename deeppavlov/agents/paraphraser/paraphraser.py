@@ -13,13 +13,13 @@
 # limitations under the License.
 
 
-import copy
-
 from parlai.core.agents import Agent
 
 from . import config
 from .embeddings_dict import EmbeddingsDict
 from .model import ParaphraserModel
+from ...utils import memory
+from ...utils.observation import join_episode_text
 
 
 def prediction2text(prediction):
@@ -61,11 +61,14 @@ class EnsembleParaphraserAgent(Agent):
 
         self.id = 'ParaphraserAgent'
         self.episode_done = True
+        self.strict_observation_copy = opt.get('strict_observation_copy', False)
         super().__init__(opt, shared)
         if shared is not None:
             self.is_shared = True
             return
 
+        if opt.get('frozen_model'):
+            raise ValueError('--frozen-model is not supported by ensembles, every model would load the same graph')
         # Set up params/logging/dicts
         self.is_shared = False
         embdict = EmbeddingsDict(opt, opt.get('embedding_dim'))
@@ -77,12 +80,10 @@ class EnsembleParaphraserAgent(Agent):
     def observe(self, observation):
         """Set an observation attribute with an observation from a teacher."""
 
-        observation = copy.deepcopy(observation)
-        if not self.episode_done:
-            # if the last example wasn't the end of an episode, then we need to
-            # recall what was said in that example
-            prev_dialogue = self.observation['text']
-            observation['text'] = prev_dialogue + '\n' + observation['text']
+        # if the last example wasn't the end of an episode, then we need to
+        # recall what was said in that example
+        prev_observation = None if self.episode_done else self.observation
+        observation = join_episode_text(observation, prev_observation, strict=self.strict_observation_copy)
         self.observation = observation
         self.episode_done = observation['episode_done']
         return observation
@@ -118,6 +119,13 @@ class EnsembleParaphraserAgent(Agent):
 
         return batch_reply
 
+    def shutdown(self):
+        """Close sessions of the models."""
+
+        if not self.is_shared:
+            for model in self.models:
+                model.shutdown()
+
 
 class ParaphraserAgent(Agent):
     """The class defines an agent to work with paraphraser identification model.
@@ -143,6 +151,7 @@ class ParaphraserAgent(Agent):
 
         self.id = 'ParaphraserAgent'
         self.episode_done = True
+        self.strict_observation_copy = opt.get('strict_observation_copy', False)
         super().__init__(opt, shared)
         if shared is not None:
             self.is_shared = True
@@ -151,17 +160,16 @@ class ParaphraserAgent(Agent):
         # Set up params/logging/dicts
         self.is_shared = False
         self.model = ParaphraserModel(opt)
+        self.best_weights = None
         self.n_examples = 0
 
     def observe(self, observation):
         """Set an observation attribute with an observation from a teacher."""
 
-        observation = copy.deepcopy(observation)
-        if not self.episode_done:
-            # if the last example wasn't the end of an episode, then we need to
-            # recall what was said in that example
-            prev_dialogue = self.observation['text']
-            observation['text'] = prev_dialogue + '\n' + observation['text']
+        # if the last example wasn't the end of an episode, then we need to
+        # recall what was said in that example
+        prev_observation = None if self.episode_done else self.observation
+        observation = join_episode_text(observation, prev_observation, strict=self.strict_observation_copy)
         self.observation = observation
         self.episode_done = observation['episode_done']
         return observation
@@ -171,8 +179,25 @@ class ParaphraserAgent(Agent):
 
         return self.batch_act([self.observation])[0]
 
-    def batch_act(self, observations):
-        """Create batches from observations and make update or make predictions for these batches."""
+    def prepare_batch(self, observations):
+        """Create a batch from observations.
+
+        Returns:
+            indices of valid observations and the batch
+        """
+
+        examples = [self.model.build_ex(obs) for obs in observations]
+        valid_inds = [i for i in range(len(observations)) if examples[i] is not None]
+        examples = [ex for ex in examples if ex is not None]
+        return valid_inds, self.model.batchify(examples)
+
+    def batch_act(self, observations, batch=None):
+        """Create batches from observations and make update or make predictions for these batches.
+
+        Args:
+            observations: batch of observations
+            batch: result of prepare_batch for the observations, computed if None
+        """
 
         if self.is_shared:
             raise RuntimeError("Parallel act is not supported.")
@@ -180,13 +205,10 @@ class ParaphraserAgent(Agent):
         batch_size = len(observations)
         # initialize a table of replies with this agent's id
         batch_reply = [{'id': self.getID()} for _ in range(batch_size)]
-        examples = [self.model.build_ex(obs) for obs in observations]
-        valid_inds = [i for i in range(batch_size) if examples[i] is not None]
-        examples = [ex for ex in examples if ex is not None]
-        batch = self.model.batchify(examples)
+        valid_inds, batch = self.prepare_batch(observations) if batch is None else batch
 
         if 'labels' in observations[0] and not self.opt.get('pretrained_model'):
-            self.n_examples += len(examples)
+            self.n_examples += len(valid_inds)
             self.model.update(batch)
         else:
             batch, _ = batch
@@ -206,6 +228,38 @@ class ParaphraserAgent(Agent):
             print("[ saving model: " + fname + " ]")
             self.model.save(fname)
 
+    def snapshot_weights(self):
+        """Keep current weights of a model in memory."""
+
+        self.best_weights = self.model.get_weights()
+
+    def restore_weights(self):
+        """Load weights kept by snapshot_weights into a model."""
+
+        if self.best_weights is not None:
+            self.model.set_weights(self.best_weights)
+
+    def memory_report(self):
+        """Memory held by the agent in megabytes, see deeppavlov.utils.memory."""
+
+        tok2emb = self.model.embdict.tok2emb
+        if self.model.frozen is not None:
+            network = self.model.frozen.nbytes()
+        else:
+            network = memory.variables_bytes(self.model.model.weights)
+        return memory.report({'embeddings_added': memory.nbytes(tok2emb.added),
+                              'embeddings_index': memory.nbytes(tok2emb.index),
+                              'embeddings_mapped': memory.mapped_bytes(tok2emb.matrix),
+                              'example_cache': memory.nbytes(self.model.example_cache.examples),
+                              'batch_buffers': memory.nbytes(self.model.batch_buffers.storage),
+                              'network': network,
+                              'best_weights': memory.nbytes(self.best_weights)})
+
+    def export_frozen(self, path):
+        """Write the inference graph of a model as a frozen graph, see deeppavlov.utils.frozen_graph."""
+
+        self.model.export_frozen(path)
+
     def report(self):
         """Return a string with training information."""
 
@@ -15,19 +15,28 @@
 
 import os
 
-try:
-    import spacy
-except ImportError:
-    raise ImportError(
-        "Please install spacy and spacy 'en' model: go to spacy.io"
-    )
-
 from parlai.core.dict import DictionaryAgent
-from .utils import normalize_text
 import urllib
 
+from ...utils import glove_mmap
+
+
+_NLP = None
+
+
+def get_nlp():
+    """Load spaCy 'en' model on first use."""
 
-NLP = spacy.load('en')
+    global _NLP
+    if _NLP is None:
+        try:
+            import spacy
+        except ImportError:
+            raise ImportError(
+                "Please install spacy and spacy 'en' model: go to spacy.io"
+            )
+        _NLP = spacy.load('en')
+    return _NLP
 
 
 class SimpleDictionaryAgent(DictionaryAgent):
@@ -60,11 +69,7 @@ class SimpleDictionaryAgent(DictionaryAgent):
                     raise RuntimeError('Looks like the `EMBEDDINGS_URL` variable is set incorrectly', e)
 
             print('[ Indexing words with embeddings... ]')
-            self.embedding_words = set()
-            with open(self.opt['embedding_file']) as f:
-                for line in f:
-                    w = normalize_text(line.rstrip().split(' ')[0])
-                    self.embedding_words.add(w)
+            self.embedding_words = glove_mmap.load_vectors(self.opt['embedding_file'])
             print('[ Num words in set = %d ]' %
                   len(self.embedding_words))
         else:
@@ -79,7 +84,7 @@ class SimpleDictionaryAgent(DictionaryAgent):
         Returns:
             list of tokens (words, punctuation, etc...)
         """
-        tokens = NLP.tokenizer(text)
+        tokens = get_nlp().tokenizer(text)
         return [t.text for t in tokens]
 
     def span_tokenize(self, text):
@@ -90,7 +95,7 @@ class SimpleDictionaryAgent(DictionaryAgent):
         Returns:
             list of tuples with start and end position of each token in original string
         """
-        tokens = NLP.tokenizer(text)
+        tokens = get_nlp().tokenizer(text)
         return [(t.idx, t.idx + len(t.text)) for t in tokens]
 
     def add_to_dict(self, tokens):
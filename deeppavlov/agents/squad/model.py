@@ -22,17 +22,12 @@ import os
 import pickle
 
 import tensorflow as tf
-from keras.backend.tensorflow_backend import set_session
 from keras.layers import Input, Masking
 from keras.models import Model
 from keras.utils import np_utils
 
 from .utils import AverageMeter, getOptimizer, score
-
-config = tf.ConfigProto()
-config.gpu_options.per_process_gpu_memory_fraction = 0.95
-config.gpu_options.visible_device_list = '0'
-set_session(tf.Session(config=config))
+from ...utils import bundle, checkpoint, frozen_graph, keras_train, tf_session
 
 # import layers
 from .layers import *
@@ -50,6 +45,7 @@ class SquadModel(object):
         word_dict: dictionary with word indexes (if given)
         feature_dict: dictionary with additional features indexes (if given)
         weights_path: path to model weights to restore model (if given)
+        frozen: frozen inference graph used instead of the model (if opt['frozen_model'] is given)
 
     """
 
@@ -70,20 +66,27 @@ class SquadModel(object):
         self.train_f1 = AverageMeter()
         self.train_em = AverageMeter()
 
+        self.frozen = None
+        self.sess = None
+        if self.opt.get('frozen_model'):
+            print('[ Loading frozen graph %s ]' % self.opt['frozen_model'])
+            self.model = None
+            self.frozen = frozen_graph.FrozenGraph(self.opt['frozen_model'], self.opt, gpu_memory_fraction=0.95)
+            return
 
-        if self.type == 'fastqa_default':
-            self.model = self.fastqa_default()
-        elif self.type == 'fastqa_hybrid':
-            self.model = self.fastqa_hybrid()
-        elif self.type == 'drqa_clone':
-            self.model = self.drqa_default()
-        else:
-            raise NameError('There is no model with name: {}'.format(self.type))
+        self.sess = tf_session.create_keras_session(self.opt, gpu_memory_fraction=0.95)
+        with tf_session.scope(self.sess):
+            self._init_model(weights_path)
+
+    def _init_model(self, weights_path):
+        """Build and compile the network, load its weights if weights_path is given."""
+
+        self.model = self._build_model()
 
         if not weights_path==None:
             print('[ Loading model %s ]' % weights_path)
             if os.path.isfile(weights_path + '.h5'):
-                self.model.load_weights(weights_path + '.h5')
+                bundle.restore_keras_weights(self.model, weights_path + '.h5')
             else:
                 print('Error. There is no %s.h5 file provided.' % weights_path)
 
@@ -94,23 +97,74 @@ class SquadModel(object):
                            metrics=['accuracy'])
 
 
+    def _build_model(self):
+        """Build an uncompiled network of the chosen type."""
+
+        if self.type == 'fastqa_default':
+            return self.fastqa_default()
+        elif self.type == 'fastqa_hybrid':
+            return self.fastqa_hybrid()
+        elif self.type == 'drqa_clone':
+            return self.drqa_default()
+        else:
+            raise NameError('There is no model with name: {}'.format(self.type))
+
+    def export_frozen(self, path):
+        """Write the network rebuilt for inference as a frozen graph."""
+
+        frozen_graph.export_keras(self._build_model, self.get_weights(), path, self.opt)
+
+    def get_weights(self):
+        """Get values of all weights of the network."""
+
+        with tf_session.scope(self.sess):
+            return self.model.get_weights()
+
+    def set_weights(self, weights):
+        """Load values returned by get_weights into weights of the network."""
+
+        with tf_session.scope(self.sess):
+            self.model.set_weights(weights)
+
+    def drop_lr(self, factor):
+        """Multiply the learning rate of the optimizer by factor."""
+
+        with tf_session.scope(self.sess):
+            self.model.optimizer.lr = self.model.optimizer.lr * factor
+
+    def shutdown(self):
+        """Close the session of the network."""
+
+        if self.frozen is not None:
+            self.frozen.close()
+        if self.sess is not None:
+            self.sess.close()
+
     def save(self, fname):
         """Save trained model along with parameters needed to restore model."""
 
-        self.model.save_weights(fname+'.h5')
+        with tf_session.scope(self.sess):
+            weights = checkpoint.keras_weights(self.model)
 
         params = {
             'word_dict': self.word_dict,
             'feature_dict': self.feature_dict,
             'config': self.opt,
         }
+        params_data = pickle.dumps(params)
+
+        def write():
+            checkpoint.write_keras_weights(fname+'.h5', weights)
+            checkpoint.write_bytes(fname+'.pkl', params_data)
 
-        with open(fname+'.pkl', 'wb') as f:
-            pickle.dump(params, f)
+        checkpoint.save(self.opt, fname, write)
 
     def update(self, batch):
         """Make one training step (forward pass, back pass) with provided batch."""
 
+        if self.frozen is not None:
+            raise RuntimeError('model loaded from a frozen graph can not be trained')
+
         def cat(target):
             dtype = K.floatx()
             indices = np.arange(len(target))
@@ -123,12 +177,16 @@ class SquadModel(object):
 
         x, y = [batch[0], batch[1], batch[3], batch[2], batch[4]], [cat(batch[5]), cat(batch[6])]
 
-        output = self.model.train_on_batch(x, y)
+        # Sometimes update F1 training score to be aware of overfitting
+        with tf_session.scope(self.sess):
+            if (self.updates + 1) % 5 == 0:
+                output, (score_s, score_e) = keras_train.train_on_batch_with_predictions(self.model, x, y)
+            else:
+                output = self.model.train_on_batch(x, y)
         self.train_loss.update(output[0])
         self.train_acc.update((output[3] + output[4])/2)
         self.updates += 1
 
-        # Sometimes update F1 training score to be aware of overfitting
         if self.updates % 5 == 0:
             text = batch[-2]
             spans = batch[-1]
@@ -136,7 +194,8 @@ class SquadModel(object):
             answers = []
             for i in range(len(text)):
                 answers.append(text[i][spans[i][answ_s[i]][0]:spans[i][answ_e[i]][1]])
-            predictions = self.predict(batch)
+            # answers are decoded from the forward pass of the train step
+            predictions = self.decode(score_s, score_e, batch)
             scorer = score(predictions, answers)
             self.train_f1.update(scorer[1])
             self.train_em.update(scorer[0])
@@ -144,7 +203,16 @@ class SquadModel(object):
     def predict(self, batch):
         """Returns answer predictions for provided batch."""
 
-        score_s, score_e = self.model.predict_on_batch([batch[0], batch[1], batch[3], batch[2], batch[4]])
+        inputs = [batch[0], batch[1], batch[3], batch[2], batch[4]]
+        if self.frozen is not None:
+            score_s, score_e = self.frozen.predict(inputs)
+        else:
+            with tf_session.scope(self.sess):
+                score_s, score_e = self.model.predict_on_batch(inputs)
+        return self.decode(score_s, score_e, batch)
+
+    def decode(self, score_s, score_e, batch):
+        """Returns answer predictions from scores of answer start and end."""
 
         text = batch[-2]
         spans = batch[-1]
@@ -20,11 +20,14 @@ import pickle
 import numpy as np
 from numpy.random import seed
 from parlai.core.agents import Agent
-
 from . import config
 from .embeddings_dict import SimpleDictionaryAgent
 from .model import SquadModel
 from .utils import build_feature_dict, vectorize, batchify, load_embeddings
+from ...utils import memory
+from ...utils.batch_buffers import BatchBuffers
+from ...utils.example_cache import ExampleCache
+from ...utils.observation import join_episode_text
 
 
 class SquadAgent(Agent):
@@ -54,6 +57,7 @@ class SquadAgent(Agent):
             word_dict = SquadAgent.dictionary_class()(opt)
         # All agents keep track of the episode (for multiple questions)
         self.episode_done = True
+        self.strict_observation_copy = opt.get('strict_observation_copy', False)
 
         # Only create an empty dummy class when sharing
         if shared is not None:
@@ -76,6 +80,9 @@ class SquadAgent(Agent):
                 self._init_from_scratch()
 
         self.embeddings = load_embeddings(opt, word_dict)
+        self.example_cache = ExampleCache(max_size=opt.get('example_cache_size'))
+        self.batch_buffers = BatchBuffers()
+        self.best_weights = None
         self.n_examples = 0
 
 
@@ -109,12 +116,10 @@ class SquadAgent(Agent):
     def observe(self, observation):
         """Return observation."""
 
-        observation = copy.deepcopy(observation)
-        if not self.episode_done:
-            # if the last example wasn't the end of an episode, then we need to
-            # recall what was said in that example
-            prev_dialogue = self.observation['text']
-            observation['text'] = prev_dialogue + '\n' + observation['text']
+        # if the last example wasn't the end of an episode, then we need to
+        # recall what was said in that example
+        prev_observation = None if self.episode_done else self.observation
+        observation = join_episode_text(observation, prev_observation, strict=self.strict_observation_copy)
         self.observation = observation
         self.episode_done = observation['episode_done']
         return observation
@@ -131,7 +136,7 @@ class SquadAgent(Agent):
         if ex is None:
             return reply
         batch = batchify(
-            [ex], null=self.word_dict[self.word_dict.null_token]
+            [ex], null=self.word_dict[self.word_dict.null_token], buffers=self.batch_buffers
         )
 
         # Either train or predict
@@ -143,33 +148,52 @@ class SquadAgent(Agent):
 
         return reply
 
-    def batch_act(self, observations):
-        """Update or predict on a batch of examples.
-        More efficient than act()."""
+    def prepare_batch(self, observations):
+        """Vectorize a batch of observations.
 
-        if self.is_shared:
-            raise RuntimeError("Parallel act is not supported.")
-
-        batchsize = len(observations)
-        batch_reply = [{'id': self.getID()} for _ in range(batchsize)]
+        Returns:
+            indices of valid observations and the batch, None if all examples are invalid
+        """
 
         # Some examples will be None (no answer found). Filter them.
         examples = [self._build_ex(obs) for obs in observations]
-        valid_inds = [i for i in range(batchsize) if examples[i] is not None]
+        valid_inds = [i for i in range(len(observations)) if examples[i] is not None]
         examples = [ex for ex in examples if ex is not None]
 
-        # If all examples are invalid, return an empty batch.
+        # If all examples are invalid, there is no batch.
         if len(examples) == 0:
-            return batch_reply
+            return valid_inds, None
 
         # Else, use what we have (hopefully everything).
         batch = batchify(
-            examples, null=self.word_dict[self.word_dict.null_token]
+            examples, null=self.word_dict[self.word_dict.null_token], buffers=self.batch_buffers
         )
+        return valid_inds, batch
+
+    def batch_act(self, observations, batch=None):
+        """Update or predict on a batch of examples.
+        More efficient than act().
+
+        Args:
+            observations: batch of observations
+            batch: result of prepare_batch for the observations, computed if None
+        """
+
+        if self.is_shared:
+            raise RuntimeError("Parallel act is not supported.")
+
+        batchsize = len(observations)
+        batch_reply = [{'id': self.getID()} for _ in range(batchsize)]
+
+        valid_inds, batch = self.prepare_batch(observations) if batch is None else batch
+
+        # If all examples are invalid, return an empty batch.
+        if batch is None:
+            return batch_reply
 
         # Either train or predict
         if 'labels' in observations[0]:
-            self.n_examples += len(examples)
+            self.n_examples += len(valid_inds)
             self.model.update(batch)
         else:
             predictions = self.model.predict(batch)
@@ -181,7 +205,7 @@ class SquadAgent(Agent):
     def drop_lr(self):
         """Reset optimizer and reset learning rate if validation score is not increasing."""
 
-        self.model.model.optimizer.lr = self.model.model.optimizer.lr * self.opt['lr_drop']
+        self.model.drop_lr(self.opt['lr_drop'])
 
     def save(self, fname=None):
         """Save the parameters of the agent to a file."""
@@ -191,6 +215,42 @@ class SquadAgent(Agent):
             print("[ saving model: " + fname + " ]")
             self.model.save(fname)
 
+    def snapshot_weights(self):
+        """Keep current weights of the model in memory."""
+
+        self.best_weights = self.model.get_weights()
+
+    def restore_weights(self):
+        """Load weights kept by snapshot_weights into the model."""
+
+        if self.best_weights is not None:
+            self.model.set_weights(self.best_weights)
+
+    def memory_report(self):
+        """Memory held by the agent in megabytes, see deeppavlov.utils.memory."""
+
+        if self.model.frozen is not None:
+            network = self.model.frozen.nbytes()
+        else:
+            network = memory.variables_bytes(self.model.model.weights)
+        return memory.report({'word_dict': memory.nbytes(self.word_dict),
+                              'feature_dict': memory.nbytes(self.feature_dict),
+                              'example_cache': memory.nbytes(self.example_cache.examples),
+                              'batch_buffers': memory.nbytes(self.batch_buffers.storage),
+                              'network': network,
+                              'best_weights': memory.nbytes(self.best_weights)})
+
+    def export_frozen(self, path):
+        """Write the inference graph of the model as a frozen graph, see deeppavlov.utils.frozen_graph."""
+
+        self.model.export_frozen(path)
+
+    def shutdown(self):
+        """Close the session of the model."""
+
+        if not self.is_shared:
+            self.model.shutdown()
+
     def report(self):
         """Report and reset metrics."""
 
@@ -213,12 +273,20 @@ class SquadAgent(Agent):
 
     def _build_ex(self, ex):
         """Find the token span of the answer in the context for this example.
-        If a token span cannot be found, return None. Otherwise, torchify."""
+        If a token span cannot be found, return None. Otherwise, torchify.
+        Examples without labels are vectorized once and reused."""
 
         # Check if empty input (end of epoch)
         if not 'text' in ex:
             return
 
+        if 'labels' not in ex:
+            return self.example_cache.get(ex['text'], self._vectorize_ex, ex)
+        return self._vectorize_ex(ex)
+
+    def _vectorize_ex(self, ex):
+        """Tokenize and vectorize the document and the question of the example."""
+
         # Split out document + question
         inputs = {}
         fields = ex['text'].strip().split('\n')
@@ -13,6 +13,9 @@
 # limitations under the License.
 
 
+import hashlib
+import json
+import os
 import re
 import string
 import unicodedata
@@ -22,6 +25,9 @@ import numpy as np
 from keras.optimizers import Adam, Adamax, Adadelta
 from numpy.random import seed
 
+from ...utils import glove_mmap
+from ...utils.batch_buffers import BatchBuffers
+
 
 # ------------------------------------------------------------------------------
 # Optimizer presets.
@@ -54,28 +60,52 @@ def normalize_text(text):
     return unicodedata.normalize('NFD', text)
 
 def load_embeddings(opt, word_dict):
-    """Initialize embeddings from file of pretrained vectors."""
+    """Initialize embeddings from file of pretrained vectors.
 
-    seed(1)
-    embeddings = np.random.normal(0.0, 1.0, (len(word_dict), opt['word_embedding_dim']))
+    Rows of the dictionary words are taken from the memory-mapped copy of the
+    embedding file. The resulting float32 matrix is cached next to the model
+    file, so it is built again only if the dictionary or the embedding file changes.
+    """
 
-    # Fill in embeddings
     if not opt.get('embedding_file'):
         raise RuntimeError('Tried to load embeddings with no embedding file.')
-    with open(opt['embedding_file']) as f:
-        for line in f:
-            parsed = line.rstrip().split(' ')
-            if len(parsed)==2:
-                continue
-            assert(len(parsed) == opt['word_embedding_dim'] + 1)
-            w = normalize_text(parsed[0])
-            if w in word_dict:
-                vec = np.array([float(i) for i in parsed[1:]])
-                embeddings[word_dict[w]] = vec
+    vectors = glove_mmap.load_vectors(opt['embedding_file'])
+    words = [word_dict[i] for i in range(len(word_dict))]
+    key = {'source': vectors.source,
+           'dim': opt['word_embedding_dim'],
+           'words': hashlib.md5('\n'.join(words).encode('utf-8')).hexdigest()}
+
+    cache_file = opt['model_file'] + '.embeddings' if opt.get('model_file') else None
+    if cache_file and os.path.isfile(cache_file + '.npy') and os.path.isfile(cache_file + '.json'):
+        with open(cache_file + '.json') as f:
+            if json.load(f) == key:
+                print('[ Loading embeddings from %s.npy ]' % cache_file)
+                return np.load(cache_file + '.npy')
+
+    seed(1)
+    embeddings = np.random.normal(0.0, 1.0, (len(word_dict), opt['word_embedding_dim'])).astype(np.float32)
+
+    # Fill in embeddings
+    ids = [vectors.get_word_id(normalize_text(w)) for w in words]
+    found = [i for i, row in enumerate(ids) if row >= 0]
+    if found:
+        assert(vectors.dim == opt['word_embedding_dim'])
+        embeddings[found] = vectors.vectors[[ids[i] for i in found]]
 
     # Zero NULL token
     embeddings[word_dict['__NULL__']] = np.zeros(opt['word_embedding_dim'])
 
+    if cache_file:
+        try:
+            if os.path.isfile(cache_file + '.json'):
+                os.remove(cache_file + '.json')
+            np.save(cache_file + '.tmp.npy', embeddings)
+            os.replace(cache_file + '.tmp.npy', cache_file + '.npy')
+            with open(cache_file + '.json', 'w') as f:
+                json.dump(key, f)
+        except OSError as e:
+            print('[ Can not cache embeddings to %s.npy: %s ]' % (cache_file, e))
+
     return embeddings
 
 def build_feature_dict(opt):
@@ -173,8 +203,8 @@ def vectorize(opt, ex, word_dict, feature_dict, embeddings):
     return document, features, question, start, end
 
 
-def batchify(batch, null=0):
-    """Collate inputs into batches."""
+def batchify(batch, null=0, buffers=None):
+    """Collate inputs into float32 batches, reusing arrays of buffers if given."""
 
     NUM_INPUTS = 3
     NUM_TARGETS = 2
@@ -191,9 +221,10 @@ def batchify(batch, null=0):
     #print(docs[0].shape)
     max_length = max([d.shape[0] for d in docs])
     emb_dim = docs[0].shape[1]
-    x1 = np.zeros((len(docs), max_length, emb_dim))
-    x1_mask = np.zeros((len(docs), max_length))
-    x1_f = np.zeros((len(docs), max_length, features[0].shape[1]))
+    buffers = buffers if buffers is not None else BatchBuffers(slots=1)
+    x1 = buffers.get('x1', (len(docs), max_length, emb_dim))
+    x1_mask = buffers.get('x1_mask', (len(docs), max_length))
+    x1_f = buffers.get('x1_f', (len(docs), max_length, features[0].shape[1]))
     for i, d in enumerate(docs):
         x1[i, :d.shape[0], :] = d
         x1_mask[i, :d.shape[0]] = 1.0
@@ -201,8 +232,8 @@ def batchify(batch, null=0):
 
     # Batch questions
     max_length = max([q.shape[0] for q in questions])
-    x2 = np.zeros((len(questions), max_length, emb_dim))
-    x2_mask = np.zeros((len(questions), max_length))
+    x2 = buffers.get('x2', (len(questions), max_length, emb_dim))
+    x2_mask = buffers.get('x2_mask', (len(questions), max_length))
     for i, q in enumerate(questions):
         x2[i, :q.shape[0], :] = q
         x2_mask[i, :q.shape[0]] = 1.0
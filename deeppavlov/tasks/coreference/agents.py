@@ -15,7 +15,6 @@
 
 import os
 from os.path import join
-import copy
 import random
 from parlai.core.agents import Teacher
 # from parlai.core.dialog_teacher import DialogTeacher
@@ -25,6 +24,18 @@ from .build import build
 from . import utils
 import tensorflow as tf
 from ...utils import coreference_utils
+from ...utils import dataset_cache
+from ...utils.observation import keep_observation
+
+# version of records read from conll files, a new version compiles datasets again
+DATASET_VERSION = '1'
+
+
+def _read_documents(datapath, names):
+    """Read conll documents as records with a name and a text."""
+    for name in names:
+        with open(join(datapath, name), 'r', encoding='utf8') as f:
+            yield {'name': name, 'conll': f.read()}
 
 
 class CoreferenceTeacher(Teacher):
@@ -63,6 +74,14 @@ class CoreferenceTeacher(Teacher):
         
         self.doc_address = os.listdir(self.datapath)  # list of files addresses        
         self.len = len(self.doc_address)
+        # documents are read once and loaded from the compiled dataset afterwards
+        names = sorted(self.doc_address)
+        self.documents = dataset_cache.load(join(opt['datapath'], 'coreference', 'compiled'),
+                                            '{}-{}'.format(self.language, self.dt),
+                                            [join(self.datapath, name) for name in names], DATASET_VERSION,
+                                            lambda: _read_documents(self.datapath, names),
+                                            text_fields=['name', 'conll'])
+        self.document_index = {name: i for i, name in enumerate(names)}
         self.doc_id = 0 
         self.iter = 0
         self.epoch = 0
@@ -84,16 +103,21 @@ class CoreferenceTeacher(Teacher):
 
     def act(self):
         """reads document and returns it"""
-        datafile = join(self.datapath, self.doc_address[self.doc_id])
+        doc_name = self.doc_address[self.doc_id]
         epoch_done = self.doc_id == self.len - 1
-        act_dict = utils.conll2dict(datafile, self.iter, self.id, self.dt, self.doc_address[self.doc_id],
-                                    epoch_done=epoch_done)
+        # the same dict as utils.conll2dict of the document file
+        act_dict = {'iter_id': self.iter,
+                    'id': self.id,
+                    'epoch_done': epoch_done,
+                    'mode': self.dt,
+                    'doc_name': doc_name,
+                    'conll_str': self.documents.text('conll', self.document_index[doc_name])}
    
         return act_dict
             
     def observe(self, observation):
         """saves observation"""
-        self.observation = copy.deepcopy(observation)
+        self.observation = keep_observation(observation, self.opt.get('strict_observation_copy', False))
         if self.observation['epoch_done']:
             self.doc_id = 0
             self.epoch += 1
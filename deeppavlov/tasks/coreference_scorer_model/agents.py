@@ -13,6 +13,7 @@
 # limitations under the License.
 
 
+import io
 import os
 import random
 
@@ -23,6 +24,17 @@ from parlai.core.agents import Teacher
 from . import utils
 from .build import build
 from ...utils import coreference_utils
+from ...utils import dataset_cache
+
+# version of records read from conll files, a new version compiles datasets again
+DATASET_VERSION = '1'
+
+
+def _read_documents(datapath, names):
+    """Read conll documents as records with a text."""
+    for name in names:
+        with open(os.path.join(datapath, name), 'r') as f:
+            yield {'conll': f.read()}
 
 
 class CoreferenceTeacher(Teacher):
@@ -83,15 +95,33 @@ class CoreferenceTeacher(Teacher):
 
         self.train_documents = [] if self.train_path is None else list(sorted(os.listdir(self.train_path)))
         self.valid_documents = [] if self.valid_path is None else list(sorted(os.listdir(self.valid_path)))
+        # documents are read once and loaded from compiled datasets afterwards
+        self.train_dataset = self._load_documents(self.train_path, self.train_documents)
+        self.valid_dataset = self._load_documents(self.valid_path, self.valid_documents)
         self.len = 1
         self.epoch = 0
         self._epoch_done = False
 
+    def _load_documents(self, path, names):
+        """Load documents of a folder from its compiled dataset"""
+        if path is None:
+            return None
+        return dataset_cache.load(os.path.join(self.datapath, 'compiled'), os.path.basename(path),
+                                  [os.path.join(path, name) for name in names], DATASET_VERSION,
+                                  lambda: _read_documents(path, names), text_fields=['conll'])
+
+    @staticmethod
+    def _document_lines(dataset):
+        """Lines of all documents of a dataset as returned by readlines of their files"""
+        if dataset is None:
+            return []
+        return [io.StringIO(dataset.text('conll', i)).readlines() for i in range(len(dataset))]
+
     def act(self):
         """reads all documents and returns them"""
         self._epoch_done = True
-        train_conll = [open(os.path.join(self.train_path, file), 'r').readlines() for file in self.train_documents]
-        valid_conll = [open(os.path.join(self.valid_path, file), 'r').readlines() for file in self.valid_documents]
+        train_conll = self._document_lines(self.train_dataset)
+        valid_conll = self._document_lines(self.valid_dataset)
         return {'id': self.id, 'conll': train_conll, 'valid_conll': valid_conll}
 
     def observe(self, observation):
@@ -13,15 +13,22 @@
 # limitations under the License.
 
 
-from parlai.core.dialog_teacher import DialogTeacher
 from sklearn.model_selection import KFold
 
 from .build import build
 import os
 import csv
-import sklearn.metrics
+import numpy as np
 import random
 
+from ...utils import bucketing
+from ...utils import dataset_cache
+from ...utils import stream
+from ...utils import stream_metrics
+
+# version of records parsed from csv files, a new version compiles datasets again
+DATASET_VERSION = '1'
+
 
 def _path(opt):
     """Function to create full data path.
@@ -35,25 +42,44 @@ def _path(opt):
     # ensure data is built
     build(opt)
     # set up paths to data (specific to each dataset)
-    dt = 'test' if opt['datatype'] == 'test' else 'train'
+    dt = 'test' if opt['datatype'].split(':')[0] == 'test' else 'train'
     datafile = os.path.join(opt['datapath'], 'insults', dt + '.csv')
     return datafile
 
 
-class DefaultTeacher(DialogTeacher):
+def _read_csv(path):
+    """Read comments of a csv file as records with a text and a label."""
+    with open(path) as labels_file:
+        context = csv.reader(labels_file)
+        next(context)
+        for label, text in context:
+            yield {'text': text, 'label': int(label)}
+
+
+def _load_dataset(opt, path):
+    """Load comments of a csv file from its compiled dataset."""
+    return dataset_cache.load(os.path.join(opt['datapath'], 'insults', 'compiled'),
+                              os.path.splitext(os.path.basename(path))[0], [path], DATASET_VERSION,
+                              lambda: _read_csv(path), token_fields=['text'], value_fields=['label'])
+
+
+class DefaultTeacher(stream.StreamDialogTeacher):
     """DefaultTeacher
 
     Child class for DialogueTeacher.
     Class reads the data, composes batches and gives them
     to Agent that returns the labels (probabilities).
+    With a :stream datatype comments are read lazily from csv shards and
+    assigned to bagging folds by a hash of their text.
 
     Attributes:
         datatype_strict: mode to train or to predict ("train" or "test")
         id: teacher name
         answer_candidate: possible text labels
         random_state: random state with given seed
-        observations: list of observed scores
-        labels: list of true labels
+        counts: confusion counts of observed predictions
+        loss: log loss accumulator of observed scores
+        auc: ROC AUC accumulator of observed scores
         opt: given parameters
         lastY: label of the last observation (or None of no labels given)
         metrics: considered metrics
@@ -65,6 +91,8 @@ class DefaultTeacher(DialogTeacher):
         teacher = argparser.add_argument_group('Insults teacher arguments')
         teacher.add_argument('--raw-dataset-path', type=str, default=None,
                              help='Path to unprocessed dataset files from Kaggle')
+        bucketing.add_cmdline_args(argparser)
+        stream.add_cmdline_args(argparser)
         teacher.add_argument('--teacher-random-seed', type=int, default=270)
         teacher.add_argument('--bagging-fold-index', type=int)
         teacher.add_argument('--bagging-folds-number', type=int, default=5)
@@ -89,17 +117,20 @@ class DefaultTeacher(DialogTeacher):
         super().__init__(opt, shared)
 
         if shared:
-            self.observations = shared['observations']
-            self.labels = shared['labels']
+            self.counts = shared['counts']
+            self.loss = shared['loss']
+            self.auc = shared['auc']
         else:
-            self.observations = []
-            self.labels = []
+            self.counts = stream_metrics.BinaryCounts()
+            self.loss = stream_metrics.LogLoss()
+            self.auc = stream_metrics.HistogramAUC()
 
     def share(self):
-        """Share the observations and labels."""
+        """Share the metric accumulators."""
         shared = super().share()
-        shared['observations'] = self.observations
-        shared['labels'] = self.labels
+        shared['counts'] = self.counts
+        shared['loss'] = self.loss
+        shared['auc'] = self.auc
         return shared
 
     def label_candidates(self):
@@ -110,42 +141,44 @@ class DefaultTeacher(DialogTeacher):
         """Read and iteratively yield data to agent"""
         print('loading: ' + path)
 
-        questions = []
-        y = []
-
-        # open data file with labels
-        # (path will be provided to setup_data from opt['datafile'] defined above)
-        with open(path) as labels_file:
-            context = csv.reader(labels_file)
-            next(context)
-
-            for item in context:
-                label, text = item
-                questions.append(text)
-                y.append([self.answer_candidates[int(label)]])
-
+        dataset = _load_dataset(self.opt, path)
         episode_done = True
 
-        indexes = range(len(questions))
+        indexes = range(len(dataset))
         if self.datatype_strict != 'test':
-            random_state = random.getstate()
-            random.setstate(self.random_state)
-            kf_seed = random.randrange(500000)
-            kf = KFold(self.opt.get('bagging_folds_number'), shuffle=True,
-                       random_state=kf_seed)
-            i = 0
-            for train_index, test_index in kf.split(questions):
-                indexes = train_index if self.datatype_strict == 'train' else test_index
-                if i >= self.opt.get('bagging_fold_index', 0):
-                    break
-            self.random_state = random.getstate()
-            random.setstate(random_state)
+            folds = self.opt.get('bagging_folds_number')
+            fold = self.opt.get('bagging_fold_index') or 0
+            # the same seed as drawn by the teacher random state after seeding
+            kf_seed = random.Random(self.opt.get('teacher_random_seed')).randrange(500000)
+
+            def split():
+                kf = KFold(folds, shuffle=True, random_state=kf_seed)
+                train_index, test_index = list(kf.split(np.arange(len(dataset))))[fold]
+                return train_index if self.datatype_strict == 'train' else test_index
+
+            indexes = dataset.split('kfold{}-seed{}-fold{}-{}'.format(folds, kf_seed, fold, self.datatype_strict),
+                                    split).tolist()
 
         # define iterator over all queries
-        for i in indexes:
+        for i in self.slice_indexes(indexes):
             # get current label, both as a digit and as a text
             # yield tuple with information and episode_done? flag
-            yield (questions[i], y[i]), episode_done
+            yield (dataset.text('text', i), [self.answer_candidates[dataset.value('label', i)]]), episode_done
+
+    def stream_examples(self, path):
+        """Comments of a csv shard."""
+        for record in _read_csv(path):
+            yield (record['text'], [self.answer_candidates[record['label']]]), True
+
+    def keep_example(self, example):
+        """Check if a streamed comment is in the bagging fold of the datatype."""
+        if self.datatype_strict == 'test':
+            return True
+        (text, _), _ = example
+        folds = self.opt.get('bagging_folds_number')
+        fraction = stream.hash_fraction(text, self.opt.get('teacher_random_seed'))
+        in_fold = int(fraction * folds) == (self.opt.get('bagging_fold_index') or 0)
+        return in_fold != (self.datatype_strict == 'train')
 
     def _predictions2text(self, predictions):
         """Convert float predictions to text labels."""
@@ -162,40 +195,46 @@ class DefaultTeacher(DialogTeacher):
         if self.lastY is not None:
             self.metrics.update(observation, self.lastY)
             if 'text' in observation.keys():
-                self.labels += self._text2predictions(self.lastY)
-                self.observations += [observation['score']]
+                label = self._text2predictions(self.lastY)[0]
+                score = float(np.ravel(observation['score'])[0])
+                self.counts.update(label, score > 0.5)
+                self.loss.update(label, score)
+                self.auc.update(label, score)
             self.lastY = None
         return observation
 
     def reset_metrics(self):
-        """Reset metrics, observations and labels."""
+        """Reset metrics and accumulators."""
         super().reset_metrics()
-        del self.observations[:]
-        del self.labels[:]
+        self.counts.clear()
+        self.loss.clear()
+        self.auc.clear()
 
     def report(self):
         """Return report with metrics on the whole data."""
-        loss = sklearn.metrics.log_loss(self.labels, self.observations)
-        acc = sklearn.metrics.accuracy_score(self.labels,
-                                             self._text2predictions(self._predictions2text(self.observations)))
         try:
-            auc = sklearn.metrics.roc_auc_score(self.labels, self.observations)
+            auc = self.auc.value()
         except ValueError:
             auc = 0
         report = dict()
-        report['comments'] = len(self.observations)
-        report['loss'] = loss
-        report['accuracy'] = acc
+        report['comments'] = len(self.counts)
+        report['loss'] = self.loss.value()
+        report['accuracy'] = self.counts.accuracy()
         report['auc'] = auc
         return report
 
     def reset(self):
         """Reset class, random state"""
         super().reset()
+        if self.stream:
+            # streamed comments are shuffled by the stream
+            return
 
         random_state = random.getstate()
         random.setstate(self.random_state)
         random.shuffle(self.data.data)
+        if self.opt.get('bucket_batches'):
+            bucketing.bucket_episodes(self.data.data, self.opt['batchsize'], self.opt['bucket_size'], random)
         self.random_state = random.getstate()
         random.setstate(random_state)
 
@@ -215,33 +254,24 @@ class FullTeacher(DefaultTeacher):
         teacher = argparser.add_argument_group('Insults teacher arguments')
         teacher.add_argument('--raw-dataset-path', type=str, default=None,
                              help='Path to unprocessed dataset files from Kaggle')
+        bucketing.add_cmdline_args(argparser)
+        stream.add_cmdline_args(argparser)
 
     def __init__(self, opt, shared=None):
         super().__init__(opt, shared)
 
+    def keep_example(self, example):
+        """Keep all streamed comments."""
+        return True
+
     def setup_data(self, path):
         print('loading: ' + path)
 
-        questions = []
-        y = []
-
-        # open data file with labels
-        # (path will be provided to setup_data from opt['datafile'] defined above)
-        with open(path) as labels_file:
-            context = csv.reader(labels_file)
-            next(context)
-
-            for item in context:
-                label, text = item
-                questions.append(text)
-                y.append([self.answer_candidates[int(label)]])
-
+        dataset = _load_dataset(self.opt, path)
         episode_done = True
 
-        indexes = range(len(questions))
-
         # define iterator over all queries
-        for i in indexes:
+        for i in self.slice_indexes(range(len(dataset))):
             # get current label, both as a digit and as a text
             # yield tuple with information and episode_done? flag
-            yield (questions[i], y[i]), episode_done
+            yield (dataset.text('text', i), [self.answer_candidates[dataset.value('label', i)]]), episode_done
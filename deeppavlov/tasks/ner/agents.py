@@ -13,12 +13,17 @@
 # limitations under the License.
 
 
-from parlai.core.dialog_teacher import DialogTeacher
 from .build import build
 import os
 import xml.etree.ElementTree as ET
 import random
 from .metric import CoNLLClassificationMetrics
+from ...utils import bucketing
+from ...utils import dataset_cache
+from ...utils import stream
+
+# version of records parsed from the heap file, a new version compiles the dataset again
+DATASET_VERSION = '1'
 
 
 def _path(opt):
@@ -29,8 +34,28 @@ def _path(opt):
     return datafile
 
 
-class DefaultTeacher(DialogTeacher):
-    """The Teacher for Named Entity Recognition task"""
+def _read_heap(path):
+    """Read sentences of the heap file as records with space separated tokens and tags"""
+    with open(path) as heap_file:
+        tokens_long = []
+        tags_long = []
+        for line in heap_file:
+            if len(line) > 2:
+                token, tag = line.split()
+                tokens_long.append(token)
+                tags_long.append(tag)
+            else:
+                yield {'tokens': ' '.join(tokens_long), 'tags': ' '.join(tags_long)}
+                tokens_long = []
+                tags_long = []
+
+
+class DefaultTeacher(stream.StreamDialogTeacher):
+    """The Teacher for Named Entity Recognition task
+
+    With a :stream datatype sentences are read lazily from shards in the format
+    of the heap file and split into parts by a hash of their tokens.
+    """
 
     def __init__(self, opt, shared=None):
         """Initialize the parameters of the DefaultTeacher"""
@@ -38,6 +63,12 @@ class DefaultTeacher(DialogTeacher):
         self.parts = [opt['train_part'], opt['valid_part'], opt['test_part']]
         # store datatype
         self.dt = opt['datatype'].split(':')[0]
+        if self.dt == 'train':
+            self.part = [0, self.parts[0]]
+        elif self.dt == 'test':
+            self.part = [self.parts[0], sum(self.parts[0:2])]
+        elif self.dt == 'valid':
+            self.part = [sum(self.parts[0:2]), 1]
         self.opt = opt
         opt['datafile'] = _path(opt)
 
@@ -67,6 +98,8 @@ class DefaultTeacher(DialogTeacher):
         group.add_argument('--train-part', type=int, default=0.8)
         group.add_argument('--valid-part', type=int, default=0.1)
         group.add_argument('--test-part', type=int, default=0.1)
+        bucketing.add_cmdline_args(argparser)
+        stream.add_cmdline_args(argparser)
 
     @staticmethod
     def split_sentences(x, y):
@@ -111,61 +144,48 @@ class DefaultTeacher(DialogTeacher):
         """
         print('loading: ' + path)
 
-        questions = []
-        y = []
-        # open data file with labels
-        # (path will be provided to setup_data from opt['datafile'] defined above)
-
-        with open(path) as heap_file:
-            tokens_long = []
-            tags_long = []
-            for line in heap_file:
-                if len(line) > 2:
-                    token, tag = line.split()
-                    tokens_long.append(token)
-                    tags_long.append(tag)
-                else:
-                    questions.append(' '.join(tokens_long))
-                    y.append([' '.join(tags_long)])
-                    tokens_long = []
-                    tags_long = []
-
-        questions_and_ys = list(zip(questions, y))
-        random_state = random.getstate()
-        random.setstate(self.random_state)
-        random.shuffle(questions_and_ys)
-        self.random_state = random.getstate()
-        random.setstate(random_state)
-        questions, y = list(zip(*questions_and_ys))
+        # sentences are parsed once and loaded from the compiled dataset afterwards
+        dataset = dataset_cache.load(os.path.join(self.opt['datapath'], 'ner', 'compiled'), 'heap', [path],
+                                     DATASET_VERSION, lambda: _read_heap(path), token_fields=['tokens', 'tags'])
 
-        if self.dt == 'train':
-            part = [0, self.parts[0]]
-        elif self.dt == 'test':
-            part = [self.parts[0], sum(self.parts[0:2])]
-        elif self.dt == 'valid':
-            part = [sum(self.parts[0:2]), 1]
+        part = self.part
         episode_done = True
 
-        n_docs = len(questions)
-        start_ind = int(n_docs * part[0])
-        end_ind = int(n_docs * part[1])
-        questions = questions[start_ind: end_ind]
-        y = y[start_ind: end_ind]
+        def split():
+            # sentences are shuffled with the teacher seed before they are split
+            order = list(range(len(dataset)))
+            random.Random(self.opt.get('teacher_seed')).shuffle(order)
+            return order[int(len(order) * part[0]): int(len(order) * part[1])]
 
-        if not y:
-            y = [None for _ in range(len(questions))]
+        indexes = dataset.split('{}-seed{}-{}'.format(self.dt, self.opt.get('teacher_seed'),
+                                                      '-'.join(str(p) for p in self.parts)), split)
 
         # define iterator over all queries
-        for i in range(len(questions)):
+        for i in self.slice_indexes(indexes.tolist()):
             # get current label, both as a digit and as a text
             # yield tuple with information and episode_done? flag
-            yield (questions[i], y[i]), episode_done
+            yield (dataset.text('tokens', i), [dataset.text('tags', i)]), episode_done
+
+    def stream_examples(self, path):
+        """Sentences of a shard in the format of the heap file"""
+        for record in _read_heap(path):
+            yield (record['tokens'], [record['tags']]), True
+
+    def keep_example(self, example):
+        """Check if a streamed sentence is in the part of the datatype"""
+        (tokens, _), _ = example
+        return self.part[0] <= stream.hash_fraction(tokens, self.opt.get('teacher_seed')) < self.part[1]
 
     def reset(self):
         """Reset Teacher random states"""
+        if self.stream:
+            # streamed sentences are shuffled by the stream
+            return super().reset()
         random_state = random.getstate()
         random.setstate(self.random_state)
         random.shuffle(self.data.data)
+        if self.opt.get('bucket_batches'):
+            bucketing.bucket_episodes(self.data.data, self.opt['batchsize'], self.opt['bucket_size'], random)
         self.random_state = random.getstate()
         random.setstate(random_state)
 
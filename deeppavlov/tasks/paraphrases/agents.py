@@ -13,19 +13,41 @@
 # limitations under the License.
 
 
-from parlai.core.dialog_teacher import DialogTeacher
-
 from .metric import BinaryClassificationMetrics
 from .build import build
 import csv
+import os
 from sklearn.model_selection import KFold
+import numpy as np
 import random
 
+from ...utils import bucketing
+from ...utils import dataset_cache
+from ...utils import stream
+
+# version of records parsed from tsv files, a new version compiles datasets again
+DATASET_VERSION = '1'
+
+
+def _read_tsv(path):
+    """Read pairs of phrases of a tsv file as records with two texts and a label."""
 
-class DefaultTeacher(DialogTeacher):
+    with open(path) as labels_file:
+        tsv_reader = csv.reader(labels_file, delimiter='\t')
+
+        for row in tsv_reader:
+            if len(row) != 3:
+                print('Warn: expected 3 columns in a tsv row, got ' + str(row))
+                continue
+            yield {'text_1': row[1], 'text_2': row[2], 'label': 1 if row[0] == '1' else 0}
+
+
+class DefaultTeacher(stream.StreamDialogTeacher):
     """The class implements a default teacher.
 
     The class reads the data, composes observations and feeds them to an agent.
+    With a :stream datatype pairs are read lazily from tsv shards and assigned
+    to bagging folds by a hash of their phrases.
 
     Attributes:
         datatype_strict: mode to train or to predict ("train" or "test")
@@ -45,6 +67,8 @@ class DefaultTeacher(DialogTeacher):
         teacher.add_argument('--teacher-random-seed', type=int, default=71)
         teacher.add_argument('--bagging-fold-index', type=int)
         teacher.add_argument('--bagging-folds-number', type=int, default=5)
+        bucketing.add_cmdline_args(argparser)
+        stream.add_cmdline_args(argparser)
 
     def __init__(self, opt, shared=None):
         """Initialize the class according to given parameters in opt."""
@@ -83,53 +107,68 @@ class DefaultTeacher(DialogTeacher):
 
         print('loading: ' + path)
 
-        questions = []
-        y = []
-
-        # open data file with labels
-        # (path will be provided to setup_data from opt['datafile'] defined above)
-        with open(path) as labels_file:
-            tsv_reader = csv.reader(labels_file, delimiter='\t')
-
-            for row in tsv_reader:
-                if len(row) != 3:
-                    print('Warn: expected 3 columns in a tsv row, got ' + str(row))
-                    continue
-                y.append(['Да' if row[0] == '1' else 'Нет'])
-                questions.append(row[1] + '\n' + row[2])
+        # phrases are parsed once and loaded from the compiled dataset afterwards
+        dataset = dataset_cache.load(os.path.join(os.path.dirname(path), 'compiled'),
+                                     os.path.splitext(os.path.basename(path))[0], [path], DATASET_VERSION,
+                                     lambda: _read_tsv(path), token_fields=['text_1', 'text_2'],
+                                     value_fields=['label'])
 
         episode_done = True
-        if not y:
-            y = [None for _ in range(len(questions))]
 
-        indexes = range(len(questions))
+        indexes = range(len(dataset))
         if self.datatype_strict != 'test':
-            random_state = random.getstate()
-            random.setstate(self.random_state)
-            kf_seed = random.randrange(500000)
-            kf = KFold(self.opt.get('bagging_folds_number'), shuffle=True,
-                       random_state=kf_seed)
-            i = 0
-            for train_index, test_index in kf.split(questions):
-                indexes = train_index if self.datatype_strict == 'train' else test_index
-                if i >= self.opt.get('bagging_fold_index', 0):
-                    break
-            self.random_state = random.getstate()
-            random.setstate(random_state)
+            folds = self.opt.get('bagging_folds_number')
+            fold = self.opt.get('bagging_fold_index') or 0
+            # the same seed as drawn by the teacher random state after seeding
+            kf_seed = random.Random(self.opt.get('teacher_random_seed')).randrange(500000)
+
+            def split():
+                kf = KFold(folds, shuffle=True, random_state=kf_seed)
+                train_index, test_index = list(kf.split(np.arange(len(dataset))))[fold]
+                return train_index if self.datatype_strict == 'train' else test_index
+
+            indexes = dataset.split('kfold{}-seed{}-fold{}-{}'.format(folds, kf_seed, fold, self.datatype_strict),
+                                    split).tolist()
 
         # define iterator over all queries
-        for i in indexes:
+        for i in self.slice_indexes(indexes):
             # get current label, both as a digit and as a text
             # yield tuple with information and episode_done? flag
-            yield (self.question + "\n" + questions[i], y[i]), episode_done
+            question = dataset.text('text_1', i) + '\n' + dataset.text('text_2', i)
+            y = ['Да' if dataset.value('label', i) == 1 else 'Нет']
+            yield (self.question + "\n" + question, y), episode_done
+
+    def stream_examples(self, path):
+        """Pairs of phrases of a tsv shard."""
+
+        for record in _read_tsv(path):
+            question = record['text_1'] + '\n' + record['text_2']
+            y = ['Да' if record['label'] == 1 else 'Нет']
+            yield (self.question + "\n" + question, y), True
+
+    def keep_example(self, example):
+        """Check if a streamed pair is in the bagging fold of the datatype."""
+
+        if self.datatype_strict == 'test':
+            return True
+        (text, _), _ = example
+        folds = self.opt.get('bagging_folds_number')
+        fraction = stream.hash_fraction(text, self.opt.get('teacher_random_seed'))
+        in_fold = int(fraction * folds) == (self.opt.get('bagging_fold_index') or 0)
+        return in_fold != (self.datatype_strict == 'train')
 
     def reset(self):
         """Reset class and random state."""
 
         super().reset()
+        if self.stream:
+            # streamed pairs are shuffled by the stream
+            return
 
         random_state = random.getstate()
         random.setstate(self.random_state)
         random.shuffle(self.data.data)
+        if self.opt.get('bucket_batches'):
+            bucketing.bucket_episodes(self.data.data, self.opt['batchsize'], self.opt['bucket_size'], random)
         self.random_state = random.getstate()
         random.setstate(random_state)
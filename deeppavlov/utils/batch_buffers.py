@@ -0,0 +1,76 @@
+# Copyright 2017 Neural Networks and Deep Learning lab, MIPT
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import numpy as np
+
+
+class BatchBuffers(object):
+    """Pool of preallocated arrays reused by batchify calls.
+
+    Every named buffer has several slots which are handed out in turn, so a
+    batch stays valid while the next `slots - 1` batches are built. Arrays are
+    contiguous views of the slot storage, which grows to the largest batch seen.
+    Callers must copy a batch they keep for longer.
+
+    Attributes:
+        slots: number of slots of every buffer
+        storage: dict from a buffer name to the list of its flat slot arrays
+        turns: dict from a buffer name to the index of the next slot
+    """
+
+    def __init__(self, slots=2):
+        self.slots = slots
+        self.storage = {}
+        self.turns = {}
+
+    def get(self, name, shape, dtype=np.float32, fill=0):
+        """Return an array of the given shape filled with a value.
+
+        Args:
+            name: name of the buffer, e.g. 'x' or 'mask'
+            shape: shape of the array
+            dtype: numpy type of the array
+            fill: value to fill the array with, None leaves it uninitialized
+
+        Returns:
+            numpy array backed by the buffer
+        """
+        dtype = np.dtype(dtype)
+        size = int(np.prod(shape))
+        slots = self.storage.setdefault(name, [])
+        if len(slots) < self.slots:
+            slots.extend([None] * (self.slots - len(slots)))
+        turn = self.turns.get(name, 0)
+        self.turns[name] = (turn + 1) % self.slots
+        flat = slots[turn]
+        if flat is None or flat.dtype != dtype or flat.size < size:
+            flat = slots[turn] = np.empty(max(size, flat.size if flat is not None else 0), dtype=dtype)
+        array = flat[:size].reshape(shape)
+        if fill is not None:
+            array.fill(fill)
+        return array
+
+    def stack(self, name, arrays, dtype=np.float32):
+        """Stack arrays of the same shape into a buffer."""
+        if len(arrays) == 0:
+            return np.zeros((0,), dtype=dtype)
+        array = self.get(name, (len(arrays),) + np.shape(arrays[0]), dtype, fill=None)
+        for i, a in enumerate(arrays):
+            array[i] = a
+        return array
+
+    def clear(self):
+        """Release all buffers."""
+        self.storage = {}
+        self.turns = {}
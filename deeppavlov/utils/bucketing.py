@@ -0,0 +1,61 @@
+# Copyright 2017 Neural Networks and Deep Learning lab, MIPT
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Length bucketing of teacher data.
+
+In a batch world every copy of a teacher takes the episode at its offset in
+the shared data, so a batch is a run of `batchsize` consecutive episodes.
+Teachers reorder their data so that every run holds episodes of similar length
+and agents pad batches less. Episodes are shuffled, cut into buckets of
+`bucket_size` batches, sorted by length inside a bucket and split into batches,
+then the batches are shuffled.
+"""
+
+
+def add_cmdline_args(argparser):
+    """Add bucketing arguments to the parser."""
+    group = argparser.add_argument_group('Bucketing Arguments')
+    group.add_argument('--bucket-batches', type='bool', default=False,
+                       help='group episodes of similar length into batches')
+    group.add_argument('--bucket-size', type=int, default=100,
+                       help='number of batches in a bucket, episodes are sorted by length inside a bucket')
+
+
+def episode_length(episode):
+    """Number of space separated tokens in texts of an episode."""
+    return sum(len(entry[0].split()) for entry in episode if entry[0])
+
+
+def bucket_episodes(episodes, batch_size, bucket_size, rng):
+    """Reorder episodes in place into batches of episodes of similar length.
+
+    Args:
+        episodes: list of episodes of a teacher
+        batch_size: number of episodes in a batch
+        bucket_size: number of batches in a bucket
+        rng: random module or random.Random instance
+    """
+    batch_size = max(batch_size, 1)
+    order = list(range(len(episodes)))
+    rng.shuffle(order)
+    lengths = [episode_length(episode) for episode in episodes]
+    window = batch_size * max(bucket_size, 1)
+    batches = []
+    for start in range(0, len(order), window):
+        bucket = sorted(order[start:start + window], key=lambda i: lengths[i])
+        batches.extend(bucket[i:i + batch_size] for i in range(0, len(bucket), batch_size))
+    # an incomplete batch stays last, otherwise it would shift the batches after it
+    last = [batches.pop()] if batches and len(batches[-1]) < batch_size else []
+    rng.shuffle(batches)
+    episodes[:] = [episodes[i] for batch in batches + last for i in batch]
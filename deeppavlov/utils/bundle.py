@@ -0,0 +1,325 @@
+# Copyright 2017 Neural Networks and Deep Learning lab, MIPT
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Single file bundles of trained agents.
+
+A bundle packs the options of an agent, the files of its model (configs,
+vocabularies, pickled vectorizers, embedding dictionaries) and the weights of
+its network into one file:
+    magic, uint64 length of the header, json header, 64-byte aligned data segments
+
+Weights are stored as raw arrays and are set into the network directly from the
+memory-mapped bundle, without parsing .h5 files or tensorflow checkpoints.
+Other files are unpacked once into <bundle>.files next to the bundle.
+
+Export a trained model with the arguments used to test it:
+    python -m deeppavlov.utils.bundle <bundle> -m <agent> -mf <model_file> ...
+and create the agent with `load_agent(<bundle>)`.
+"""
+
+import glob
+import json
+import mmap
+import os
+import re
+import shutil
+import struct
+import sys
+
+import numpy as np
+
+
+MAGIC = b'DPBUNDLE'
+ALIGNMENT = 64
+STAMP_FILE = '.bundle_stamp'
+PATH_OPTIONS = ('model_file', 'pretrained_model', 'fasttext_embeddings_dict', 'dict_file', 'frozen_model')
+# options with lists of paths, e.g. models of an ensemble
+PATH_LIST_OPTIONS = ('model_files',)
+WEIGHTS_SUFFIXES = ('.h5', '.ckpt')
+
+# weights of unpacked bundles, by the path of the weights file they replace
+_weights = {}
+
+
+def _align(pos):
+    return (pos + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def _json_options(opt):
+    """Options which can be saved to json."""
+    options = {}
+    for key, value in opt.items():
+        try:
+            json.dumps(value)
+        except (TypeError, ValueError):
+            continue
+        options[key] = value
+    return options
+
+
+def _model_files(path, exclude):
+    """Files of a model saved to a directory or to files with a common prefix.
+
+    Files of other models sharing the prefix (e.g. bagging folds <prefix>_0.h5
+    or <prefix>0.h5 of the fold <prefix> itself) and bundles are skipped.
+    """
+    if os.path.isdir(path):
+        files = {os.path.relpath(os.path.join(root, f), path): os.path.join(root, f)
+                 for root, _, names in os.walk(path) for f in names}
+    else:
+        files = {os.path.basename(f): f for f in glob.glob(glob.escape(path) + '*')
+                 if os.path.isfile(f) and not re.match(r'(_?\d+)([._]|$)', f[len(path):])}
+    return {name: f for name, f in files.items()
+            if '.tmp' not in name and not os.path.abspath(f).startswith(exclude)}
+
+
+def _weights_key(name):
+    """Name of the weights a file belongs to, e.g. model.ckpt for model.ckpt.index."""
+    for suffix in WEIGHTS_SUFFIXES:
+        i = name.find(suffix)
+        if i >= 0 and (name.endswith(suffix) or name[i + len(suffix)] == '.'):
+            return name[:i + len(suffix)]
+    return None
+
+
+def write_bundle(bundle_path, opt, roots, files, weights_file=None, weights=None):
+    """Write a bundle.
+
+    Args:
+        bundle_path: path to the bundle
+        opt: options of the agent
+        roots: dict from a path option to the path of its files inside the bundle, or to a list of paths
+        files: dict from a name of a file inside the bundle to its path
+        weights_file: name of the weights file replaced by weights
+        weights: list of numpy arrays
+    """
+    weights = [np.ascontiguousarray(w) for w in weights or []]
+    header = {'opt': _json_options(opt), 'roots': roots, 'files': {}, 'weights_file': weights_file, 'weights': []}
+    pos = 0
+    for name in sorted(files):
+        size = os.path.getsize(files[name])
+        header['files'][name] = [pos, size]
+        pos = _align(pos + size)
+    for w in weights:
+        header['weights'].append([pos, w.dtype.str, list(w.shape)])
+        pos = _align(pos + w.nbytes)
+    raw_header = json.dumps(header).encode('utf-8')
+    data_start = _align(len(MAGIC) + 8 + len(raw_header))
+
+    tmp_path = '{}.tmp{}'.format(bundle_path, os.getpid())
+    with open(tmp_path, 'wb') as f:
+        f.write(MAGIC + struct.pack('<Q', len(raw_header)) + raw_header)
+        for name in sorted(files):
+            f.seek(data_start + header['files'][name][0])
+            with open(files[name], 'rb') as src:
+                shutil.copyfileobj(src, f)
+        for w, (offset, _, _) in zip(weights, header['weights']):
+            f.seek(data_start + offset)
+            f.write(w.tobytes())
+        f.truncate(data_start + pos)
+    os.replace(tmp_path, bundle_path)
+
+
+class Bundle(object):
+    """Read-only view of a memory-mapped bundle.
+
+    Attributes:
+        path: path to the bundle
+        opt: options of the agent
+        roots: dict from a path option to the path of its files inside the bundle, or to a list of paths
+        weights_file: name of the weights file replaced by weights
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mm[:len(MAGIC)] != MAGIC:
+            raise ValueError('{} is not an agent bundle'.format(path))
+        size, = struct.unpack_from('<Q', self._mm, len(MAGIC))
+        header = json.loads(self._mm[len(MAGIC) + 8:len(MAGIC) + 8 + size].decode('utf-8'))
+        self._data_start = _align(len(MAGIC) + 8 + size)
+        self.opt = header['opt']
+        self.roots = header['roots']
+        self.weights_file = header['weights_file']
+        self._files = header['files']
+        self._weights = header['weights']
+
+    @property
+    def files(self):
+        """Names of files inside the bundle."""
+        return sorted(self._files)
+
+    def file(self, name):
+        """Content of a file as a memoryview of the bundle."""
+        offset, size = self._files[name]
+        start = self._data_start + offset
+        return memoryview(self._mm)[start:start + size]
+
+    def weights(self):
+        """List of weight arrays backed by the bundle."""
+        return [np.frombuffer(self._mm, dtype=np.dtype(dtype), count=int(np.prod(shape)),
+                              offset=self._data_start + offset).reshape(shape)
+                for offset, dtype, shape in self._weights]
+
+    def stamp(self):
+        stat = os.stat(self.path)
+        return {'size': stat.st_size, 'mtime': int(stat.st_mtime)}
+
+
+def export_agent(agent, opt, bundle_path):
+    """Pack a trained agent into a bundle.
+
+    Files of the model are taken from paths given by PATH_OPTIONS and
+    PATH_LIST_OPTIONS, every path is packed under its own root. If the agent
+    keeps its weights with snapshot_weights, the weights file is replaced by arrays
+    (agents predicting with a frozen graph and ensembles are packed with their files as is).
+
+    Args:
+        agent: agent initialized from the trained model
+        opt: options the agent was created with
+        bundle_path: path to the bundle
+    """
+    roots = {}
+    files = {}
+    prefixes = {}
+
+    def pack(path):
+        """Add files of a path to the bundle, return their root or None if there are no files."""
+        prefix = os.path.abspath(path)
+        if prefix not in prefixes:
+            model_files = _model_files(prefix, os.path.abspath(bundle_path))
+            if not model_files:
+                return None
+            directory = str(len(prefixes))
+            for name, f in model_files.items():
+                files[os.path.join(directory, name)] = f
+            prefixes[prefix] = directory if os.path.isdir(prefix) else os.path.join(directory, os.path.basename(prefix))
+        return prefixes[prefix]
+
+    for key in PATH_OPTIONS:
+        path = opt.get(key)
+        if isinstance(path, str) and path:
+            root = pack(path)
+            if root is not None:
+                roots[key] = root
+    for key in PATH_LIST_OPTIONS:
+        paths = opt.get(key)
+        if not paths:
+            continue
+        key_roots = [pack(path) for path in paths]
+        missing = [path for path, root in zip(paths, key_roots) if root is None]
+        if missing:
+            raise ValueError('there are no files of --{} {}'.format(key, ' '.join(missing)))
+        roots[key] = key_roots
+
+    weights_file = None
+    weights = None
+    keys = {_weights_key(name) for name in files} - {None}
+    if len(keys) == 1 and hasattr(agent, 'snapshot_weights') and not opt.get('frozen_model'):
+        agent.snapshot_weights()
+        if isinstance(agent.best_weights, list):
+            weights_file = keys.pop()
+            weights = agent.best_weights
+        agent.best_weights = None
+    write_bundle(bundle_path, opt, roots, files, weights_file, weights)
+    print('[ agent bundle is saved to {} ]'.format(bundle_path))
+
+
+def unpack(bundle):
+    """Unpack files of a bundle next to it once.
+
+    Files of weights stored as arrays are left empty, their weights are registered
+    to be taken by `restore_keras_weights` and `registered_weights`.
+
+    Returns:
+        path to the directory with unpacked files
+    """
+    files_path = bundle.path + '.files'
+    stamp_path = os.path.join(files_path, STAMP_FILE)
+    stamp = bundle.stamp()
+    try:
+        with open(stamp_path) as f:
+            unpacked = json.load(f) == stamp
+    except (OSError, ValueError):
+        unpacked = False
+    if not unpacked:
+        tmp_path = '{}.tmp{}'.format(files_path, os.getpid())
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        try:
+            for name in bundle.files:
+                path = os.path.join(tmp_path, name)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(path, 'wb') as f:
+                    if bundle.weights_file is None or _weights_key(name) != bundle.weights_file:
+                        f.write(bundle.file(name))
+            with open(os.path.join(tmp_path, STAMP_FILE), 'w') as f:
+                json.dump(stamp, f)
+            shutil.rmtree(files_path, ignore_errors=True)
+            os.rename(tmp_path, files_path)
+        finally:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+    if bundle.weights_file is not None:
+        _weights[os.path.abspath(os.path.join(files_path, bundle.weights_file))] = bundle.weights()
+    return files_path
+
+
+def registered_weights(path):
+    """Weights of an unpacked bundle which replace the weights file, or None."""
+    return _weights.get(os.path.abspath(path))
+
+
+def restore_keras_weights(model, path):
+    """Load weights of a keras model from a bundle or from an .h5 file."""
+    weights = registered_weights(path)
+    if weights is None:
+        model.load_weights(path)
+    else:
+        model.set_weights(weights)
+
+
+def load_agent(bundle_path, opt=None):
+    """Create an agent from a bundle.
+
+    Args:
+        bundle_path: path to the bundle
+        opt: options overriding the saved ones
+
+    Returns:
+        agent
+    """
+    from parlai.core.agents import create_agent
+    bundle = Bundle(bundle_path)
+    files_path = unpack(bundle)
+    agent_opt = dict(bundle.opt)
+    for key, root in bundle.roots.items():
+        if isinstance(root, list):
+            agent_opt[key] = [os.path.join(files_path, r) for r in root]
+        else:
+            agent_opt[key] = os.path.join(files_path, root)
+    agent_opt.update(opt or {})
+    return create_agent(agent_opt)
+
+
+if __name__ == '__main__':
+    from parlai.core.agents import create_agent
+    from parlai.core.params import ParlaiParser
+    parser = ParlaiParser(True, True, model_argv=sys.argv[2:])
+    export_opt = parser.parse_args(args=sys.argv[2:])
+    export_opt['datatype'] = 'test'
+    if export_opt.get('model_files') and export_opt.get('bagging_folds_number', 0) > 1:
+        # the same models as build_utils.model tests
+        export_opt['model_files'] = ['{}_{}'.format(fname, i) for fname in export_opt['model_files']
+                                     for i in range(export_opt['bagging_folds_number'])]
+    export_agent(create_agent(export_opt), export_opt, sys.argv[1])
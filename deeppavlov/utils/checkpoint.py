@@ -0,0 +1,229 @@
+# Copyright 2017 Neural Networks and Deep Learning lab, MIPT
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Checkpoint saving off the training thread.
+
+A model saves itself in two steps: it takes an in-memory snapshot of everything
+it writes (weights, options, pickled objects) on the training thread, and then
+writes the snapshot to files. With the `async_save` option the second step runs
+in a background thread; a save of a model replaces its previous save if that
+one has not started yet. Every file is written under a temporary name and
+renamed, so a crash never leaves a half-written checkpoint.
+
+Call `flush()` before reading saved files back.
+"""
+
+import atexit
+import glob
+import os
+import threading
+import traceback
+from collections import OrderedDict
+from contextlib import contextmanager
+
+
+def _tmp_path(path):
+    return '{}.tmp{}'.format(path, os.getpid())
+
+
+@contextmanager
+def atomic_path(path):
+    """Yield a temporary path which is renamed to path if the context succeeds."""
+    tmp_path = _tmp_path(path)
+    try:
+        yield tmp_path
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+@contextmanager
+def atomic_file(path, mode='w'):
+    """Open a file which replaces path when it is closed successfully."""
+    with atomic_path(path) as tmp_path:
+        with open(tmp_path, mode) as f:
+            yield f
+
+
+def write_bytes(path, data):
+    """Write bytes to a file atomically."""
+    with atomic_file(path, 'wb') as f:
+        f.write(data)
+
+
+def keras_weights(model):
+    """Snapshot of the weights of a keras model.
+
+    Returns:
+        list of layer names and lists of (weight name, value) pairs, in the layout of model.save_weights
+    """
+    from keras import backend as K
+    layers = [(layer.name, layer.weights) for layer in model.layers]
+    values = K.batch_get_value([w for _, weights in layers for w in weights])
+    snapshot = []
+    start = 0
+    for name, weights in layers:
+        names = [w.name if getattr(w, 'name', None) else 'param_' + str(i) for i, w in enumerate(weights)]
+        snapshot.append((name, list(zip(names, values[start:start + len(weights)]))))
+        start += len(weights)
+    return snapshot
+
+
+def write_keras_weights(path, snapshot):
+    """Write a snapshot of keras weights to an .h5 file readable by model.load_weights."""
+    import h5py
+    from keras import __version__ as keras_version
+    from keras import backend as K
+    with atomic_path(path) as tmp_path:
+        with h5py.File(tmp_path, 'w') as f:
+            f.attrs['layer_names'] = [name.encode('utf8') for name, _ in snapshot]
+            f.attrs['backend'] = K.backend().encode('utf8')
+            f.attrs['keras_version'] = str(keras_version).encode('utf8')
+            for name, weights in snapshot:
+                group = f.create_group(name)
+                group.attrs['weight_names'] = [w_name.encode('utf8') for w_name, _ in weights]
+                for w_name, value in weights:
+                    dataset = group.create_dataset(w_name, value.shape, dtype=value.dtype)
+                    if not value.shape:
+                        dataset[()] = value
+                    else:
+                        dataset[:] = value
+
+
+def tf_variables(sess, saver):
+    """Snapshot of the variables saved by a tensorflow saver.
+
+    Returns:
+        names of variables in the checkpoint, their values and the meta graph
+    """
+    import tensorflow as tf
+    variables = sess.graph.get_collection(tf.GraphKeys.GLOBAL_VARIABLES)
+    names = [v.op.name for v in variables]
+    values = sess.run(variables)
+    meta_graph = tf.train.export_meta_graph(graph=sess.graph, saver_def=saver.saver_def)
+    return names, values, meta_graph
+
+
+def write_tf_checkpoint(prefix, snapshot):
+    """Write a snapshot of tensorflow variables as a checkpoint readable by saver.restore.
+
+    Variables are loaded into a separate CPU graph, so the training session is not used.
+    Files of the checkpoint are renamed one by one, the meta graph last.
+    """
+    import tensorflow as tf
+    names, values, meta_graph = snapshot
+    tmp_prefix = _tmp_path(prefix)
+    graph = tf.Graph()
+    with graph.as_default():
+        placeholders = [tf.placeholder(tf.as_dtype(value.dtype), value.shape) for value in values]
+        variables = {name: tf.Variable(p, name='var_' + str(i))
+                     for i, (name, p) in enumerate(zip(names, placeholders))}
+        saver = tf.train.Saver(variables)
+        config = tf.ConfigProto(device_count={'GPU': 0})
+        with tf.Session(graph=graph, config=config) as sess:
+            sess.run(tf.variables_initializer(list(variables.values())), feed_dict=dict(zip(placeholders, values)))
+            saver.save(sess, tmp_prefix, write_meta_graph=False, write_state=False)
+    write_bytes(tmp_prefix + '.meta', meta_graph.SerializeToString())
+    tmp_files = sorted(glob.glob(glob.escape(tmp_prefix) + '.*'), key=lambda f: f.endswith('.meta'))
+    for tmp_file in tmp_files:
+        os.replace(tmp_file, prefix + tmp_file[len(tmp_prefix):])
+    tf.train.update_checkpoint_state(os.path.dirname(prefix) or '.', prefix)
+
+
+class CheckpointWriter(object):
+    """Background thread writing checkpoints one by one.
+
+    Saves are keyed, usually by the path of a model; a save waiting in the queue
+    is replaced by a newer save with the same key.
+    """
+
+    def __init__(self):
+        self._pending = OrderedDict()
+        self._busy = False
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def submit(self, key, write):
+        """Queue a write, replacing a queued write with the same key.
+
+        Args:
+            key: name of the checkpoint
+            write: function writing the checkpoint
+        """
+        with self._cond:
+            if self._pending.pop(key, None) is not None:
+                print('[ checkpoint {} is replaced by a newer one before it was written ]'.format(key))
+            self._pending[key] = write
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='checkpoint-writer', daemon=True)
+                self._thread.start()
+            self._cond.notify_all()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                key, write = self._pending.popitem(last=False)
+                self._busy = True
+            try:
+                write()
+            except Exception:
+                print('[ saving checkpoint {} failed ]'.format(key))
+                traceback.print_exc()
+            finally:
+                with self._cond:
+                    self._busy = False
+                    self._cond.notify_all()
+
+    def flush(self):
+        """Wait until all queued checkpoints are written."""
+        with self._cond:
+            while self._pending or self._busy:
+                self._cond.wait()
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_writer():
+    """Checkpoint writer of the process."""
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = CheckpointWriter()
+            atexit.register(_writer.flush)
+    return _writer
+
+
+def save(opt, key, write):
+    """Write a checkpoint in the background if opt['async_save'] is set, or right away.
+
+    Args:
+        opt: options of the model
+        key: name of the checkpoint, e.g. the path it is saved to
+        write: function writing the snapshot taken by the caller
+    """
+    if opt.get('async_save'):
+        get_writer().submit(key, write)
+    else:
+        write()
+
+
+def flush():
+    """Wait until checkpoints saved in the background are written."""
+    if _writer is not None:
+        _writer.flush()
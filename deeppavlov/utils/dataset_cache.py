@@ -0,0 +1,218 @@
+# Copyright 2017 Neural Networks and Deep Learning lab, MIPT
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Compiled datasets of teachers.
+
+Raw files of a dataset are parsed once into records and compiled into a
+directory of memory-mappable arrays named by the dataset, the version of its
+parser and a content hash of the raw files, so a changed file or parser is
+compiled again and an unchanged one is never parsed twice:
+    <cache_dir>/<name>-v<version>-<hash>/
+        meta.json - number of records, fields and hash of the raw files
+        vocab.json - tokens of all token fields, a token id is its position
+        <field>.ids.npy, <field>.offsets.npy - token ids of records of a token field
+            concatenated and offsets of records in them
+        <field>.bytes.npy, <field>.offsets.npy - utf-8 text of records of a text field
+        <field>.values.npy - integers of records of a value field
+        split.<name>.npy - indices of records in a split (e.g. a fold)
+
+Token fields are strings split on single spaces, so ' '.join of the tokens of
+a record is exactly the original string.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+from array import array
+
+import numpy as np
+
+FORMAT_VERSION = 1
+META_FILE = 'meta.json'
+
+
+def content_hash(paths):
+    """Hash of names and contents of files."""
+    h = hashlib.sha1()
+    for path in sorted(paths):
+        h.update(os.path.basename(path).encode('utf-8') + b'\0')
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                h.update(chunk)
+        h.update(b'\0')
+    return h.hexdigest()[:16]
+
+
+def _save(path, values, dtype):
+    np.save(path, np.frombuffer(values, dtype=dtype) if len(values) else np.zeros(0, dtype=dtype))
+
+
+def compile_records(path, records, token_fields=(), text_fields=(), value_fields=(), source_hash=None):
+    """Compile records into memory-mappable arrays.
+
+    Files are written into a temporary directory which is renamed at the end,
+    so concurrent processes never see a partially compiled dataset.
+
+    Args:
+        path: directory of the compiled dataset
+        records: iterable of dicts with strings of token and text fields and integers of value fields
+        token_fields: fields kept as token ids
+        text_fields: fields kept as utf-8 text
+        value_fields: integer fields
+        source_hash: hash of raw files the records are parsed from
+
+    Returns:
+        path
+    """
+    tmp_path = '{}.tmp{}'.format(path, os.getpid())
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+    try:
+        vocab = {}
+        ids = {field: array('i') for field in token_fields}
+        blobs = {field: bytearray() for field in text_fields}
+        offsets = {field: array('q', [0]) for field in list(token_fields) + list(text_fields)}
+        values = {field: array('q') for field in value_fields}
+        n = 0
+        for record in records:
+            for field in token_fields:
+                field_ids = ids[field]
+                for token in record[field].split(' '):
+                    token_id = vocab.get(token)
+                    if token_id is None:
+                        token_id = vocab[token] = len(vocab)
+                    field_ids.append(token_id)
+                offsets[field].append(len(field_ids))
+            for field in text_fields:
+                blobs[field] += record[field].encode('utf-8')
+                offsets[field].append(len(blobs[field]))
+            for field in value_fields:
+                values[field].append(int(record[field]))
+            n += 1
+
+        for field in token_fields:
+            _save(os.path.join(tmp_path, field + '.ids.npy'), ids[field], np.int32)
+        for field in text_fields:
+            _save(os.path.join(tmp_path, field + '.bytes.npy'), blobs[field], np.uint8)
+        for field, field_offsets in offsets.items():
+            _save(os.path.join(tmp_path, field + '.offsets.npy'), field_offsets, np.int64)
+        for field in value_fields:
+            _save(os.path.join(tmp_path, field + '.values.npy'), values[field], np.int64)
+        with open(os.path.join(tmp_path, 'vocab.json'), 'w') as f:
+            json.dump(list(vocab), f, ensure_ascii=False)
+        meta = {'format': FORMAT_VERSION, 'records': n, 'source_hash': source_hash, 'token_fields': list(token_fields),
+                'text_fields': list(text_fields), 'value_fields': list(value_fields)}
+        with open(os.path.join(tmp_path, META_FILE), 'w') as f:
+            json.dump(meta, f)
+
+        try:
+            os.rename(tmp_path, path)
+        except OSError:
+            # another process has compiled the dataset first
+            if not os.path.isfile(os.path.join(path, META_FILE)):
+                raise
+    finally:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+    return path
+
+
+class CompiledDataset(object):
+    """Read-only records of a compiled dataset backed by memory-mapped arrays.
+
+    Attributes:
+        path: directory of the compiled dataset
+        vocab: tokens of token fields
+    """
+
+    def __init__(self, path):
+        with open(os.path.join(path, META_FILE)) as f:
+            self.meta = json.load(f)
+        self.path = path
+        with open(os.path.join(path, 'vocab.json')) as f:
+            self.vocab = json.load(f)
+        self._arrays = {}
+
+    def _array(self, name):
+        if name not in self._arrays:
+            self._arrays[name] = np.load(os.path.join(self.path, name + '.npy'), mmap_mode='r')
+        return self._arrays[name]
+
+    def __len__(self):
+        return self.meta['records']
+
+    def token_ids(self, field, i):
+        """Token ids of a token field of the i-th record."""
+        offsets = self._array(field + '.offsets')
+        return self._array(field + '.ids')[offsets[i]:offsets[i + 1]]
+
+    def tokens(self, field, i):
+        """Tokens of a token field of the i-th record."""
+        return [self.vocab[token_id] for token_id in self.token_ids(field, i).tolist()]
+
+    def text(self, field, i):
+        """String of a token or text field of the i-th record."""
+        if field in self.meta['token_fields']:
+            return ' '.join(self.tokens(field, i))
+        offsets = self._array(field + '.offsets')
+        return self._array(field + '.bytes')[offsets[i]:offsets[i + 1]].tobytes().decode('utf-8')
+
+    def value(self, field, i):
+        """Integer of a value field of the i-th record."""
+        return int(self._array(field + '.values')[i])
+
+    def split(self, name, compute):
+        """Indices of records in a split, computed and stored on first use.
+
+        Args:
+            name: name of the split, unique for arguments it is computed with
+            compute: function returning indices of the split
+
+        Returns:
+            array of indices
+        """
+        path = os.path.join(self.path, 'split.{}.npy'.format(name))
+        if not os.path.isfile(path):
+            tmp_path = '{}.tmp{}.npy'.format(path[:-len('.npy')], os.getpid())
+            np.save(tmp_path, np.asarray(compute(), dtype=np.int64))
+            os.replace(tmp_path, path)
+        return np.load(path, mmap_mode='r')
+
+
+def load(cache_dir, name, sources, version, parse, **fields):
+    """Load a compiled dataset, compiling it first if raw files or the parser have changed.
+
+    Args:
+        cache_dir: directory of compiled datasets
+        name: name of the dataset
+        sources: paths to raw files of the dataset
+        version: version of the parser, to be changed when it yields different records
+        parse: function returning an iterable of records parsed from the raw files
+        fields: token_fields, text_fields and value_fields of records as in compile_records
+
+    Returns:
+        CompiledDataset
+    """
+    source_hash = content_hash(sources)
+    prefix = '{}-v{}-'.format(name, version)
+    path = os.path.join(cache_dir, prefix + source_hash)
+    if not os.path.isfile(os.path.join(path, META_FILE)):
+        print('[ compiling dataset {} ]'.format(path))
+        os.makedirs(cache_dir, exist_ok=True)
+        compile_records(path, parse(), source_hash=source_hash, **fields)
+        # datasets compiled from older raw files are never loaded again
+        for old in os.listdir(cache_dir):
+            if old.startswith(prefix) and old != prefix + source_hash and '.tmp' not in old:
+                shutil.rmtree(os.path.join(cache_dir, old), ignore_errors=True)
+    return CompiledDataset(path)
@@ -0,0 +1,203 @@
+# Copyright 2017 Neural Networks and Deep Learning lab, MIPT
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Binary token embeddings dictionaries.
+
+A dictionary saved to <fname> is stored in one file <fname>.store:
+    8 bytes - magic string
+    8 bytes - little-endian length of the header
+    header - utf-8 JSON with the number of rows, the dimension and the list of
+        tokens in the order of matrix rows, padded to 64 bytes
+    float32 matrix of embeddings, opened with mmap
+
+The file is written under a temporary name and renamed once, so processes
+saving the same dictionary never leave tokens and rows that do not match.
+
+Old text dictionaries (a token and its embedding values on every line) are
+converted to the binary format on first load. Convert them in advance with:
+    python -m deeppavlov.utils.embeddings_store <embedding_dim> <fname> [<fname> ...]
+"""
+
+import json
+import os
+import struct
+import sys
+from collections.abc import MutableMapping
+
+import numpy as np
+
+
+MAGIC = b'DPEMBS01'
+ALIGNMENT = 64
+
+
+def _binary_path(fname):
+    return fname + '.store'
+
+
+class EmbeddingsStore(MutableMapping):
+    """Mapping from tokens to embeddings over a memory-mapped matrix.
+
+    Embeddings of added tokens are kept in memory until the store is saved.
+
+    Attributes:
+        matrix: float32 matrix of saved embeddings
+        index: dict from a saved token to its matrix row
+        added: dict from an added token to its embedding
+    """
+
+    def __init__(self, matrix=None, tokens=None):
+        self.matrix = matrix
+        self.index = {tok: i for i, tok in enumerate(tokens or [])}
+        self.added = {}
+
+    def __getitem__(self, tok):
+        try:
+            return self.added[tok]
+        except KeyError:
+            return self.matrix[self.index[tok]]
+
+    def __setitem__(self, tok, emb):
+        self.added[tok] = np.asarray(emb, dtype=np.float32)
+
+    def __delitem__(self, tok):
+        if tok in self.added:
+            del self.added[tok]
+        else:
+            del self.index[tok]
+
+    def __iter__(self):
+        for tok in self.index:
+            if tok not in self.added:
+                yield tok
+        yield from self.added
+
+    def __len__(self):
+        return len(self.index) + sum(1 for tok in self.added if tok not in self.index)
+
+    def snapshot(self):
+        """Copy of the store which is not changed by later additions.
+
+        The matrix and the index of saved tokens are shared, added embeddings are copied.
+        """
+        store = EmbeddingsStore()
+        store.matrix = self.matrix
+        store.index = self.index
+        store.added = dict(self.added)
+        return store
+
+    def save(self, fname):
+        """Write embeddings to <fname>.store.
+
+        The file is written under a temporary name and then renamed, so the
+        store may be saved over the file it is mapped from.
+        """
+        tokens = list(self)
+        path = _binary_path(fname)
+        dim = self.matrix.shape[1] if self.matrix is not None else len(next(iter(self.added.values()), []))
+        header = json.dumps({'rows': len(tokens), 'dim': dim, 'tokens': tokens}, ensure_ascii=False).encode('utf-8')
+        header += b' ' * (-(len(MAGIC) + 8 + len(header)) % ALIGNMENT)
+        tmp_path = '{}.tmp{}'.format(path, os.getpid())
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(MAGIC)
+                f.write(struct.pack('<Q', len(header)))
+                f.write(header)
+                for tok in tokens:
+                    f.write(np.asarray(self[tok], dtype='<f4').tobytes())
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+
+def _load_text(fname, embedding_dim):
+    """Read a text dictionary into an EmbeddingsStore."""
+    store = EmbeddingsStore()
+    with open(fname, 'r') as f:
+        for line in f:
+            values = line.rsplit(sep=' ', maxsplit=embedding_dim)
+            assert(len(values) == embedding_dim + 1)
+            store[values[0]] = np.asarray(values[1:], dtype='float32')
+    return store
+
+
+def _load_binary(fname):
+    """Open a binary dictionary.
+
+    Raises:
+        ValueError: if the file is not a complete embeddings dictionary
+    """
+    path = _binary_path(fname)
+    with open(path, 'rb') as f:
+        magic = f.read(len(MAGIC))
+        length = f.read(8)
+        if magic != MAGIC or len(length) != 8:
+            raise ValueError('{} is not an embeddings dictionary'.format(path))
+        header = f.read(struct.unpack('<Q', length)[0])
+    offset = len(MAGIC) + 8 + len(header)
+    meta = json.loads(header.decode('utf-8'))
+    rows, dim, tokens = meta['rows'], meta['dim'], meta['tokens']
+    if len(tokens) != rows or os.path.getsize(path) != offset + rows * dim * 4:
+        raise ValueError('embeddings dictionary {} is truncated or inconsistent: {} tokens, {} rows of {} values'
+                         .format(path, len(tokens), rows, dim))
+    if rows == 0:
+        matrix = np.zeros((0, dim), dtype=np.float32)
+    else:
+        matrix = np.memmap(path, dtype='<f4', mode='r', offset=offset, shape=(rows, dim))
+    return EmbeddingsStore(matrix, tokens)
+
+
+def is_binary(fname):
+    """Check that a binary dictionary exists and is not older than the text one."""
+    path = _binary_path(fname)
+    if not os.path.isfile(path):
+        return False
+    return not os.path.isfile(fname) or os.path.getmtime(path) >= os.path.getmtime(fname)
+
+
+def exists(fname):
+    """Check that a dictionary is saved in the binary or the text format."""
+    return is_binary(fname) or os.path.isfile(fname)
+
+
+def load(fname, embedding_dim):
+    """Load embeddings dictionary saved to fname.
+
+    A text dictionary is converted to the binary format next to it.
+
+    Args:
+        fname: name of the dictionary
+        embedding_dim: dimension of embeddings
+
+    Returns:
+        EmbeddingsStore, empty if there is no dictionary
+    """
+    if is_binary(fname):
+        return _load_binary(fname)
+    if not os.path.isfile(fname):
+        return EmbeddingsStore()
+    print('[ converting text embeddings dictionary {} to binary ]'.format(fname))
+    store = _load_text(fname, embedding_dim)
+    try:
+        store.save(fname)
+    except OSError as e:
+        print('[ can not save binary embeddings dictionary {}: {} ]'.format(fname, e))
+        return store
+    return _load_binary(fname)
+
+
+if __name__ == '__main__':
+    for path in sys.argv[2:]:
+        load(path, int(sys.argv[1]))
@@ -0,0 +1,105 @@
+# Copyright 2017 Neural Networks and Deep Learning lab, MIPT
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+from contextlib import contextmanager
+
+DEFAULT_MAX_SIZE = 10000
+
+
+class ExampleCache(object):
+    """Memory cache of tensorized examples.
+
+    Agents keep examples observed without labels, so the validation set is
+    tokenized and embedded on the first validation round only and next rounds
+    run forward passes. The cache is disabled until the agent is validated,
+    see `caching`. It keeps the first `max_size` examples: validation reads
+    examples in the same order every round, so evicting old examples would
+    make every lookup miss once the validation set is larger than the cache.
+    Cached values are shared between calls and must not be changed in place.
+
+    Attributes:
+        enabled: if False every example is built again
+        max_size: maximal number of cached examples
+        examples: dict from example key to tensorized example
+        hits: number of examples taken from the cache
+        misses: number of built examples
+    """
+
+    def __init__(self, enabled=False, max_size=None):
+        self.enabled = enabled
+        self.max_size = DEFAULT_MAX_SIZE if max_size is None else max_size
+        self.examples = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, build, *args):
+        """Return a cached example or build and cache it.
+
+        Args:
+            key: hashable key of the example, e.g. text of the observation
+            build: function which tensorizes the example
+            *args: arguments of the build function
+
+        Returns:
+            tensorized example
+        """
+        if not self.enabled or self.max_size <= 0:
+            return build(*args)
+        try:
+            example = self.examples[key]
+            self.hits += 1
+        except KeyError:
+            example = build(*args)
+            self.misses += 1
+            if len(self.examples) < self.max_size:
+                self.examples[key] = example
+        return example
+
+    def clear(self):
+        """Drop all cached examples."""
+        self.examples = {}
+
+    def __len__(self):
+        return len(self.examples)
+
+
+def _caches(agent):
+    """Example caches of an agent and of its models."""
+    owners = [agent, getattr(agent, 'model', None)] + list(getattr(agent, 'models', None) or [])
+    caches = []
+    for owner in owners:
+        cache = getattr(owner, 'example_cache', None)
+        if isinstance(cache, ExampleCache):
+            caches.append(cache)
+    return caches
+
+
+@contextmanager
+def caching(agent, enabled=True):
+    """Enable example caches of the agent inside the context.
+
+    Args:
+        agent: agent whose caches are enabled
+        enabled: if False caches are left as they are
+    """
+    caches = _caches(agent) if enabled else []
+    states = [cache.enabled for cache in caches]
+    for cache in caches:
+        cache.enabled = True
+    try:
+        yield
+    finally:
+        for cache, state in zip(caches, states):
+            cache.enabled = state
@@ -0,0 +1,328 @@
+# Copyright 2017 Neural Networks and Deep Learning lab, MIPT
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Memory-mapped fasttext word vectors.
+
+A fasttext binary model is converted once into a directory of numpy arrays next
+to it (<model>.bin.mmap):
+    meta.json - dimension, subword parameters and the source file stamp
+    vectors.npy - float32 [nwords, dim] vectors of vocabulary words
+    buckets.npy - float32 [bucket, dim] vectors of subword hash buckets
+    word_hashes.npy, word_ids.npy - sorted 64-bit hashes of words and their indices
+    words.txt - vocabulary words, one per line
+
+The arrays are opened with mmap, so all processes and agents using the same
+model share the page cache and loading takes no time. Vectors of out of
+vocabulary words are composed from subword buckets the same way as fasttext does.
+
+Convert a model in advance with:
+    python -m deeppavlov.utils.fasttext_mmap <model>.bin
+"""
+
+import json
+import mmap
+import os
+import shutil
+import struct
+import sys
+
+import numpy as np
+
+
+FASTTEXT_MAGIC = 793712314
+FASTTEXT_SUPERVISED = 3
+META_FILE = 'meta.json'
+# rows of the input matrix read at once while converting, bounds memory to CHUNK_ROWS * dim floats
+CHUNK_ROWS = 65536
+
+
+def fasttext_hash(data):
+    """32-bit FNV-1a hash of bytes as computed by fasttext (bytes are sign-extended)."""
+    h = 2166136261
+    for b in data:
+        h = ((h ^ (b | 0xFFFFFF00 if b > 127 else b)) * 16777619) & 0xFFFFFFFF
+    return h
+
+
+def word_hash(data):
+    """64-bit FNV-1a hash of bytes, used to index vocabulary words."""
+    h = 14695981039346656037
+    for b in data:
+        h = ((h ^ b) * 1099511628211) & 0xFFFFFFFFFFFFFFFF
+    return h
+
+
+def subword_buckets(word, minn, maxn, bucket):
+    """Indices of subword buckets of a word, the same as fasttext computeNgrams.
+
+    Args:
+        word: utf-8 encoded word
+        minn: min length of char ngram
+        maxn: max length of char ngram
+        bucket: number of buckets
+
+    Returns:
+        list of bucket indices
+    """
+    word = b'<' + word + b'>'
+    buckets = []
+    for i in range(len(word)):
+        if word[i] & 0xC0 == 0x80:
+            continue
+        j = i
+        n = 1
+        while j < len(word) and n <= maxn:
+            j += 1
+            while j < len(word) and word[j] & 0xC0 == 0x80:
+                j += 1
+            if n >= minn and not (n == 1 and (i == 0 or j == len(word))):
+                buckets.append(fasttext_hash(word[i:j]) % bucket)
+            n += 1
+    return buckets
+
+
+def _source_stamp(bin_path):
+    stat = os.stat(bin_path)
+    return {'size': stat.st_size, 'mtime': int(stat.st_mtime)}
+
+
+def _read_header(bin_path):
+    """Read args and vocabulary of a fasttext binary model.
+
+    Returns:
+        args dict, list of vocabulary words (bytes), offset of the input matrix data, its shape
+    """
+    with open(bin_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        pos = 0
+        version = None
+        magic, = struct.unpack_from('<i', mm, pos)
+        if magic == FASTTEXT_MAGIC:
+            version, = struct.unpack_from('<i', mm, pos + 4)
+            pos += 8
+
+        names = ('dim', 'ws', 'epoch', 'min_count', 'neg', 'word_ngrams', 'loss', 'model', 'bucket', 'minn', 'maxn',
+                 'lr_update_rate', 't')
+        args = dict(zip(names, struct.unpack_from('<12id', mm, pos)))
+        pos += struct.calcsize('<12id')
+        if version == 11 and args['model'] == FASTTEXT_SUPERVISED:
+            # old supervised models do not use char ngrams
+            args['maxn'] = 0
+
+        size, nwords, _, _ = struct.unpack_from('<3iq', mm, pos)
+        pos += struct.calcsize('<3iq')
+        prune_size = -1
+        if version is not None:
+            prune_size, = struct.unpack_from('<q', mm, pos)
+            pos += 8
+
+        words = []
+        for _ in range(size):
+            end = mm.find(b'\0', pos)
+            if end < 0:
+                raise ValueError('{} is not a fasttext binary model'.format(bin_path))
+            if mm[end + 9] == 0:
+                words.append(mm[pos:end])
+            pos = end + 10
+        if len(words) != nwords:
+            raise ValueError('{} is not a fasttext binary model'.format(bin_path))
+
+        if version is not None:
+            if prune_size > 0:
+                raise ValueError('pruned fasttext models are not supported')
+            if mm[pos]:
+                raise ValueError('quantized fasttext models are not supported')
+            pos += 1
+
+        rows, dim = struct.unpack_from('<2q', mm, pos)
+        pos += 16
+        if dim != args['dim'] or rows != nwords + args['bucket'] or pos + rows * dim * 4 > len(mm):
+            raise ValueError('{} is not a fasttext binary model'.format(bin_path))
+    args['version'] = version
+    args['nwords'] = nwords
+    return args, words, pos, (rows, dim)
+
+
+def convert(bin_path, mmap_path=None):
+    """Convert a fasttext binary model into memory-mappable arrays.
+
+    Files are written into a temporary directory which is renamed at the end,
+    so concurrent processes never see a partially written model.
+
+    Args:
+        bin_path: path to the fasttext .bin file
+        mmap_path: output directory, defaults to <bin_path>.mmap
+
+    Returns:
+        path to the output directory
+    """
+    mmap_path = mmap_path or bin_path + '.mmap'
+    print('[ converting fasttext model {} to {} ]'.format(bin_path, mmap_path))
+    args, words, offset, shape = _read_header(bin_path)
+    nwords = args['nwords']
+    hashes = np.array([word_hash(w) for w in words], dtype=np.uint64)
+    order = np.argsort(hashes, kind='mergesort')
+    if len(np.unique(hashes)) != len(hashes):
+        raise ValueError('hash collision in vocabulary of {}'.format(bin_path))
+
+    tmp_path = '{}.tmp{}'.format(mmap_path, os.getpid())
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+    try:
+        matrix = np.memmap(bin_path, dtype=np.float32, mode='r', offset=offset, shape=shape)
+        np.save(os.path.join(tmp_path, 'word_hashes.npy'), hashes[order])
+        np.save(os.path.join(tmp_path, 'word_ids.npy'), order.astype(np.int32))
+        with open(os.path.join(tmp_path, 'words.txt'), 'wb') as f:
+            f.write(b'\n'.join(words) + b'\n')
+
+        buckets = np.lib.format.open_memmap(os.path.join(tmp_path, 'buckets.npy'), mode='w+', dtype=np.float32,
+                                            shape=(args['bucket'], shape[1]))
+        for start in range(0, args['bucket'], CHUNK_ROWS):
+            end = min(start + CHUNK_ROWS, args['bucket'])
+            buckets[start:end] = matrix[nwords + start:nwords + end]
+        buckets.flush()
+
+        # vector of a vocabulary word is a mean of its own row and rows of its subwords
+        vectors = np.lib.format.open_memmap(os.path.join(tmp_path, 'vectors.npy'), mode='w+', dtype=np.float32,
+                                            shape=(nwords, shape[1]))
+        start = 0
+        rows = []
+        lengths = []
+        for i, word in enumerate(words):
+            ids = [i]
+            if args['maxn'] > 0:
+                ids.extend(nwords + b for b in subword_buckets(word, args['minn'], args['maxn'], args['bucket']))
+            rows.extend(ids)
+            lengths.append(len(ids))
+            if len(rows) >= CHUNK_ROWS or i == nwords - 1:
+                offsets = np.cumsum([0] + lengths[:-1])
+                sums = np.add.reduceat(matrix[rows], offsets, axis=0)
+                vectors[start:i + 1] = sums / np.array(lengths, dtype=np.float32)[:, None]
+                start = i + 1
+                rows = []
+                lengths = []
+        vectors.flush()
+        del buckets, vectors, matrix
+
+        meta = {key: args[key] for key in ('dim', 'minn', 'maxn', 'bucket', 'nwords', 'version')}
+        meta['source'] = _source_stamp(bin_path)
+        with open(os.path.join(tmp_path, META_FILE), 'w') as f:
+            json.dump(meta, f)
+
+        if os.path.isdir(mmap_path):
+            shutil.rmtree(mmap_path, ignore_errors=True)
+        try:
+            os.rename(tmp_path, mmap_path)
+        except OSError:
+            # another process has converted the model first
+            if not os.path.isfile(os.path.join(mmap_path, META_FILE)):
+                raise
+    finally:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+    return mmap_path
+
+
+class FastTextMmap(object):
+    """Read-only fasttext word vectors backed by memory-mapped arrays.
+
+    Attributes:
+        dim: dimension of vectors
+        minn: min length of char ngram
+        maxn: max length of char ngram
+        bucket: number of subword buckets
+        vectors: vectors of vocabulary words
+        buckets: vectors of subword buckets
+    """
+
+    def __init__(self, mmap_path):
+        with open(os.path.join(mmap_path, META_FILE)) as f:
+            meta = json.load(f)
+        self.path = mmap_path
+        self.dim = meta['dim']
+        self.minn = meta['minn']
+        self.maxn = meta['maxn']
+        self.bucket = meta['bucket']
+        self.vectors = np.load(os.path.join(mmap_path, 'vectors.npy'), mmap_mode='r')
+        self.buckets = np.load(os.path.join(mmap_path, 'buckets.npy'), mmap_mode='r')
+        self.word_hashes = np.load(os.path.join(mmap_path, 'word_hashes.npy'), mmap_mode='r')
+        self.word_ids = np.load(os.path.join(mmap_path, 'word_ids.npy'), mmap_mode='r')
+        self._words = None
+
+    def get_word_id(self, word):
+        """Index of a word in the vocabulary or -1."""
+        h = np.uint64(word_hash(word.encode('utf-8')))
+        i = int(np.searchsorted(self.word_hashes, h))
+        if i < len(self.word_hashes) and self.word_hashes[i] == h:
+            return int(self.word_ids[i])
+        return -1
+
+    def __getitem__(self, word):
+        i = self.get_word_id(word)
+        if i >= 0:
+            return np.array(self.vectors[i])
+        ids = subword_buckets(word.encode('utf-8'), self.minn, self.maxn, self.bucket) if self.maxn > 0 else []
+        if not ids:
+            return np.zeros(self.dim, dtype=np.float32)
+        return self.buckets[ids].mean(axis=0)
+
+    def __contains__(self, word):
+        return self.get_word_id(word) >= 0
+
+    def __len__(self):
+        return len(self.vectors)
+
+    @property
+    def words(self):
+        """List of vocabulary words, read on first access."""
+        if self._words is None:
+            with open(os.path.join(self.path, 'words.txt'), 'rb') as f:
+                self._words = [w.decode('utf-8', errors='replace') for w in f.read().split(b'\n')[:-1]]
+        return self._words
+
+
+def is_converted(bin_path, mmap_path=None):
+    """Check that a memory-mapped copy of the binary model exists and is up to date."""
+    mmap_path = mmap_path or bin_path + '.mmap'
+    try:
+        with open(os.path.join(mmap_path, META_FILE)) as f:
+            return json.load(f).get('source') == _source_stamp(bin_path)
+    except (OSError, ValueError):
+        return False
+
+
+def load_model(bin_path):
+    """Load fasttext word vectors from the memory-mapped copy of a binary model.
+
+    The model is converted on first use. If it can not be converted (e.g. the
+    model is quantized or the directory is read-only), it is loaded with fasttext.
+
+    Args:
+        bin_path: path to the fasttext .bin file
+
+    Returns:
+        FastTextMmap or fasttext model, both give a word vector by model[word]
+    """
+    mmap_path = bin_path + '.mmap'
+    try:
+        if not is_converted(bin_path, mmap_path):
+            convert(bin_path, mmap_path)
+        return FastTextMmap(mmap_path)
+    except (OSError, ValueError) as e:
+        print('[ can not memory-map fasttext model {}: {}, loading it with fasttext ]'.format(bin_path, e))
+        import fasttext
+        return fasttext.load_model(bin_path)
+
+
+if __name__ == '__main__':
+    for path in sys.argv[1:]:
+        convert(path)
@@ -0,0 +1,193 @@
+# Copyright 2017 Neural Networks and Deep Learning lab, MIPT
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Frozen inference graphs of trained agents.
+
+A frozen graph holds only the subgraph computing predictions of a model:
+variables are replaced by constants, the optimizer, losses and training inputs
+are stripped, and dropout is not built into it. Constant subgraphs and batch
+normalizations are folded when tensorflow graph transforms are available.
+The graph is written to <path>, names of its inputs and outputs and parameters
+of the model needed to feed it (e.g. the padded sequence length) to <path>.json.
+
+Export a trained model with the arguments used to test it:
+    python -m deeppavlov.utils.frozen_graph <path> -m <agent> -mf <model_file> ...
+and test or serve it with the same arguments and `--frozen-model <path>`.
+"""
+
+import json
+import sys
+
+from . import checkpoint, tf_session
+
+TRANSFORMS = ['remove_nodes(op=Identity, op=CheckNumerics)',
+              'fold_constants(ignore_errors=true)',
+              'fold_batch_norms',
+              'fold_old_batch_norms']
+
+
+def add_cmdline_args(argparser):
+    """Add frozen graph arguments to the parser."""
+    group = argparser.add_argument_group('Frozen Graph Arguments')
+    group.add_argument('--frozen-model', type=str, default=None,
+                       help='predict with a frozen inference graph exported by deeppavlov.utils.frozen_graph, '
+                            'the model can not be trained then')
+
+
+def _node_name(tensor_name):
+    return tensor_name.split(':')[0]
+
+
+def _optimize(graph_def, input_nodes, output_nodes):
+    """Fold constants and batch normalizations, the graph is returned as is without graph transforms."""
+    try:
+        from tensorflow.tools.graph_transforms import TransformGraph
+    except ImportError:
+        return graph_def
+    return TransformGraph(graph_def, input_nodes, output_nodes, TRANSFORMS)
+
+
+def freeze(sess, inputs, outputs, path, params=None):
+    """Write the subgraph computing outputs from inputs as a frozen graph.
+
+    Args:
+        sess: session holding values of variables
+        inputs: list of (name, placeholder) pairs, placeholders not needed for outputs are skipped
+        outputs: list of (name, tensor) pairs
+        path: path to the frozen graph
+        params: dict of model parameters saved with the graph
+    """
+    from tensorflow.python.framework import graph_util
+    for name, tensor in inputs:
+        if tensor.op.type != 'Placeholder':
+            raise ValueError('input {} of a frozen graph must be a placeholder, not {}'.format(name, tensor.op.type))
+    output_nodes = sorted({tensor.op.name for _, tensor in outputs})
+    graph_def = graph_util.convert_variables_to_constants(sess, sess.graph.as_graph_def(), output_nodes)
+    nodes = {node.name for node in graph_def.node}
+    inputs = [(name, tensor.name) for name, tensor in inputs if tensor.op.name in nodes]
+    graph_def = _optimize(graph_def, [_node_name(t) for _, t in inputs], output_nodes)
+    signature = {'inputs': inputs, 'outputs': [(name, tensor.name) for name, tensor in outputs],
+                 'params': params or {}}
+
+    checkpoint.write_bytes(path, graph_def.SerializeToString())
+    with checkpoint.atomic_file(path + '.json') as f:
+        json.dump(signature, f)
+    print('[ frozen graph is saved to {} ]'.format(path))
+
+
+def export_keras(build_model, weights, path, opt=None, params=None):
+    """Write a keras model rebuilt for inference as a frozen graph.
+
+    The model is built in a new graph in the test learning phase, so dropout and
+    batch statistics are not in it, and is not compiled, so it has no optimizer.
+
+    Args:
+        build_model: function building the uncompiled model
+        weights: weights of the trained model, as returned by model.get_weights()
+        path: path to the frozen graph
+        opt: options of the agent with session arguments
+        params: dict of model parameters saved with the graph
+    """
+    from keras import backend as K
+    with tf_session.create_graph_session(opt, use_gpu=False) as sess, tf_session.scope(sess):
+        K.set_learning_phase(0)
+        model = build_model()
+        model.set_weights(weights)
+        freeze(sess, list(zip(model.input_names, model.inputs)), list(zip(model.output_names, model.outputs)), path,
+               params)
+
+
+class FrozenGraph(object):
+    """Frozen inference graph with its own session.
+
+    Attributes:
+        path: path to the frozen graph
+        input_names: names of inputs in the order taken by predict
+        output_names: names of outputs in the order returned by predict
+        params: dict of model parameters saved with the graph
+        graph: tensorflow graph
+        sess: tensorflow session
+    """
+
+    def __init__(self, path, opt=None, **config_args):
+        """Load a frozen graph.
+
+        Ops of custom op libraries used by the graph must be loaded before.
+
+        Args:
+            path: path to the frozen graph
+            opt: options of the agent with session arguments
+            config_args: arguments of tf_session.session_config
+        """
+        import tensorflow as tf
+        self.path = path
+        with open(path + '.json') as f:
+            signature = json.load(f)
+        graph_def = tf.GraphDef()
+        with open(path, 'rb') as f:
+            graph_def.ParseFromString(f.read())
+        self._nbytes = sum(len(node.attr['value'].tensor.tensor_content)
+                           for node in graph_def.node if node.op == 'Const')
+        self.graph = tf.Graph()
+        with self.graph.as_default():
+            tf.import_graph_def(graph_def, name='')
+        self.input_names = [name for name, _ in signature['inputs']]
+        self.output_names = [name for name, _ in signature['outputs']]
+        self.params = signature.get('params', {})
+        self._inputs = [self.graph.get_tensor_by_name(t) for _, t in signature['inputs']]
+        self._outputs = [self.graph.get_tensor_by_name(t) for _, t in signature['outputs']]
+        self.sess = tf_session.create_session(opt, graph=self.graph, **config_args)
+        print('[ frozen graph is loaded from {} ]'.format(path))
+
+    def predict(self, inputs):
+        """Compute outputs of the graph.
+
+        Args:
+            inputs: list of input values in the order of input_names, or dict from
+                input names to values, where values of inputs not in the graph are ignored
+
+        Returns:
+            list of output values in the order of output_names
+        """
+        if isinstance(inputs, dict):
+            feed_dict = {tensor: inputs[name] for name, tensor in zip(self.input_names, self._inputs)}
+        else:
+            if len(inputs) != len(self._inputs):
+                raise ValueError('frozen graph {} takes {} inputs, got {}'.format(self.path, len(self._inputs),
+                                                                                  len(inputs)))
+            feed_dict = dict(zip(self._inputs, inputs))
+        return self.sess.run(self._outputs, feed_dict=feed_dict)
+
+    def nbytes(self):
+        """Size of constants (frozen weights) of the graph."""
+        return self._nbytes
+
+    def close(self):
+        self.sess.close()
+
+
+def export_agent(agent, path):
+    """Write the frozen inference graph of an agent which defines export_frozen."""
+    if not hasattr(agent, 'export_frozen'):
+        raise RuntimeError('{} can not export a frozen graph'.format(type(agent).__name__))
+    agent.export_frozen(path)
+
+
+if __name__ == '__main__':
+    from parlai.core.agents import create_agent
+    from parlai.core.params import ParlaiParser
+    parser = ParlaiParser(True, True, model_argv=sys.argv[2:])
+    export_opt = parser.parse_args(args=sys.argv[2:])
+    export_opt['datatype'] = 'test'
+    export_agent(create_agent(export_opt), sys.argv[1])
@@ -0,0 +1,184 @@
+# Copyright 2017 Neural Networks and Deep Learning lab, MIPT
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Memory-mapped GloVe word vectors.
+
+A text file of GloVe vectors is converted once into a directory next to it
+(<vectors>.txt.mmap):
+    meta.json - number of words, dimension and the source file stamp
+    vectors.bin - float32 [nwords, dim] vectors
+    word_hashes.npy, word_ids.npy - sorted 64-bit hashes of words and their rows
+    words.txt - words, one per line
+
+Words are normalized to the unicode NFD form. If a normalized word occurs more
+than once, its last vector is used.
+
+Convert vectors in advance with:
+    python -m deeppavlov.utils.glove_mmap <vectors>.txt
+"""
+
+import json
+import os
+import shutil
+import sys
+import unicodedata
+
+import numpy as np
+
+from .fasttext_mmap import word_hash
+
+
+META_FILE = 'meta.json'
+
+
+def _source_stamp(txt_path):
+    stat = os.stat(txt_path)
+    return {'size': stat.st_size, 'mtime': int(stat.st_mtime)}
+
+
+def convert(txt_path, mmap_path=None):
+    """Convert a text file of GloVe vectors into memory-mappable arrays in one pass.
+
+    Files are written into a temporary directory which is renamed at the end,
+    so concurrent processes never see a partially converted file.
+
+    Args:
+        txt_path: path to the text file of vectors
+        mmap_path: output directory, defaults to <txt_path>.mmap
+
+    Returns:
+        path to the output directory
+    """
+    mmap_path = mmap_path or txt_path + '.mmap'
+    print('[ converting embeddings {} to {} ]'.format(txt_path, mmap_path))
+    tmp_path = '{}.tmp{}'.format(mmap_path, os.getpid())
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+    try:
+        rows = {}
+        words = []
+        dim = None
+        with open(txt_path) as f, open(os.path.join(tmp_path, 'vectors.bin'), 'wb') as out:
+            for line in f:
+                parsed = line.rstrip().split(' ')
+                if len(parsed) == 2:
+                    # header of word2vec-like files
+                    continue
+                if dim is None:
+                    dim = len(parsed) - 1
+                if len(parsed) != dim + 1:
+                    raise ValueError('{} has vectors of different dimensions'.format(txt_path))
+                rows[unicodedata.normalize('NFD', parsed[0])] = len(words)
+                words.append(parsed[0])
+                out.write(np.array(parsed[1:], dtype=np.float32).tobytes())
+
+        hashes = np.array([word_hash(w.encode('utf-8')) for w in rows], dtype=np.uint64)
+        ids = np.array(list(rows.values()), dtype=np.int64)
+        order = np.argsort(hashes, kind='mergesort')
+        if len(np.unique(hashes)) != len(hashes):
+            raise ValueError('hash collision in vocabulary of {}'.format(txt_path))
+        np.save(os.path.join(tmp_path, 'word_hashes.npy'), hashes[order])
+        np.save(os.path.join(tmp_path, 'word_ids.npy'), ids[order])
+        with open(os.path.join(tmp_path, 'words.txt'), 'w') as f:
+            f.write('\n'.join(rows) + '\n')
+
+        meta = {'dim': dim or 0, 'nrows': len(words), 'nwords': len(rows), 'source': _source_stamp(txt_path)}
+        with open(os.path.join(tmp_path, META_FILE), 'w') as f:
+            json.dump(meta, f)
+
+        if os.path.isdir(mmap_path):
+            shutil.rmtree(mmap_path, ignore_errors=True)
+        try:
+            os.rename(tmp_path, mmap_path)
+        except OSError:
+            # another process has converted the vectors first
+            if not os.path.isfile(os.path.join(mmap_path, META_FILE)):
+                raise
+    finally:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+    return mmap_path
+
+
+class GloveMmap(object):
+    """Read-only GloVe vectors backed by memory-mapped arrays.
+
+    Words are looked up by their 64-bit hashes, so the vocabulary is not loaded
+    into memory.
+
+    Attributes:
+        dim: dimension of vectors
+        vectors: vectors of words
+    """
+
+    def __init__(self, mmap_path):
+        with open(os.path.join(mmap_path, META_FILE)) as f:
+            meta = json.load(f)
+        self.path = mmap_path
+        self.dim = meta['dim']
+        self.source = meta['source']
+        self.nwords = meta['nwords']
+        self.vectors = np.memmap(os.path.join(mmap_path, 'vectors.bin'), dtype=np.float32, mode='r',
+                                 shape=(meta['nrows'], self.dim)) if meta['nrows'] else np.zeros((0, self.dim))
+        self.word_hashes = np.load(os.path.join(mmap_path, 'word_hashes.npy'), mmap_mode='r')
+        self.word_ids = np.load(os.path.join(mmap_path, 'word_ids.npy'), mmap_mode='r')
+
+    def get_word_id(self, word):
+        """Row of a normalized word in the vectors matrix or -1."""
+        h = np.uint64(word_hash(word.encode('utf-8')))
+        i = int(np.searchsorted(self.word_hashes, h))
+        if i < len(self.word_hashes) and self.word_hashes[i] == h:
+            return int(self.word_ids[i])
+        return -1
+
+    def __getitem__(self, word):
+        i = self.get_word_id(word)
+        if i < 0:
+            raise KeyError(word)
+        return self.vectors[i]
+
+    def __contains__(self, word):
+        return self.get_word_id(word) >= 0
+
+    def __len__(self):
+        return self.nwords
+
+
+def is_converted(txt_path, mmap_path=None):
+    """Check that a memory-mapped copy of the vectors exists and is up to date."""
+    mmap_path = mmap_path or txt_path + '.mmap'
+    try:
+        with open(os.path.join(mmap_path, META_FILE)) as f:
+            return json.load(f).get('source') == _source_stamp(txt_path)
+    except (OSError, ValueError):
+        return False
+
+
+def load_vectors(txt_path):
+    """Load GloVe vectors from the memory-mapped copy of a text file, converting it on first use.
+
+    Args:
+        txt_path: path to the text file of vectors
+
+    Returns:
+        GloveMmap
+    """
+    mmap_path = txt_path + '.mmap'
+    if not is_converted(txt_path, mmap_path):
+        convert(txt_path, mmap_path)
+    return GloveMmap(mmap_path)
+
+
+if __name__ == '__main__':
+    for path in sys.argv[1:]:
+        convert(path)
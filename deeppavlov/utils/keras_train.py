@@ -0,0 +1,47 @@
+# Copyright 2017 Neural Networks and Deep Learning lab, MIPT
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from keras import backend as K
+
+
+def train_on_batch_with_predictions(model, x, y):
+    """Make one training step of a compiled keras model and return its outputs.
+
+    The outputs are fetched in the same session run as the update, so they come
+    from the forward pass of the training step: computed with weights before the
+    update and in the training phase (e.g. with dropout).
+
+    Args:
+        model: compiled keras model
+        x: inputs as for model.train_on_batch
+        y: targets as for model.train_on_batch
+
+    Returns:
+        list of the loss and metrics values (as returned by model.train_on_batch)
+        list of arrays of model outputs
+    """
+    model._make_train_function()
+    train_function = model.train_function
+    if getattr(model, '_train_predict_source', None) is not train_function:
+        model._train_predict_function = K.function(train_function.inputs,
+                                                   train_function.outputs + model.outputs,
+                                                   updates=[train_function.updates_op])
+        model._train_predict_source = train_function
+    x, y, sample_weights = model._standardize_user_data(x, y, check_batch_axis=True)
+    ins = x + y + sample_weights
+    if model.uses_learning_phase and not isinstance(K.learning_phase(), int):
+        ins += [1.]
+    outputs = model._train_predict_function(ins)
+    n_metrics = len(train_function.outputs)
+    return outputs[:n_metrics], outputs[n_metrics:]
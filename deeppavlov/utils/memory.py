@@ -0,0 +1,140 @@
+# Copyright 2017 Neural Networks and Deep Learning lab, MIPT
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Memory accounting of agents.
+
+Agents define `memory_report()` returning `report(parts)`, where parts are
+sizes of their large structures (embedding tables, example caches, feature
+dicts, network variables) in bytes. The training loop logs the report with the
+resident and peak resident memory of the process.
+"""
+
+import mmap
+import sys
+from collections import deque
+
+import numpy as np
+
+
+def _array_bytes(array):
+    """Bytes of an array owning its data, arrays over memory-mapped files are free."""
+    if array.base is None:
+        return array.nbytes
+    return 0
+
+
+def nbytes(obj):
+    """Approximate memory held by an object and everything it references.
+
+    Containers, arrays and objects of deeppavlov classes are followed, other
+    objects (e.g. networks and sessions) are counted by their own size only.
+    Arrays backed by memory-mapped files are not counted.
+    """
+    seen = set()
+    total = 0
+    stack = [obj]
+    while stack:
+        o = stack.pop()
+        if id(o) in seen:
+            continue
+        seen.add(id(o))
+        if isinstance(o, np.ndarray):
+            total += _array_bytes(o)
+            if o.base is not None:
+                stack.append(o.base)
+            continue
+        if isinstance(o, mmap.mmap):
+            continue
+        total += sys.getsizeof(o)
+        if isinstance(o, dict):
+            stack.extend(o.keys())
+            stack.extend(o.values())
+        elif isinstance(o, (list, tuple, set, frozenset, deque)):
+            stack.extend(o)
+        elif type(o).__module__.startswith('deeppavlov') and hasattr(o, '__dict__'):
+            stack.append(o.__dict__)
+    return total
+
+
+def mapped_bytes(array):
+    """Size of a memory-mapped array, 0 for arrays in memory and None."""
+    if array is None:
+        return 0
+    base = array
+    while isinstance(base, np.ndarray):
+        base = base.base
+    return array.nbytes if isinstance(base, mmap.mmap) else 0
+
+
+def variables_bytes(variables):
+    """Size of tensorflow variables (also weights of keras models)."""
+    total = 0
+    for v in variables:
+        shape = v.get_shape()
+        if shape.is_fully_defined():
+            total += shape.num_elements() * v.dtype.base_dtype.size
+    return total
+
+
+def graph_variables_bytes(graph):
+    """Size of global variables of a tensorflow graph."""
+    import tensorflow as tf
+    return variables_bytes(graph.get_collection(tf.GraphKeys.GLOBAL_VARIABLES))
+
+
+def process_memory():
+    """Resident and peak resident memory of the process in bytes."""
+    memory = {}
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                key, _, value = line.partition(':')
+                if key == 'VmRSS':
+                    memory['rss'] = int(value.split()[0]) * 1024
+                elif key == 'VmHWM':
+                    memory['peak_rss'] = int(value.split()[0]) * 1024
+    except OSError:
+        pass
+    if 'peak_rss' not in memory:
+        try:
+            import resource
+        except ImportError:
+            return memory
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # kilobytes on linux, bytes on macOS
+        memory['peak_rss'] = peak if sys.platform == 'darwin' else peak * 1024
+    return memory
+
+
+def _mb(value):
+    return round(value / 2 ** 20, 1)
+
+
+def report(parts):
+    """Memory report in megabytes.
+
+    Args:
+        parts: dict from a name of a structure to its size in bytes
+
+    Returns:
+        dict with sizes of parts and memory of the process in megabytes
+    """
+    result = {name: _mb(value) for name, value in parts.items()}
+    result.update({name: _mb(value) for name, value in process_memory().items()})
+    return result
+
+
+def format_report(memory_report):
+    """One line of a memory report for the training log."""
+    return 'memory MB: ' + ' '.join('{}:{}'.format(name, value) for name, value in memory_report.items())
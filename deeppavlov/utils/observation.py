@@ -0,0 +1,81 @@
+# Copyright 2017 Neural Networks and Deep Learning lab, MIPT
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Copy-on-write handling of observations received by agents and teachers.
+
+Teachers build a new dictionary for every act, so an agent only has to copy
+the fields it replaces, not the whole observation. Strict copying makes a deep
+copy of every observation, which is useful to debug agents that change nested
+values in place.
+"""
+
+import copy
+
+
+def add_cmdline_args(argparser):
+    """Add observation handling arguments to the parser."""
+    group = argparser.add_argument_group('Observation Arguments')
+    group.add_argument('--strict_observation_copy', type='bool', default=False,
+                       help='deep copy every observation instead of copying only changed fields')
+
+
+def keep_observation(observation, strict=False):
+    """Return an observation which is only read by an agent.
+
+    Args:
+        observation: dict from teacher or agent
+        strict: deep copy the observation
+
+    Returns:
+        the observation itself or its deep copy
+    """
+    if strict:
+        return copy.deepcopy(observation)
+    return observation
+
+
+def copy_observation(observation, strict=False):
+    """Return a copy of an observation whose fields are replaced by an agent.
+
+    Args:
+        observation: dict from teacher or agent
+        strict: deep copy the observation
+
+    Returns:
+        shallow copy of the observation or its deep copy
+    """
+    if strict:
+        return copy.deepcopy(observation)
+    return dict(observation)
+
+
+def join_episode_text(observation, prev_observation, separator='\n', strict=False):
+    """Prepend the text of the previous observation of an unfinished episode.
+
+    The observation is copied only if its text is changed.
+
+    Args:
+        observation: dict from teacher
+        prev_observation: previous observation of the episode or None if the episode is done
+        separator: string to join texts with
+        strict: deep copy the observation
+
+    Returns:
+        observation with the text of the whole episode
+    """
+    if prev_observation is None:
+        return keep_observation(observation, strict)
+    observation = copy_observation(observation, strict)
+    observation['text'] = prev_observation['text'] + separator + observation['text']
+    return observation
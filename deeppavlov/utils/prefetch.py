@@ -0,0 +1,196 @@
+# Copyright 2017 Neural Networks and Deep Learning lab, MIPT
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Background preparation of training batches.
+
+A training world does three things in every parley: teachers act, agents
+observe their acts and build a batch, and the agent updates the model. The
+first two are python work which can run while the model trains on the previous
+batch. `PrefetchWorld` runs them in one producer thread and keeps up to `depth`
+prepared batches in a bounded queue; `parley` takes the next one and runs the
+update in the calling thread.
+
+The producer is a single thread and teachers act in the same order as in a
+plain world, so batches and their order do not change. The producer stops at
+the end of every epoch until the world is reset, and `paused` stops it while
+the calling thread validates or logs, since teachers share the global random
+state.
+
+Agents may define `prepare_batch(observations)` returning the tensorized batch,
+which is then passed to `batch_act(observations, batch)`. Batches are built in
+the reusable buffers of the agent, which validation overwrites with its own
+batches, so the producer keeps copies of the arrays. Only agents with
+batch_act are supported: teachers must be able to act before they observe the
+reply to the previous act, which is not the case for the coreference teacher.
+"""
+
+import queue
+import threading
+from contextlib import contextmanager
+
+import numpy as np
+from parlai.core.worlds import validate
+
+
+def _copy_arrays(batch):
+    """Copy numpy arrays nested in tuples, lists and dicts of a batch."""
+    if isinstance(batch, np.ndarray):
+        return batch.copy()
+    if isinstance(batch, (tuple, list)):
+        return type(batch)(_copy_arrays(b) for b in batch)
+    if isinstance(batch, dict):
+        return {k: _copy_arrays(v) for k, v in batch.items()}
+    return batch
+
+
+def supported(agent):
+    """Whether batches of the agent can be prepared in the background."""
+    return hasattr(agent, 'batch_act')
+
+
+class PrefetchWorld(object):
+    """Training world which prepares next batches in a background thread.
+
+    Attributes:
+        world: wrapped training world, a batch world or a world of a teacher and an agent
+        agent: the agent being trained
+        depth: maximal number of prepared batches waiting in the queue
+    """
+
+    def __init__(self, world, agent, depth):
+        """Start the producer thread.
+
+        Args:
+            world: training world
+            agent: the agent being trained
+            depth: maximal number of prepared batches waiting in the queue
+        """
+        self.world = world
+        self.agent = agent
+        self.depth = max(depth, 1)
+        self._worlds = list(getattr(world, 'worlds', None) or [world])
+        self._queue = queue.Queue(maxsize=self.depth)
+        self._lock = threading.Lock()
+        self._teacher_lock = threading.Lock()
+        self._resume = threading.Event()
+        self._stopped = False
+        self._epoch_done = False
+        self._thread = threading.Thread(target=self._produce, name='prefetch', daemon=True)
+        self._thread.start()
+
+    def _prepare(self):
+        """Let teachers act and agents observe, build the batch of the next parley."""
+        acts = []
+        labels = []
+        observations = []
+        with self._teacher_lock:
+            for w in self._worlds:
+                teacher = w.get_agents()[0]
+                acts.append(teacher.act())
+                # teachers check replies against labels of their last act
+                labels.append(getattr(teacher, 'lastY', None))
+            epoch_done = self.world.epoch_done()
+        for w, act in zip(self._worlds, acts):
+            observations.append(w.get_agents()[1].observe(validate(act)))
+        batch = None
+        prepare_batch = getattr(self.agent, 'prepare_batch', None)
+        if callable(prepare_batch):
+            # arrays are views of the agent's batch buffers, see the module docstring
+            batch = _copy_arrays(prepare_batch(observations))
+        return {'acts': acts, 'labels': labels, 'observations': observations, 'batch': batch,
+                'epoch_done': epoch_done}
+
+    def _put(self, item):
+        while not self._stopped:
+            try:
+                self._queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def _produce(self):
+        try:
+            while not self._stopped:
+                with self._lock:
+                    if self._stopped:
+                        return
+                    item = self._prepare()
+                self._put(item)
+                if item['epoch_done']:
+                    self._resume.wait()
+                    self._resume.clear()
+        except BaseException as e:
+            self._put({'error': e})
+
+    def parley(self):
+        """Update the agent on the next prepared batch and let teachers observe replies."""
+        item = self._queue.get()
+        if 'error' in item:
+            raise RuntimeError('preparation of a training batch failed') from item['error']
+        observations = item['observations']
+        if item['batch'] is not None:
+            replies = self.agent.batch_act(observations, item['batch'])
+        else:
+            replies = self.agent.batch_act(observations)
+        with self._teacher_lock:
+            for w, act, labels, reply in zip(self._worlds, item['acts'], item['labels'], replies):
+                teacher = w.get_agents()[0]
+                acts = w.get_acts()
+                acts[0] = act
+                acts[1] = reply
+                teacher.lastY = labels
+                teacher.observe(validate(reply))
+        self._epoch_done = item['epoch_done']
+
+    def epoch_done(self):
+        return self._epoch_done
+
+    def reset(self):
+        """Reset the world after an epoch and let the producer go on."""
+        self.world.reset()
+        if self._epoch_done:
+            self._epoch_done = False
+            self._resume.set()
+
+    @contextmanager
+    def paused(self):
+        """Stop preparing batches inside the context."""
+        with self._lock:
+            yield
+
+    def close(self):
+        """Stop the producer thread, prepared batches are dropped."""
+        self._stopped = True
+        self._resume.set()
+        self._thread.join()
+
+    def shutdown(self):
+        self.close()
+        self.world.shutdown()
+
+    def __len__(self):
+        return len(self.world)
+
+    def __getattr__(self, name):
+        return getattr(self.world, name)
+
+
+@contextmanager
+def paused(world):
+    """Pause a prefetching world inside the context, do nothing for other worlds."""
+    if isinstance(world, PrefetchWorld):
+        with world.paused():
+            yield
+    else:
+        yield
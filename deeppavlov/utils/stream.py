@@ -0,0 +1,268 @@
+# Copyright 2017 Neural Networks and Deep Learning lab, MIPT
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Streaming teachers for datasets which do not fit in memory.
+
+With a `:stream` datatype (e.g. `train:stream`) a teacher reads examples
+lazily from shard files matched by --stream-files (the task data file by
+default) instead of loading the whole dataset:
+    - shards are read one by one in an order shuffled every epoch
+    - training examples are shuffled within a buffer of --shuffle-buffer-size examples
+    - examples are assigned to train/valid/test splits by a hash of their text,
+      so splits do not depend on the order or sharding of the data
+    - epoch n is shuffled with a seed made of --stream-seed and n, so runs repeat
+
+Copies of a teacher in a batch world share one stream, every example is given
+once per epoch. Memory is bounded by the shuffle buffer whatever the size of
+the data. The number of examples is unknown, so teachers report a length of 0
+and epochs end when shards are read.
+
+Processes sharing work on a dataset (e.g. parallel builds of a dictionary)
+set opt['data_shard'] and opt['data_shards'], then every teacher reads only
+its slice of the data: its share of shard files, or every data_shards-th
+example if there are fewer files than slices.
+"""
+
+import glob
+import hashlib
+import itertools
+import random
+
+from parlai.core.agents import Teacher
+from parlai.core.dialog_teacher import DialogTeacher
+
+
+def add_cmdline_args(argparser):
+    """Add streaming arguments to the parser."""
+    group = argparser.add_argument_group('Stream Arguments')
+    group.add_argument('--stream-files', type=str, default=None,
+                       help='glob pattern of shard files read with a :stream datatype, the task data file by default')
+    group.add_argument('--shuffle-buffer-size', type=int, default=10000,
+                       help='number of examples shuffled together when streaming training data')
+    group.add_argument('--stream-seed', type=int, default=0,
+                       help='seed of shuffling of streamed training data')
+
+
+def is_stream(opt):
+    """Check if the datatype asks for streaming."""
+    return 'stream' in opt.get('datatype', '').split(':')
+
+
+def data_slice(opt):
+    """Index of the slice of data read by a teacher and the number of slices, (0, 1) for all data."""
+    return opt.get('data_shard') or 0, opt.get('data_shards') or 1
+
+
+def shard_paths(pattern):
+    """Sorted paths of shard files matched by a glob pattern."""
+    paths = sorted(glob.glob(pattern))
+    if not paths:
+        raise ValueError('no shard files match {}'.format(pattern))
+    return paths
+
+
+def hash_fraction(key, seed=None):
+    """Deterministic number in [0, 1) for a string, used to split streamed examples."""
+    digest = hashlib.md5('{}:{}'.format(seed, key).encode('utf-8')).digest()
+    return int.from_bytes(digest[:8], 'big') / 2 ** 64
+
+
+def shuffled(items, buffer_size, rng):
+    """Shuffle an iterable keeping at most buffer_size items in memory.
+
+    Args:
+        items: iterable
+        buffer_size: number of items shuffled together
+        rng: random.Random
+
+    Returns:
+        generator of items
+    """
+    buffer = []
+    for item in items:
+        if len(buffer) < buffer_size:
+            buffer.append(item)
+            continue
+        i = rng.randrange(buffer_size)
+        yield buffer[i]
+        buffer[i] = item
+    rng.shuffle(buffer)
+    yield from buffer
+
+
+class ExampleStream(object):
+    """Examples read lazily from shards, epoch by epoch.
+
+    Attributes:
+        paths: paths to shard files
+        epoch: number of the current epoch
+        done: all examples of the epoch are taken
+    """
+
+    def __init__(self, paths, read, keep=None, shuffle_buffer_size=0, seed=None, shard=0, shards=1):
+        """Create a stream, nothing is read until the first example is taken.
+
+        Args:
+            paths: paths to shard files
+            read: function yielding examples of a shard
+            keep: predicate selecting examples, all examples are kept if None
+            shuffle_buffer_size: number of examples shuffled together, 0 keeps the order of shards
+            seed: seed of shuffling
+            shard: index of the slice of kept examples taken by the stream
+            shards: number of slices, every shards-th kept example is taken
+        """
+        self.paths = list(paths)
+        self.read = read
+        self.keep = keep
+        self.shard = shard
+        self.shards = shards
+        self.shuffle_buffer_size = shuffle_buffer_size
+        self.seed = seed
+        self.epoch = 0
+        self.done = False
+        self._examples = None
+        self._next = None
+        self._started = False
+
+    def _epoch_examples(self):
+        paths = list(self.paths)
+        examples = (example for path in paths for example in self.read(path)
+                    if self.keep is None or self.keep(example))
+        if self.shards > 1:
+            examples = itertools.islice(examples, self.shard, None, self.shards)
+        if self.shuffle_buffer_size > 0:
+            rng = random.Random('{}:{}'.format(self.seed, self.epoch))
+            rng.shuffle(paths)
+            examples = shuffled(examples, self.shuffle_buffer_size, rng)
+        return examples
+
+    def next(self):
+        """Take the next example of the epoch, None if all are taken."""
+        if not self._started:
+            self._started = True
+            self._examples = self._epoch_examples()
+            self._next = next(self._examples, None)
+        example = self._next
+        if example is not None:
+            # one example is read ahead, so the last one is known to end the epoch
+            self._next = next(self._examples, None)
+        self.done = self._next is None
+        return example
+
+    def reset(self):
+        """Start the next epoch, resets before the first example of an epoch is taken are ignored."""
+        if self._started:
+            self.epoch += 1
+            self._started = False
+            self._examples = None
+            self._next = None
+            self.done = False
+
+
+class StreamDialogTeacher(DialogTeacher):
+    """Dialog teacher reading its examples lazily with a :stream datatype.
+
+    Without :stream in the datatype it is a DialogTeacher. Subclasses define
+    `stream_examples(path)` yielding examples of a shard in the format of
+    setup_data, and may define `keep_example(example)` selecting examples of
+    their datatype. Streamed episodes must be single examples. setup_data of
+    subclasses yields only examples selected by `slice_indexes`.
+    """
+
+    # the teacher reads only the slice of data set by data_shard and data_shards
+    slices_data = True
+
+    def __init__(self, opt, shared=None):
+        self.stream = is_stream(opt)
+        if not self.stream:
+            super().__init__(opt, shared)
+            return
+        Teacher.__init__(self, opt, shared)
+        self.datatype = opt['datatype']
+        self.training = self.datatype.startswith('train')
+        if shared and shared.get('stream'):
+            self.examples = shared['stream']
+        else:
+            paths = shard_paths(opt.get('stream_files') or opt['datafile'])
+            shard, shards = data_slice(opt)
+            if len(paths) >= shards > 1:
+                # slices are whole shard files, so no file is read by two teachers
+                paths, shard, shards = paths[shard::shards], 0, 1
+            self.examples = ExampleStream(paths, self.stream_examples, self.keep_example,
+                                          opt.get('shuffle_buffer_size', 0) if self.training else 0,
+                                          opt.get('stream_seed'), shard, shards)
+        self.lastY = None
+        self.epochDone = False
+
+    def stream_examples(self, path):
+        """Examples of a shard as ((text, labels), episode_done) pairs."""
+        raise NotImplementedError
+
+    def keep_example(self, example):
+        """Check if a streamed example belongs to the datatype of the teacher."""
+        return True
+
+    def slice_indexes(self, indexes):
+        """Indexes of examples loaded by setup_data which are in the slice of data read by the teacher."""
+        shard, shards = data_slice(self.opt)
+        return indexes[shard::shards]
+
+    def share(self):
+        if not self.stream:
+            return super().share()
+        shared = Teacher.share(self)
+        shared['stream'] = self.examples
+        return shared
+
+    def __len__(self):
+        return 0 if self.stream else super().__len__()
+
+    def num_examples(self):
+        return 0 if self.stream else super().num_examples()
+
+    def num_episodes(self):
+        return 0 if self.stream else super().num_episodes()
+
+    def reset(self):
+        if not self.stream:
+            return super().reset()
+        Teacher.reset(self)
+        # a reset teacher starts a new epoch or evaluation round, metrics of the last one are dropped
+        self.reset_metrics()
+        self.examples.reset()
+        self.lastY = None
+        self.epochDone = False
+
+    def epoch_done(self):
+        if not self.stream:
+            return super().epoch_done()
+        return self.epochDone or self.examples.done
+
+    def act(self):
+        if not self.stream:
+            return super().act()
+        example = None if self.epoch_done() else self.examples.next()
+        if example is None:
+            self.epochDone = True
+            self.lastY = None
+            return {'episode_done': True, 'id': self.getID()}
+        entry, episode_done = example
+        action = {'text': entry[0], 'episode_done': episode_done, 'id': self.getID()}
+        if len(entry) > 1 and entry[1] is not None:
+            action['labels'] = entry[1]
+        self.lastY = action.get('labels')
+        if not self.training and 'labels' in action:
+            # labels are only given to agents in training
+            action['eval_labels'] = action.pop('labels')
+        return action
@@ -0,0 +1,254 @@
+# Copyright 2017 Neural Networks and Deep Learning lab, MIPT
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Streaming metric accumulators.
+
+Accumulators keep counts instead of predictions, so memory does not grow with
+the number of evaluated examples. Accumulators of the same kind computed on
+different shards of data are combined with `merge`.
+"""
+
+import math
+
+import numpy as np
+
+
+class BinaryCounts(object):
+    """Confusion counts of a binary classifier.
+
+    Attributes:
+        tp, fp, tn, fn: numbers of true positives, false positives, true negatives and false negatives
+    """
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.tp = self.fp = self.tn = self.fn = 0
+
+    def update(self, y_true, y_pred):
+        """Count one example with true and predicted classes (1 is positive)."""
+        if y_true:
+            if y_pred:
+                self.tp += 1
+            else:
+                self.fn += 1
+        elif y_pred:
+            self.fp += 1
+        else:
+            self.tn += 1
+
+    def merge(self, other):
+        self.tp += other.tp
+        self.fp += other.fp
+        self.tn += other.tn
+        self.fn += other.fn
+        return self
+
+    def __len__(self):
+        return self.tp + self.fp + self.tn + self.fn
+
+    def accuracy(self):
+        return (self.tp + self.tn) / len(self) if len(self) else 0
+
+    def precision(self):
+        return self.tp / (self.tp + self.fp) if self.tp + self.fp else 0
+
+    def recall(self):
+        return self.tp / (self.tp + self.fn) if self.tp + self.fn else 0
+
+    def f1(self):
+        p = self.precision()
+        r = self.recall()
+        return 2 * p * r / (p + r) if p + r else 0
+
+
+class LogLoss(object):
+    """Mean binary cross-entropy of predicted probabilities.
+
+    Probabilities are clipped to [eps, 1 - eps] as in sklearn.metrics.log_loss.
+    """
+
+    def __init__(self, eps=1e-15):
+        self.eps = eps
+        self.clear()
+
+    def clear(self):
+        self.total = 0.0
+        self.count = 0
+
+    def update(self, y_true, probability):
+        p = min(max(float(probability), self.eps), 1 - self.eps)
+        self.total -= math.log(p if y_true else 1 - p)
+        self.count += 1
+
+    def merge(self, other):
+        self.total += other.total
+        self.count += other.count
+        return self
+
+    def value(self):
+        return self.total / self.count if self.count else 0
+
+
+class HistogramAUC(object):
+    """ROC AUC of scores in [0, 1] computed from histograms of positive and negative scores.
+
+    Scores falling into the same bin are counted as ties, so the error is bounded
+    by the share of positive-negative pairs in the same bin.
+    """
+
+    def __init__(self, bins=10000):
+        self.bins = bins
+        self.positives = np.zeros(bins, dtype=np.int64)
+        self.negatives = np.zeros(bins, dtype=np.int64)
+
+    def clear(self):
+        self.positives[:] = 0
+        self.negatives[:] = 0
+
+    def update(self, y_true, score):
+        index = min(max(int(float(score) * self.bins), 0), self.bins - 1)
+        if y_true:
+            self.positives[index] += 1
+        else:
+            self.negatives[index] += 1
+
+    def merge(self, other):
+        if other.bins != self.bins:
+            raise ValueError('can not merge histograms with {} and {} bins'.format(self.bins, other.bins))
+        self.positives += other.positives
+        self.negatives += other.negatives
+        return self
+
+    def value(self):
+        """ROC AUC, raises ValueError if only one class was seen (as sklearn.metrics.roc_auc_score)."""
+        n_pos = int(self.positives.sum())
+        n_neg = int(self.negatives.sum())
+        if n_pos == 0 or n_neg == 0:
+            raise ValueError('Only one class present in y_true. ROC AUC score is not defined in that case.')
+        negatives_below = np.cumsum(self.negatives) - self.negatives
+        pairs = np.sum(self.positives * negatives_below) + 0.5 * np.sum(self.positives * self.negatives)
+        return float(pairs) / (n_pos * n_neg)
+
+
+def _split_tag(tag):
+    """Split a tag, e.g. B-PER, into the chunk tag and the chunk type."""
+    chunk_tag, _, chunk_type = tag.partition('-')
+    return chunk_tag, chunk_type
+
+
+def _end_of_chunk(prev_tag, tag, prev_type, chunk_type):
+    """Check if a chunk ended between the previous and the current word (endOfChunk of conlleval)."""
+    if (prev_tag, tag) in (('B', 'B'), ('B', 'O'), ('I', 'B'), ('I', 'O'), ('E', 'E'), ('E', 'I'), ('E', 'O')):
+        return True
+    if prev_tag not in ('O', '.') and prev_type != chunk_type:
+        return True
+    return prev_tag in ('[', ']')
+
+
+def _start_of_chunk(prev_tag, tag, prev_type, chunk_type):
+    """Check if a chunk started between the previous and the current word (startOfChunk of conlleval)."""
+    if (prev_tag, tag) in (('B', 'B'), ('I', 'B'), ('O', 'B'), ('O', 'I'), ('E', 'E'), ('E', 'I'), ('O', 'E')):
+        return True
+    if tag not in ('O', '.') and prev_type != chunk_type:
+        return True
+    return tag in ('[', ']')
+
+
+class ChunkCounts(object):
+    """Counts of named entity chunks as in the conlleval script.
+
+    Sentences are evaluated one by one and a chunk never spans two sentences.
+
+    Attributes:
+        correct_chunks: chunks found with the same boundaries and type as in ground truth
+        found_guessed: chunks in predictions
+        found_correct: chunks in ground truth
+        correct_tags: tokens with the correct tag
+        tokens: number of tokens
+    """
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.correct_chunks = 0
+        self.found_guessed = 0
+        self.found_correct = 0
+        self.correct_tags = 0
+        self.tokens = 0
+        self.sentences = 0
+
+    def update(self, true_tags, pred_tags):
+        """Count chunks of a sentence.
+
+        Args:
+            true_tags: list of ground truth tags, e.g. ['B-PER', 'I-PER', 'O']
+            pred_tags: list of predicted tags of the same tokens
+        """
+        in_correct = False
+        last_correct, last_correct_type = 'O', ''
+        last_guessed, last_guessed_type = 'O', ''
+        # the sentence boundary is an out of chunk word closing chunks of the last words
+        for i, (true_tag, pred_tag) in enumerate(list(zip(true_tags, pred_tags)) + [('O', 'O')]):
+            correct, correct_type = _split_tag(true_tag)
+            guessed, guessed_type = _split_tag(pred_tag)
+            end_correct = _end_of_chunk(last_correct, correct, last_correct_type, correct_type)
+            end_guessed = _end_of_chunk(last_guessed, guessed, last_guessed_type, guessed_type)
+            if in_correct:
+                if end_correct and end_guessed and last_guessed_type == last_correct_type:
+                    in_correct = False
+                    self.correct_chunks += 1
+                elif end_correct != end_guessed or guessed_type != correct_type:
+                    in_correct = False
+            start_correct = _start_of_chunk(last_correct, correct, last_correct_type, correct_type)
+            start_guessed = _start_of_chunk(last_guessed, guessed, last_guessed_type, guessed_type)
+            if start_correct and start_guessed and guessed_type == correct_type:
+                in_correct = True
+            self.found_correct += start_correct
+            self.found_guessed += start_guessed
+            if i < len(true_tags) and i < len(pred_tags):
+                self.correct_tags += correct == guessed and correct_type == guessed_type
+                self.tokens += 1
+            last_correct, last_correct_type = correct, correct_type
+            last_guessed, last_guessed_type = guessed, guessed_type
+        self.sentences += 1
+
+    def merge(self, other):
+        self.correct_chunks += other.correct_chunks
+        self.found_guessed += other.found_guessed
+        self.found_correct += other.found_correct
+        self.correct_tags += other.correct_tags
+        self.tokens += other.tokens
+        self.sentences += other.sentences
+        return self
+
+    def precision(self):
+        """Precision of chunks in percents."""
+        return 100 * self.correct_chunks / self.found_guessed if self.found_guessed else 0
+
+    def recall(self):
+        """Recall of chunks in percents."""
+        return 100 * self.correct_chunks / self.found_correct if self.found_correct else 0
+
+    def f1(self):
+        """F1 of chunks in percents (FB1 of conlleval)."""
+        p = self.precision()
+        r = self.recall()
+        return 2 * p * r / (p + r) if p + r else 0
+
+    def accuracy(self):
+        """Share of correctly tagged tokens in percents."""
+        return 100 * self.correct_tags / self.tokens if self.tokens else 0
@@ -0,0 +1,140 @@
+# Copyright 2017 Neural Networks and Deep Learning lab, MIPT
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Search spaces and early stopping of hyperparameter sweeps.
+
+A search space maps command line options of build_utils to values:
+    {"--learning_rate": [0.001, 0.0001], "--hidden_dim": [100, 200]}
+Grid search tries every combination of the listed values. Random search samples
+every option independently, a list is then a set of choices and a dict is a
+distribution: {"uniform": [low, high]}, {"loguniform": [low, high]} or
+{"randint": [low, high]} (high is included).
+
+Trials of a sweep share a directory. After every validation round a trial
+appends its best metric value so far to <sweep_dir>/trial_<n>.json and stops if
+it is below the median of the other trials at the same round (median stopping
+rule). Folds of bagging are compared with the same folds of other trials.
+"""
+
+import glob
+import itertools
+import json
+import math
+import os
+import random
+import re
+import statistics
+
+from . import checkpoint
+
+
+def add_cmdline_args(argparser):
+    """Add arguments of sweep trials to the parser."""
+    group = argparser.add_argument_group('Sweep Arguments')
+    group.add_argument('--sweep-dir', default=None,
+                       help='directory of the sweep the model is trained in, set by the sweep runner')
+    group.add_argument('--sweep-trial', type=int, default=None,
+                       help='index of the trial in the sweep, set by the sweep runner')
+    group.add_argument('--sweep-grace-rounds', type=int, default=2,
+                       help='number of validation rounds a trial runs before it may be stopped early')
+    group.add_argument('--sweep-min-trials', type=int, default=3,
+                       help='number of other trials which must reach a validation round to stop a trial there')
+
+
+def grid(space):
+    """List all combinations of values of a search space."""
+    keys = sorted(space)
+    for key in keys:
+        if not isinstance(space[key], list):
+            raise ValueError('grid search takes lists of values, {} is {}'.format(key, space[key]))
+    return [dict(zip(keys, values)) for values in itertools.product(*(space[key] for key in keys))]
+
+
+def _sample(value, rng):
+    if isinstance(value, list):
+        return rng.choice(value)
+    if not isinstance(value, dict) or len(value) != 1:
+        return value
+    (kind, (low, high)), = value.items()
+    if kind == 'uniform':
+        return rng.uniform(low, high)
+    if kind == 'loguniform':
+        return math.exp(rng.uniform(math.log(low), math.log(high)))
+    if kind == 'randint':
+        return rng.randint(low, high)
+    raise ValueError('unknown distribution {}'.format(kind))
+
+
+def random_search(space, trials, seed=None):
+    """Sample values of a search space for a number of trials."""
+    rng = random.Random(seed)
+    keys = sorted(space)
+    return [{key: _sample(space[key], rng) for key in keys} for _ in range(trials)]
+
+
+def trial_args(params):
+    """Command line arguments setting values of a trial."""
+    args = []
+    for key, value in sorted(params.items()):
+        args.extend([key, str(value)])
+    return args
+
+
+def _history_path(opt, trial):
+    fold = opt.get('bagging_fold_index')
+    name = 'trial_{}'.format(trial) if fold is None else 'trial_{}_fold_{}'.format(trial, fold)
+    return os.path.join(opt['sweep_dir'], name + '.json')
+
+
+def read_history(path):
+    """Read the validation history of a trial, None if there is none."""
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def report_validation(opt, value):
+    """Record a validation result of a trial and decide if the trial should stop.
+
+    Args:
+        opt: options of the trained model
+        value: value of the chosen metric, greater is better
+
+    Returns:
+        True if the best value of the trial is below the median of other trials at this round
+    """
+    if opt.get('sweep_dir') is None or opt.get('sweep_trial') is None:
+        return False
+    path = _history_path(opt, opt['sweep_trial'])
+    state = read_history(path) or {'trial': opt['sweep_trial'], 'history': [], 'stopped': False}
+    history = state['history']
+    history.append(max(history[-1], value) if history else value)
+    current = len(history)
+
+    others = []
+    pattern = re.escape(_history_path(opt, '*')).replace(re.escape('*'), r'\d+')
+    for other_path in glob.glob(_history_path(opt, '*')):
+        if other_path == path or not re.fullmatch(pattern, other_path):
+            continue
+        other = read_history(other_path)
+        if other is not None and len(other['history']) >= current:
+            others.append(other['history'][current - 1])
+    if current > opt.get('sweep_grace_rounds', 0) and len(others) >= opt.get('sweep_min_trials', 1):
+        state['stopped'] = history[-1] < statistics.median(others)
+
+    with checkpoint.atomic_file(path) as f:
+        json.dump(state, f)
+    return state['stopped']
@@ -0,0 +1,170 @@
+# Copyright 2017 Neural Networks and Deep Learning lab, MIPT
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Creation of tensorflow sessions of agents.
+
+Every agent creates its sessions with `create_session`, which configures them
+from the options of the agent:
+    --tf-cpu-threads: threads of the session, 0 keeps tensorflow defaults (a thread per core)
+    --tf-inter-op-threads: threads running independent ops, the same as --tf-cpu-threads by default
+    --tf-cpu-cores: cores the threads of the session run on, e.g. 0-3,8
+    --tf-visible-devices: GPUs visible to the session, e.g. 0,1
+
+With a thread budget a session gets its own inter-op thread pool. The intra-op
+pool is shared by all sessions of a process and is sized by the first session,
+so agents sharing a host are best run in separate processes, each with its own
+budget and cores.
+
+Every agent owns its graph and session, so several agents can be hosted in one
+process without clobbering each other's graphs. Ops of an agent, also those
+built by keras, are created and run inside `scope(sess)` of its session.
+"""
+
+import os
+from contextlib import contextmanager
+
+
+def add_cmdline_args(argparser):
+    """Add session arguments to the parser."""
+    group = argparser.add_argument_group('Session Arguments')
+    group.add_argument('--tf-cpu-threads', type=int, default=0,
+                       help='number of threads of tensorflow sessions of the agent, '
+                            '0 uses the number of --tf-cpu-cores or tensorflow defaults')
+    group.add_argument('--tf-inter-op-threads', type=int, default=0,
+                       help='number of threads running independent ops, 0 is the same as --tf-cpu-threads')
+    group.add_argument('--tf-cpu-cores', type=str, default=None,
+                       help='CPU cores threads of tensorflow sessions run on, e.g. 0-3,8')
+    group.add_argument('--tf-visible-devices', type=str, default=None,
+                       help='comma separated GPUs visible to tensorflow sessions of the agent')
+
+
+def parse_cores(cores):
+    """List of cores from a string like 0-3,8, None for None or an empty string."""
+    if not cores:
+        return None
+    result = []
+    for part in str(cores).split(','):
+        first, _, last = part.strip().partition('-')
+        result.extend(range(int(first), int(last or first) + 1))
+    return sorted(set(result))
+
+
+def session_config(opt=None, gpu_memory_fraction=None, allow_growth=False, visible_device_list=None,
+                   use_gpu=True):
+    """Configuration of a session of an agent.
+
+    Args:
+        opt: options of the agent with session arguments
+        gpu_memory_fraction: fraction of GPU memory the process may allocate
+        allow_growth: allocate GPU memory on demand
+        visible_device_list: GPUs visible to the session, unless set by options
+        use_gpu: place ops on GPUs
+
+    Returns:
+        tf.ConfigProto
+    """
+    import tensorflow as tf
+    opt = opt or {}
+    config = tf.ConfigProto() if use_gpu else tf.ConfigProto(device_count={'GPU': 0})
+    cores = parse_cores(opt.get('tf_cpu_cores'))
+    threads = opt.get('tf_cpu_threads') or (len(cores) if cores else 0)
+    if threads:
+        config.intra_op_parallelism_threads = threads
+        config.inter_op_parallelism_threads = opt.get('tf_inter_op_threads') or threads
+        config.use_per_session_threads = True
+    elif opt.get('tf_inter_op_threads'):
+        config.inter_op_parallelism_threads = opt['tf_inter_op_threads']
+    if gpu_memory_fraction is not None:
+        config.gpu_options.per_process_gpu_memory_fraction = gpu_memory_fraction
+    config.gpu_options.allow_growth = allow_growth
+    visible_device_list = opt.get('tf_visible_devices') or visible_device_list
+    if visible_device_list is not None:
+        config.gpu_options.visible_device_list = visible_device_list
+    return config
+
+
+@contextmanager
+def cpu_affinity(cores):
+    """Pin the calling thread, and threads it starts, to cores while in the context."""
+    if not cores or not hasattr(os, 'sched_setaffinity'):
+        yield
+        return
+    previous = os.sched_getaffinity(0)
+    os.sched_setaffinity(0, cores)
+    try:
+        yield
+    finally:
+        os.sched_setaffinity(0, previous)
+
+
+def create_session(opt=None, graph=None, **config_args):
+    """Create a session of an agent.
+
+    Thread pools started by the session are pinned to opt['tf_cpu_cores'].
+
+    Args:
+        opt: options of the agent with session arguments
+        graph: graph of the session, the default graph if None
+        config_args: arguments of session_config
+
+    Returns:
+        tf.Session
+    """
+    import tensorflow as tf
+    config = session_config(opt, **config_args)
+    with cpu_affinity(parse_cores((opt or {}).get('tf_cpu_cores'))):
+        return tf.Session(graph=graph, config=config)
+
+
+def create_graph_session(opt=None, **config_args):
+    """Create a session of an agent with a new graph owned by the session.
+
+    Args:
+        opt: options of the agent with session arguments
+        config_args: arguments of session_config
+
+    Returns:
+        tf.Session
+    """
+    import tensorflow as tf
+    return create_session(opt, graph=tf.Graph(), **config_args)
+
+
+def create_keras_session(opt=None, gpu_memory_fraction=None, allow_growth=False, visible_device_list='0'):
+    """Create a session with a new graph for a keras model.
+
+    Layers of the model must be built, trained and run in `scope` of the session.
+
+    Args:
+        opt: options of the agent with session arguments
+        gpu_memory_fraction: fraction of GPU memory the process may allocate
+        allow_growth: allocate GPU memory on demand
+        visible_device_list: GPUs visible to the session, unless set by options
+
+    Returns:
+        tf.Session
+    """
+    return create_graph_session(opt, gpu_memory_fraction=gpu_memory_fraction, allow_growth=allow_growth,
+                                visible_device_list=visible_device_list)
+
+
+@contextmanager
+def scope(sess):
+    """Make the session and its graph the defaults while in the context.
+
+    Ops are added to the graph of the session, and keras (which takes the default
+    session when there is one) builds, trains and runs models in it.
+    """
+    with sess.graph.as_default(), sess.as_default():
+        yield sess
@@ -0,0 +1,213 @@
+# Copyright 2017 Neural Networks and Deep Learning lab, MIPT
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import time
+from collections import deque
+from contextlib import contextmanager
+from functools import wraps
+
+import numpy as np
+
+
+STAGES = ('teacher', 'observe', 'batchify', 'session_run', 'log_valid', 'other')
+
+# methods doing the tokenization and tensorization of a batch in the agents
+BATCHIFY_METHODS = ('batchify', '_build_ex', 'model.batchify', 'model._batchify', 'model.tensorize_example')
+
+
+class TrainProfiler(object):
+    """Wall-clock profiler of the training loop.
+
+    Methods of the teachers and agents of a world are wrapped with timers and the time of
+    every training step is split into stages:
+        teacher: teacher act() and observe()
+        observe: agent observe(), including copying of the observation
+        batchify: tokenization and tensorization of a batch
+        session_run: the rest of agent act()/batch_act(), i.e. the model update
+        log_valid: logging and intermediate validation
+        other: time spent in the world itself
+    Nested calls are accounted exclusively, e.g. batchify time is not counted in session_run.
+    """
+
+    def __init__(self, enabled=True, window=1000):
+        """Initialize the profiler.
+
+        Args:
+            enabled: a disabled profiler does nothing
+            window: number of last steps used for rolling statistics
+        """
+        self.enabled = enabled
+        self.samples = {stage: deque(maxlen=window) for stage in STAGES}
+        self.step_samples = deque(maxlen=window)
+        self.totals = dict.fromkeys(STAGES, 0.0)
+        self.current = dict.fromkeys(STAGES, 0.0)
+        self.steps = 0
+        self.examples = 0
+        self.step_examples = 0
+        self.total_time = 0.0
+        self._step_start = None
+        self._stack = []
+        self._suspended = 0
+        self._patched = []
+
+    def attach(self, world, agent):
+        """Wrap methods of the teachers and agents taking part in the world.
+
+        Args:
+            world: training world, a batch world or a world of a teacher and an agent
+            agent: the agent being trained
+        """
+        if not self.enabled:
+            return
+        worlds = list(getattr(world, 'worlds', None) or [world])
+        if hasattr(world, 'world'):
+            worlds.append(world.world)
+        seen = set()
+        for w in worlds:
+            teacher, *agents = w.get_agents()
+            if id(teacher) not in seen:
+                seen.add(id(teacher))
+                self._wrap(teacher, 'act', 'teacher', count_examples=True)
+                self._wrap(teacher, 'observe', 'teacher')
+            for a in agents:
+                if id(a) not in seen:
+                    seen.add(id(a))
+                    self._wrap_agent(a)
+        if id(agent) not in seen:
+            self._wrap_agent(agent)
+
+    def detach(self):
+        """Restore the original methods."""
+        for obj, name, original in reversed(self._patched):
+            if original is None:
+                delattr(obj, name)
+            else:
+                setattr(obj, name, original)
+        self._patched = []
+
+    def _wrap_agent(self, agent):
+        self._wrap(agent, 'observe', 'observe')
+        self._wrap(agent, 'act', 'session_run')
+        self._wrap(agent, 'batch_act', 'session_run')
+        for path in BATCHIFY_METHODS:
+            *owners, name = path.split('.')
+            obj = agent
+            for owner in owners:
+                obj = getattr(obj, owner, None)
+            if obj is not None:
+                self._wrap(obj, name, 'batchify')
+
+    def _wrap(self, obj, name, stage, count_examples=False):
+        method = getattr(obj, name, None)
+        if not callable(method):
+            return
+        profiler = self
+
+        @wraps(method)
+        def timed(*args, **kwargs):
+            if profiler._suspended:
+                return method(*args, **kwargs)
+            profiler._stack.append([time.perf_counter(), 0.0])
+            try:
+                result = method(*args, **kwargs)
+            finally:
+                start, children = profiler._stack.pop()
+                elapsed = time.perf_counter() - start
+                profiler.current[stage] += elapsed - children
+                if profiler._stack:
+                    profiler._stack[-1][1] += elapsed
+            if count_examples and isinstance(result, dict) and result.get('text') is not None:
+                profiler.step_examples += 1
+            return result
+
+        self._patched.append((obj, name, obj.__dict__.get(name) if hasattr(obj, '__dict__') else None))
+        setattr(obj, name, timed)
+
+    def start_step(self):
+        """Mark the start of a training step."""
+        if self.enabled:
+            self._step_start = time.perf_counter()
+
+    def end_step(self):
+        """Mark the end of a training step and add its timings to the statistics."""
+        if not self.enabled or self._step_start is None:
+            return
+        elapsed = time.perf_counter() - self._step_start
+        self._step_start = None
+        self.current['other'] = max(0.0, elapsed - sum(v for k, v in self.current.items() if k != 'other'))
+        for stage in STAGES:
+            self.samples[stage].append(self.current[stage])
+            self.totals[stage] += self.current[stage]
+            self.current[stage] = 0.0
+        self.step_samples.append((elapsed, self.step_examples))
+        self.total_time += elapsed
+        self.examples += self.step_examples
+        self.step_examples = 0
+        self.steps += 1
+
+    @contextmanager
+    def stage(self, stage):
+        """Account everything run inside the context to the given stage."""
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        self._suspended += 1
+        try:
+            yield
+        finally:
+            self._suspended -= 1
+            self.current[stage] += time.perf_counter() - start
+
+    def rolling(self):
+        """Percentiles of stage timings over the last steps.
+
+        Returns:
+            a dictionary with p50/p90/p99 in milliseconds for every stage and examples/sec
+        """
+        report = {}
+        for stage in STAGES:
+            if self.samples[stage]:
+                p50, p90, p99 = np.percentile(np.array(self.samples[stage]) * 1000, [50, 90, 99])
+                report[stage] = {'p50': round(p50, 3), 'p90': round(p90, 3), 'p99': round(p99, 3)}
+        wall = sum(t for t, _ in self.step_samples)
+        report['exs_per_sec'] = round(sum(n for _, n in self.step_samples) / wall, 2) if wall > 0 else 0.0
+        return report
+
+    def log_line(self):
+        """Short rolling summary for the training log."""
+        report = self.rolling()
+        stages = ['{} {:.2f}/{:.2f}ms'.format(stage, report[stage]['p50'], report[stage]['p99'])
+                  for stage in STAGES if stage in report]
+        return 'profile p50/p99: {} exs/s:{}'.format(' '.join(stages), report['exs_per_sec'])
+
+    def summary(self):
+        """Summary of the whole run."""
+        return {'steps': self.steps,
+                'examples': self.examples,
+                'total_time': round(self.total_time, 3),
+                'exs_per_sec': round(self.examples / self.total_time, 2) if self.total_time > 0 else 0.0,
+                'total_stage_time': {stage: round(t, 3) for stage, t in self.totals.items()},
+                'stage_share': {stage: round(t / self.total_time, 4) if self.total_time > 0 else 0.0
+                                for stage, t in self.totals.items()},
+                'rolling_ms': self.rolling()}
+
+    def dump(self, fname):
+        """Write the summary to a json file."""
+        if not self.enabled:
+            return
+        with open(fname, 'w') as f:
+            json.dump(self.summary(), f, indent=2)
+        print('[ training profile is saved to {} ]'.format(fname))
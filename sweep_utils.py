@@ -0,0 +1,151 @@
+# Copyright 2017 Neural Networks and Deep Learning lab, MIPT
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Hyperparameter sweeps over build_utils training.
+
+Run with, e.g.:
+
+python sweep_utils.py sweep.json
+
+where sweep.json describes the sweep:
+
+{
+    "args": ["-t", "deeppavlov.tasks.paraphrases.agents", "-m", "...", "-mf", "./build/paraphraser/paraphraser", ...],
+    "space": {"--learning_rate": {"loguniform": [0.00001, 0.001]}, "--hidden_dim": [100, 200, 300]},
+    "search": "random",
+    "trials": 16,
+    "seed": 0,
+    "workers": 4,
+    "cpu_threads": 0,
+    "dir": "./build/paraphraser/sweep"
+}
+
+"args" are arguments of build_utils.model shared by all trials, "space" is the
+search space described in deeppavlov.utils.sweep. "search" is "grid" (default)
+or "random". Trials run in `workers` processes, each pinned to `cpu_threads`
+cores (0 splits available cores evenly), and save models to
+<dir>/trial_<n>/. Trials behind the median of others at a validation round are
+stopped. Results are written to <dir>/results.tsv.
+"""
+
+import json
+import os
+import sys
+
+import build_utils as bu
+from deeppavlov.utils import sweep
+
+
+def _option(args, names, default=None):
+    """Value of the last occurrence of a command line option."""
+    value = default
+    for i, arg in enumerate(args[:-1]):
+        if arg in names:
+            value = args[i + 1]
+    return value
+
+
+def _trial_status(sweep_dir, trial, metrics, error):
+    if error is not None or metrics is None:
+        return 'failed'
+    histories = [sweep.read_history(os.path.join(sweep_dir, name)) for name in os.listdir(sweep_dir)
+                 if name == 'trial_{}.json'.format(trial) or name.startswith('trial_{}_fold_'.format(trial))]
+    return 'stopped' if any(h and h['stopped'] for h in histories) else 'done'
+
+
+def _metrics_row(metrics):
+    """Scalar metrics of a trial, metrics of bagging folds are averaged."""
+    folds = metrics if isinstance(metrics, list) else [metrics]
+    folds = [{key: value for key, value in fold.items() if isinstance(value, (int, float))}
+             for fold in folds if fold is not None]
+    if not folds:
+        return {}
+    keys = set.intersection(*(set(fold) for fold in folds))
+    return {key: sum(fold[key] for fold in folds) / len(folds) for key in keys}
+
+
+def write_table(path, rows, chosen_metric):
+    """Write results of trials to a tab separated table sorted by the chosen metric."""
+    metric_keys = sorted({key for row in rows for key in row['metrics']})
+    param_keys = sorted({key for row in rows for key in row['params']})
+    rows = sorted(rows, key=lambda row: row['metrics'].get(chosen_metric, float('-inf')), reverse=True)
+    lines = ['\t'.join(['trial', 'status'] + metric_keys + param_keys)]
+    for row in rows:
+        lines.append('\t'.join([str(row['trial']), row['status']] +
+                               [str(row['metrics'].get(key, '')) for key in metric_keys] +
+                               [str(row['params'].get(key, '')) for key in param_keys]))
+    with open(path, 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+    return lines
+
+
+def run_sweep(config):
+    """Run trials of a sweep and write the table of their results.
+
+    Args:
+        config: dictionary describing the sweep, see the module docstring
+
+    Returns:
+        list of rows with trial, status, params and metrics of every trial
+    """
+    args = list(config.get('args', []))
+    space = config['space']
+    if config.get('search', 'grid') == 'random':
+        trials = sweep.random_search(space, config.get('trials', 10), config.get('seed'))
+    else:
+        trials = sweep.grid(space)
+    model_file = _option(args, ('-mf', '--model-file'))
+    if model_file is None:
+        raise ValueError('arguments of the sweep must set --model-file')
+    sweep_dir = os.path.abspath(config.get('dir') or os.path.normpath(model_file) + '_sweep')
+    os.makedirs(sweep_dir, exist_ok=True)
+    # validation histories of a previous run would stop new trials
+    for name in os.listdir(sweep_dir):
+        if name.startswith('trial_') and name.endswith('.json'):
+            os.remove(os.path.join(sweep_dir, name))
+
+    jobs = []
+    for trial, params in enumerate(trials):
+        trial_dir = os.path.join(sweep_dir, 'trial_{}'.format(trial))
+        trial_model_file = os.path.join(trial_dir, os.path.basename(os.path.normpath(model_file)))
+        # models saved to a directory need it to exist
+        os.makedirs(trial_model_file if os.path.isdir(model_file) else os.path.dirname(trial_model_file), exist_ok=True)
+        trial_args = args + sweep.trial_args(params) + [
+            '--model-file', trial_model_file,
+            '--sweep-dir', sweep_dir,
+            '--sweep-trial', str(trial)]
+        jobs.append((trial_args,))
+    with open(os.path.join(sweep_dir, 'trials.json'), 'w') as f:
+        json.dump([{'trial': trial, 'params': params, 'args': job[0]}
+                   for trial, (params, job) in enumerate(zip(trials, jobs))], f, indent=2)
+
+    workers = max(1, min(config.get('workers', 1), len(jobs)))
+    results = bu.run_in_workers(bu.model, jobs, workers, config.get('cpu_threads', 0), 'trial')
+
+    rows = []
+    for trial, (params, (metrics, error)) in enumerate(zip(trials, results)):
+        if error is not None:
+            print('[ trial {} failed ]\n{}'.format(trial, error))
+        rows.append({'trial': trial, 'params': params, 'metrics': _metrics_row(metrics),
+                     'status': _trial_status(sweep_dir, trial, metrics, error)})
+    chosen_metric = _option(args, ('--chosen-metrics',), 'accuracy')
+    lines = write_table(os.path.join(sweep_dir, 'results.tsv'), rows, chosen_metric)
+    print('[ sweep results are saved to {} ]'.format(os.path.join(sweep_dir, 'results.tsv')))
+    print('\n'.join(lines))
+    return rows
+
+
+if __name__ == '__main__':
+    with open(sys.argv[1]) as config_file:
+        run_sweep(json.load(config_file))
@@ -0,0 +1,321 @@
+"""Throughput and latency benchmarks of the agents' act and batch_act.
+
+Every agent is built from a tiny randomly initialized model and fed synthetic
+texts of controlled length, so the suite runs offline on CPU. Results are written
+as json to ./build/benchmarks (BENCHMARKS_DIR), batch sizes, text lengths and the
+number of repeats are set by BENCHMARK_BATCH_SIZES, BENCHMARK_LENGTHS and
+BENCHMARK_REPEATS environment variables.
+
+Run with:
+    python -m unittest discover -s tests/benchmarks -p '*_benchmarks.py'
+"""
+import os
+import random
+import shutil
+import subprocess
+import tempfile
+import unittest
+
+import benchmark_utils as bmu
+import build_utils as bu
+
+
+class AgentBenchmark(unittest.TestCase):
+    """Parent class for agent benchmarks.
+
+    Child classes define `build_agent` and `make_observation`, the benchmarked
+    agent is shared by all tests of a class.
+    """
+
+    name = None
+    supports_batch_act = True
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp_dir = tempfile.mkdtemp(prefix='benchmark_' + cls.name + '_')
+        cls.rng = random.Random(0)
+        cls.results = []
+        try:
+            cls.agent = cls.build_agent(cls.tmp_dir)
+        except ImportError as e:
+            shutil.rmtree(cls.tmp_dir, ignore_errors=True)
+            raise unittest.SkipTest('{} dependencies are not installed: {}'.format(cls.name, e))
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.agent.shutdown()
+        if cls.results:
+            path = bmu.save_results(cls.name, cls.results)
+            print('[ {} benchmark results are saved to {} ]'.format(cls.name, path))
+        shutil.rmtree(cls.tmp_dir, ignore_errors=True)
+
+    @classmethod
+    def build_agent(cls, tmp_dir):
+        raise NotImplementedError
+
+    @classmethod
+    def make_observation(cls, length, train):
+        raise NotImplementedError
+
+    def record(self, method, mode, length, result):
+        result.update({'method': method, 'mode': mode, 'length': length})
+        print('[ {} {} {}: {} ]'.format(self.name, method, mode, result))
+        self.results.append(result)
+
+    def run_batch_act(self, train):
+        mode = 'train' if train else 'inference'
+        for length in bmu.LENGTHS:
+            for batch_size in bmu.BATCH_SIZES:
+                def make_args(_):
+                    return [self.make_observation(length, train) for _ in range(batch_size)],
+                self.record('batch_act', mode, length, bmu.measure(self.agent.batch_act, make_args, batch_size))
+
+    def run_act(self, train):
+        mode = 'train' if train else 'inference'
+
+        def observe_act(observation):
+            self.agent.observe(observation)
+            return self.agent.act()
+
+        for length in bmu.LENGTHS:
+            def make_args(_):
+                return self.make_observation(length, train),
+            self.record('act', mode, length, bmu.measure(observe_act, make_args, 1))
+
+    def test_batch_act_inference(self):
+        if not self.supports_batch_act:
+            self.skipTest('{} has no batch_act'.format(self.name))
+        self.run_batch_act(train=False)
+
+    def test_batch_act_train(self):
+        if not self.supports_batch_act:
+            self.skipTest('{} has no batch_act'.format(self.name))
+        self.run_batch_act(train=True)
+
+    def test_act_inference(self):
+        self.run_act(train=False)
+
+    def test_act_train(self):
+        self.run_act(train=True)
+
+
+class NerBenchmark(AgentBenchmark):
+    name = 'ner'
+    tags = ['O', 'B-PER', 'I-PER', 'B-LOC', 'I-LOC', 'B-ORG', 'I-ORG']
+
+    @classmethod
+    def build_agent(cls, tmp_dir):
+        from deeppavlov.agents.ner.ner import NERAgent
+        cls.vocab = bmu.make_vocab(bmu.CYRILLIC)
+        dict_file = os.path.join(tmp_dir, 'ner.dict')
+        opt = bu.arg_parse(['-t', 'deeppavlov.tasks.ner.agents',
+                            '-m', 'deeppavlov.agents.ner.ner:NERAgent',
+                            '-mf', os.path.join(tmp_dir, 'ner'),
+                            '--dict-file', dict_file])
+        dictionary = NERAgent.dictionary_class()(opt)
+        dictionary.observe({'text': ' '.join(cls.vocab), 'labels': [' '.join(cls.tags)], 'episode_done': True})
+        dictionary.act()
+        dictionary.save(dict_file)
+        return NERAgent(opt)
+
+    @classmethod
+    def make_observation(cls, length, train):
+        observation = {'text': bmu.make_sentence(cls.rng, cls.vocab, length), 'episode_done': True}
+        if train:
+            observation['labels'] = [' '.join(cls.rng.choice(cls.tags) for _ in range(length))]
+        return observation
+
+
+class InsultsBenchmark(AgentBenchmark):
+    name = 'insults'
+
+    @classmethod
+    def build_agent(cls, tmp_dir):
+        from deeppavlov.agents.insults.insults_agents import InsultsAgent
+        cls.vocab = bmu.make_vocab(bmu.LATIN)
+        fasttext_model = bmu.train_fasttext(os.path.join(tmp_dir, 'fasttext'), cls.vocab, dim=16)
+        opt = bu.arg_parse(['-t', 'deeppavlov.tasks.insults.agents',
+                            '-m', 'deeppavlov.agents.insults.insults_agents:InsultsAgent',
+                            '-mf', os.path.join(tmp_dir, 'insults'),
+                            '--model_name', 'cnn_word',
+                            '--fasttext_model', fasttext_model,
+                            '--embedding_dim', '16',
+                            '--max_sequence_length', str(max(bmu.LENGTHS)),
+                            '--filters_cnn', '8',
+                            '--dense_dim', '8'])
+        return InsultsAgent(opt)
+
+    @classmethod
+    def make_observation(cls, length, train):
+        observation = {'text': bmu.make_sentence(cls.rng, cls.vocab, length), 'episode_done': True}
+        if train:
+            observation['labels'] = [cls.rng.choice(['Insult', 'Non-insult'])]
+        return observation
+
+
+class ParaphraserBenchmark(AgentBenchmark):
+    name = 'paraphraser'
+
+    @classmethod
+    def build_agent(cls, tmp_dir):
+        from deeppavlov.agents.paraphraser.paraphraser import ParaphraserAgent
+        cls.vocab = bmu.make_vocab(bmu.CYRILLIC)
+        fasttext_model = bmu.train_fasttext(os.path.join(tmp_dir, 'fasttext'), cls.vocab, dim=16)
+        opt = bu.arg_parse(['-t', 'deeppavlov.tasks.paraphrases.agents',
+                            '-m', 'deeppavlov.agents.paraphraser.paraphraser:ParaphraserAgent',
+                            '-mf', os.path.join(tmp_dir, 'paraphraser'),
+                            '--fasttext_model', fasttext_model,
+                            '--embedding_dim', '16',
+                            '--max_sequence_length', str(max(bmu.LENGTHS)),
+                            '--hidden_dim', '8',
+                            '--attention_dim', '4',
+                            '--perspective_num', '2',
+                            '--aggregation_dim', '8',
+                            '--dense_dim', '8'])
+        return ParaphraserAgent(opt)
+
+    @classmethod
+    def make_observation(cls, length, train):
+        text = '\n'.join(['Эти два предложения являются парафразами?',
+                          bmu.make_sentence(cls.rng, cls.vocab, length),
+                          bmu.make_sentence(cls.rng, cls.vocab, length)])
+        observation = {'text': text, 'episode_done': True}
+        if train:
+            observation['labels'] = [cls.rng.choice(['Да', 'Нет'])]
+        return observation
+
+
+class SquadBenchmark(AgentBenchmark):
+    name = 'squad'
+    question_length = 8
+
+    @classmethod
+    def build_agent(cls, tmp_dir):
+        try:
+            from deeppavlov.agents.squad.squad import SquadAgent
+        except OSError as e:
+            # spaCy model 'en' is not linked
+            raise ImportError(e)
+        cls.vocab = bmu.make_vocab(bmu.LATIN)
+        embedding_file = bmu.write_vectors(os.path.join(tmp_dir, 'glove.txt'), cls.vocab, dim=8)
+        dict_file = os.path.join(tmp_dir, 'squad.dict')
+        opt = bu.arg_parse(['-t', 'squad',
+                            '-m', 'deeppavlov.agents.squad.squad:SquadAgent',
+                            '-mf', os.path.join(tmp_dir, 'squad'),
+                            '--dict-file', dict_file,
+                            '--embedding_file', embedding_file,
+                            '--type', 'fastqa_default',
+                            '--char_embedding_dim', '4',
+                            '--encoder_hidden_dim', '8',
+                            '--projection_dim', '8',
+                            '--pointer_dim', '8'])
+        dictionary = SquadAgent.dictionary_class()(opt)
+        dictionary.observe({'text': ' '.join(cls.vocab), 'episode_done': True})
+        dictionary.act()
+        dictionary.save(dict_file)
+        return SquadAgent(opt)
+
+    @classmethod
+    def make_observation(cls, length, train):
+        document = bmu.make_sentence(cls.rng, cls.vocab, length)
+        question = bmu.make_sentence(cls.rng, cls.vocab, cls.question_length)
+        observation = {'text': document + '\n' + question, 'episode_done': True}
+        if train:
+            words = document.split(' ')
+            start = cls.rng.randrange(len(words))
+            observation['labels'] = [' '.join(words[start:start + 2])]
+        return observation
+
+
+def compile_coref_kernels(path):
+    """Build coref_kernels.so into the path, raise ImportError if it can not be compiled."""
+    import tensorflow as tf
+    source = os.path.join(os.path.dirname(bu.__file__), 'deeppavlov', 'agents', 'coreference', 'coref_kernels.cc')
+    try:
+        subprocess.check_call(['g++', '-std=c++11', '-shared', source, '-o', os.path.join(path, 'coref_kernels.so'),
+                               '-I', tf.sysconfig.get_include(), '-fPIC', '-D_GLIBCXX_USE_CXX11_ABI=0'])
+    except (OSError, subprocess.CalledProcessError) as e:
+        raise ImportError('coref_kernels.so can not be compiled: {}'.format(e))
+
+
+class CoreferenceBenchmark(AgentBenchmark):
+    """Benchmark of the end-to-end coreference agent, `length` is a number of sentences in a document."""
+
+    name = 'coreference'
+    supports_batch_act = False
+    sentence_length = 15
+
+    @classmethod
+    def build_agent(cls, tmp_dir):
+        from deeppavlov.agents.coreference.agents import CoreferenceAgent
+        compile_coref_kernels(tmp_dir)
+        cls.vocab = bmu.make_vocab(bmu.CYRILLIC)
+        agent_dir = os.path.join(tmp_dir, 'russian', 'agent')
+        os.makedirs(os.path.join(agent_dir, 'embeddings'))
+        os.makedirs(os.path.join(agent_dir, 'vocab'))
+        bmu.write_vectors(os.path.join(agent_dir, 'embeddings', 'embeddings_lenta_100.vec'), cls.vocab, dim=16,
+                          header=True)
+        bmu.train_fasttext(os.path.join(agent_dir, 'embeddings', 'ft_0.8.3_nltk_yalen_sg_300'), cls.vocab, dim=16)
+        with open(os.path.join(agent_dir, 'vocab', 'char_vocab.russian.txt'), 'w') as f:
+            f.write('\n'.join(sorted(set(bmu.CYRILLIC))) + '\n')
+        opt = bu.arg_parse(['-t', 'deeppavlov.tasks.coreference.agents',
+                            '-m', 'deeppavlov.agents.coreference.agents:CoreferenceAgent',
+                            '-mf', tmp_dir,
+                            '--language', 'russian',
+                            '--name', 'benchmark',
+                            '--pretrained_model', 'False',
+                            '--embedding_size', '16',
+                            '--char_embedding_size', '4',
+                            '--filter_size', '4',
+                            '--lstm_size', '8',
+                            '--ffnn_size', '8',
+                            '--feature_size', '4'])
+        opt.setdefault('language', 'russian')
+        return CoreferenceAgent(opt)
+
+    @classmethod
+    def make_observation(cls, length, train):
+        lines = bmu.make_conll_document(cls.rng, cls.vocab, 'bc/benchmark', length, cls.sentence_length)
+        return {'conll_str': '\n'.join(lines) + '\n', 'mode': 'train' if train else 'valid', 'iter_id': 0,
+                'epoch_done': False, 'doc_name': 'benchmark'}
+
+
+class CoreferenceScorerBenchmark(AgentBenchmark):
+    """Benchmark of the mention scorer agent, `length` is a number of sentences in a document.
+
+    The agent trains on the whole observation with its own inner loop, so only
+    inference on valid documents is measured.
+    """
+
+    name = 'coreference_scorer'
+    supports_batch_act = False
+    sentence_length = 15
+    documents = 4
+
+    @classmethod
+    def build_agent(cls, tmp_dir):
+        from deeppavlov.agents.coreference_scorer_model.agents import CoreferenceAgent
+        cls.vocab = bmu.make_vocab(bmu.CYRILLIC)
+        embeddings_path = bmu.train_fasttext(os.path.join(tmp_dir, 'fasttext'), cls.vocab, dim=16)
+        opt = bu.arg_parse(['-t', 'deeppavlov.tasks.coreference.agents',
+                            '-m', 'deeppavlov.agents.coreference_scorer_model.agents:CoreferenceAgent',
+                            '-mf', tmp_dir,
+                            '--datapath', tmp_dir,
+                            '--embeddings_path', embeddings_path,
+                            '--dense_hidden_size', '8'])
+        opt.setdefault('language', 'russian')
+        opt.setdefault('scorer_path', 'scorer.pl')
+        return CoreferenceAgent(opt)
+
+    @classmethod
+    def make_observation(cls, length, train):
+        documents = [bmu.make_conll_document(cls.rng, cls.vocab, 'bc/doc_{}'.format(i), length, cls.sentence_length)
+                     for i in range(cls.documents)]
+        return {'conll': [], 'valid_conll': documents}
+
+    def test_act_train(self):
+        self.skipTest('{} trains only on the whole dataset'.format(self.name))
+
+
+if __name__ == '__main__':
+    unittest.main()
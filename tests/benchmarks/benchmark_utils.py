@@ -0,0 +1,120 @@
+"""Synthetic data and timing helpers for agent benchmarks."""
+import json
+import os
+import random
+import time
+
+import numpy as np
+
+# benchmarks run offline on CPU
+os.environ.setdefault('CUDA_VISIBLE_DEVICES', '')
+os.environ.setdefault('KERAS_BACKEND', 'tensorflow')
+
+RESULTS_DIR = os.environ.get('BENCHMARKS_DIR', './build/benchmarks')
+BATCH_SIZES = [int(bs) for bs in os.environ.get('BENCHMARK_BATCH_SIZES', '1,8,32').split(',')]
+LENGTHS = [int(length) for length in os.environ.get('BENCHMARK_LENGTHS', '10,50').split(',')]
+REPEATS = int(os.environ.get('BENCHMARK_REPEATS', '20'))
+WARMUP = 2
+
+LATIN = 'abcdefghijklmnopqrstuvwxyz'
+CYRILLIC = 'абвгдежзийклмнопрстуфхцчшщыэюя'
+
+
+def make_vocab(alphabet, size=300, seed=0):
+    """Return a list of random words of 2 to 10 characters."""
+    rng = random.Random(seed)
+    return sorted({''.join(rng.choice(alphabet) for _ in range(rng.randint(2, 10))) for _ in range(size)})
+
+
+def make_sentence(rng, vocab, length):
+    """Return a sentence of exactly `length` space separated words."""
+    return ' '.join(rng.choice(vocab) for _ in range(length))
+
+
+def write_corpus(path, vocab, n_sentences=200, length=20, seed=0):
+    """Write a corpus of random sentences, one per line."""
+    rng = random.Random(seed)
+    with open(path, 'w') as f:
+        for _ in range(n_sentences):
+            f.write(make_sentence(rng, vocab, length) + '\n')
+    return path
+
+
+def train_fasttext(path, vocab, dim):
+    """Train a tiny skipgram fasttext model over the vocabulary, returns path to the .bin file."""
+    import fasttext
+    corpus = write_corpus(path + '.txt', vocab)
+    fasttext.skipgram(corpus, path, dim=dim, min_count=1, epoch=1, bucket=1000, thread=1, silent=1)
+    return path + '.bin'
+
+
+def write_vectors(path, words, dim, header=False, seed=0):
+    """Write random word vectors in the text format: word e1 ... ed."""
+    rng = np.random.RandomState(seed)
+    with open(path, 'w') as f:
+        if header:
+            f.write('{} {}\n'.format(len(words), dim))
+        for w in words:
+            f.write(w + ' ' + ' '.join('{:.5f}'.format(v) for v in rng.randn(dim)) + '\n')
+    return path
+
+
+def make_conll_document(rng, vocab, doc_name, n_sentences, length, n_chains=3):
+    """Return lines of a CoNLL-2012 document with a few random coreference chains."""
+    lines = ['#begin document ({}); part 000'.format(doc_name)]
+    mentions = {}
+    for s in range(n_sentences):
+        for chain in range(n_chains):
+            mentions[(s, rng.randrange(length))] = chain
+    for s in range(n_sentences):
+        for w in range(length):
+            chain = mentions.get((s, w))
+            coref = '({})'.format(chain) if chain is not None else '-'
+            lines.append('\t'.join([doc_name, '0', str(w), rng.choice(vocab), 'NN', '*', '-', '-', '-',
+                                    'speaker', '*', '*', coref]))
+        lines.append('')
+    lines.append('#end document')
+    return lines
+
+
+def summarize(latencies, batch_size):
+    """Throughput and latency percentiles of a list of call durations in seconds."""
+    latencies = np.array(latencies)
+    return {'batch_size': batch_size,
+            'repeats': len(latencies),
+            'mean_ms': round(float(latencies.mean() * 1000), 3),
+            'p50_ms': round(float(np.percentile(latencies, 50) * 1000), 3),
+            'p99_ms': round(float(np.percentile(latencies, 99) * 1000), 3),
+            'examples_per_sec': round(float(batch_size * len(latencies) / latencies.sum()), 2)}
+
+
+def measure(call, make_args, batch_size, repeats=REPEATS, warmup=WARMUP):
+    """Time `call(*make_args(i))`, input preparation is not timed.
+
+    Args:
+        call: function to benchmark
+        make_args: function of iteration number returning a tuple of call arguments
+        batch_size: number of examples processed by one call
+        repeats: number of timed calls
+        warmup: number of untimed calls before measuring
+
+    Returns:
+        dictionary with throughput and latency percentiles
+    """
+    latencies = []
+    for i in range(warmup + repeats):
+        args = make_args(i)
+        start = time.perf_counter()
+        call(*args)
+        if i >= warmup:
+            latencies.append(time.perf_counter() - start)
+    return summarize(latencies, batch_size)
+
+
+def save_results(name, results):
+    """Write benchmark results to <RESULTS_DIR>/<name>.json."""
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    path = os.path.join(RESULTS_DIR, name + '.json')
+    with open(path, 'w') as f:
+        json.dump({'agent': name, 'results': results}, f, indent=2)
+    return path
@@ -0,0 +1,86 @@
+"""Import time benchmarks of the agents.
+
+Every module is imported in a fresh interpreter. The test fails if importing it
+creates the keras session or loads the spaCy model, or if the import takes more
+than BENCHMARK_IMPORT_SECONDS seconds. Import times are written as json to
+./build/benchmarks/imports.json (BENCHMARKS_DIR).
+
+Run with:
+    python -m unittest discover -s tests/benchmarks -p 'import_benchmarks.py'
+"""
+import json
+import os
+import subprocess
+import sys
+import unittest
+
+import benchmark_utils as bmu
+
+
+IMPORT_SECONDS = float(os.environ.get('BENCHMARK_IMPORT_SECONDS', '20'))
+
+MODULES = [
+    'deeppavlov.agents.ner.ner',
+    'deeppavlov.agents.insults.model',
+    'deeppavlov.agents.insults.insults_agents',
+    'deeppavlov.agents.paraphraser.model',
+    'deeppavlov.agents.paraphraser.paraphraser',
+    'deeppavlov.agents.squad.embeddings_dict',
+    'deeppavlov.agents.squad.model',
+    'deeppavlov.agents.squad.squad',
+    'deeppavlov.agents.coreference.agents',
+    'deeppavlov.agents.coreference_scorer_model.agents',
+]
+
+PROBE = '''
+import importlib, json, sys, time
+start = time.perf_counter()
+try:
+    module = importlib.import_module(sys.argv[1])
+except ImportError as e:
+    print(json.dumps({'skip': str(e)}))
+    sys.exit(0)
+seconds = time.perf_counter() - start
+session = None
+if 'keras.backend.tensorflow_backend' in sys.modules:
+    session = sys.modules['keras.backend.tensorflow_backend']._SESSION
+squad_dict = sys.modules.get('deeppavlov.agents.squad.embeddings_dict')
+print(json.dumps({
+    'seconds': seconds,
+    'keras_session': session is not None,
+    'spacy_model': squad_dict is not None and squad_dict._NLP is not None,
+}))
+'''
+
+
+class ImportBenchmark(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.results = []
+
+    @classmethod
+    def tearDownClass(cls):
+        if cls.results:
+            path = bmu.save_results('imports', cls.results)
+            print('[ import benchmark results are saved to {} ]'.format(path))
+
+    def test_imports(self):
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.pathsep.join([os.getcwd(), env.get('PYTHONPATH', '')])
+        for module in MODULES:
+            with self.subTest(module=module):
+                output = subprocess.check_output([sys.executable, '-c', PROBE, module], env=env)
+                result = json.loads(output.decode('utf-8').strip().splitlines()[-1])
+                if 'skip' in result:
+                    self.skipTest('{} dependencies are not installed: {}'.format(module, result['skip']))
+                result['module'] = module
+                print('[ import {}: {} ]'.format(module, result))
+                self.results.append(result)
+                self.assertFalse(result['keras_session'], 'keras session is created on import')
+                self.assertFalse(result['spacy_model'], 'spaCy model is loaded on import')
+                self.assertLess(result['seconds'], IMPORT_SECONDS)
+
+
+if __name__ == '__main__':
+    unittest.main()
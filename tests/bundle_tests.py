@@ -0,0 +1,117 @@
+import importlib.util
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from deeppavlov.utils import bundle
+
+
+def write_file(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        f.write(content)
+
+
+def read_file(path):
+    with open(path) as f:
+        return f.read()
+
+
+class RecordingAgent(object):
+    """Agent which keeps the options it is created with."""
+
+    @staticmethod
+    def add_cmdline_args(argparser):
+        pass
+
+    def __init__(self, opt, shared=None):
+        self.opt = opt
+
+
+class TestBundle(unittest.TestCase):
+    def test_weights(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            model_file = os.path.join(tmp, 'model', 'model')
+            write_file(model_file + '.json', '{"dim": 2}')
+            write_file(model_file + '.h5', 'weights')
+            weights = [np.arange(6, dtype=np.float32).reshape(2, 3), np.array([1, 2], dtype=np.int64)]
+            bundle_path = os.path.join(tmp, 'agent.bundle')
+            bundle.write_bundle(bundle_path, {'model_file': model_file, 'dim': 2}, {'model_file': '0/model'},
+                                {'0/model.json': model_file + '.json', '0/model.h5': model_file + '.h5'},
+                                '0/model.h5', weights)
+
+            saved = bundle.Bundle(bundle_path)
+            self.assertEqual(saved.opt['dim'], 2)
+            self.assertEqual(saved.files, ['0/model.h5', '0/model.json'])
+            self.assertEqual(bytes(saved.file('0/model.json')), b'{"dim": 2}')
+            for w, expected in zip(saved.weights(), weights):
+                np.testing.assert_array_equal(w, expected)
+                self.assertEqual(w.dtype, expected.dtype)
+
+            files_path = bundle.unpack(saved)
+            self.assertEqual(read_file(os.path.join(files_path, '0', 'model.json')), '{"dim": 2}')
+            # weights are taken from the bundle, the weights file is left empty
+            self.assertEqual(read_file(os.path.join(files_path, '0', 'model.h5')), '')
+            registered = bundle.registered_weights(os.path.join(files_path, '0', 'model.h5'))
+            np.testing.assert_array_equal(registered[0], weights[0])
+            # the second unpack reuses the files
+            stamp = os.path.getmtime(os.path.join(files_path, bundle.STAMP_FILE))
+            self.assertEqual(bundle.unpack(bundle.Bundle(bundle_path)), files_path)
+            self.assertEqual(os.path.getmtime(os.path.join(files_path, bundle.STAMP_FILE)), stamp)
+
+    @staticmethod
+    def export_ensemble(tmp):
+        """Export an ensemble of bagging folds 0, 1 and 10, return the bundle and the model files."""
+        prefix = os.path.join(tmp, 'build', 'paraphraser')
+        model_files = ['{}_{}'.format(prefix, i) for i in (0, 1, 10)]
+        for model_file in model_files:
+            write_file(model_file + '.h5', 'weights of ' + os.path.basename(model_file))
+            write_file(model_file + '_opt.json', os.path.basename(model_file))
+        write_file(prefix + '.emb.store', 'embeddings')
+        opt = {'model': __name__ + ':RecordingAgent', 'model_files': model_files,
+               'fasttext_embeddings_dict': prefix + '.emb', 'datatype': 'test'}
+        bundle_path = os.path.join(tmp, 'ensemble.bundle')
+        bundle.export_agent(object(), opt, bundle_path)
+        return bundle_path, model_files
+
+    def test_ensemble(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            bundle_path, model_files = self.export_ensemble(tmp)
+
+            saved = bundle.Bundle(bundle_path)
+            self.assertIsNone(saved.weights_file)
+            self.assertEqual(len(saved.roots['model_files']), 3)
+            files_path = bundle.unpack(saved)
+            for root, model_file in zip(saved.roots['model_files'], model_files):
+                name = os.path.basename(model_file)
+                self.assertEqual(read_file(os.path.join(files_path, root + '.h5')), 'weights of ' + name)
+                self.assertEqual(read_file(os.path.join(files_path, root + '_opt.json')), name)
+            # files of the fold 10 are not packed with the fold 1
+            root = os.path.dirname(saved.roots['model_files'][1])
+            self.assertEqual(sorted(os.listdir(os.path.join(files_path, root))),
+                             ['paraphraser_1.h5', 'paraphraser_1_opt.json'])
+
+    @unittest.skipUnless(importlib.util.find_spec('parlai'), 'parlai is not installed')
+    def test_load_agent(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            bundle_path, model_files = self.export_ensemble(tmp)
+            agent = bundle.load_agent(bundle_path)
+
+            files_path = bundle_path + '.files'
+            self.assertEqual(len(agent.opt['model_files']), 3)
+            for path, model_file in zip(agent.opt['model_files'], model_files):
+                self.assertTrue(path.startswith(files_path))
+                self.assertEqual(read_file(path + '.h5'), 'weights of ' + os.path.basename(model_file))
+            self.assertEqual(read_file(agent.opt['fasttext_embeddings_dict'] + '.store'), 'embeddings')
+
+    def test_missing_model_files(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            opt = {'model_files': [os.path.join(tmp, 'missing')]}
+            with self.assertRaises(ValueError):
+                bundle.export_agent(object(), opt, os.path.join(tmp, 'ensemble.bundle'))
+
+
+if __name__ == '__main__':
+    unittest.main()
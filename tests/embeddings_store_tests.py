@@ -0,0 +1,74 @@
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from deeppavlov.utils import embeddings_store
+
+
+class TestEmbeddingsStore(unittest.TestCase):
+    def test_round_trip(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            fname = os.path.join(tmp, 'dict.emb')
+            store = embeddings_store.EmbeddingsStore()
+            store['cat'] = [1, 2, 3]
+            store['ёж'] = [4, 5, 6]
+            store.save(fname)
+            self.assertEqual(os.listdir(tmp), ['dict.emb.store'])
+
+            loaded = embeddings_store.load(fname, 3)
+            self.assertIsInstance(loaded.matrix, np.memmap)
+            self.assertEqual(sorted(loaded), ['cat', 'ёж'])
+            np.testing.assert_array_equal(loaded['ёж'], [4, 5, 6])
+
+            snapshot = loaded.snapshot()
+            loaded['dog'] = [7, 8, 9]
+            self.assertNotIn('dog', snapshot)
+            self.assertEqual(len(snapshot), 2)
+            self.assertEqual(len(loaded), 3)
+
+            # saved over the file it is mapped from
+            loaded.save(fname)
+            reloaded = embeddings_store.load(fname, 3)
+            self.assertEqual(sorted(reloaded), ['cat', 'dog', 'ёж'])
+            np.testing.assert_array_equal(reloaded['cat'], [1, 2, 3])
+            np.testing.assert_array_equal(reloaded['dog'], [7, 8, 9])
+
+    def test_empty(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            fname = os.path.join(tmp, 'dict.emb')
+            self.assertFalse(embeddings_store.exists(fname))
+            self.assertEqual(len(embeddings_store.load(fname, 3)), 0)
+
+    def test_text_migration(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            fname = os.path.join(tmp, 'dict.emb')
+            with open(fname, 'w') as f:
+                f.write('cat 0.5 -1 2\n')
+                f.write('a b 1 2 3\n')
+            self.assertTrue(embeddings_store.exists(fname))
+            self.assertFalse(embeddings_store.is_binary(fname))
+
+            store = embeddings_store.load(fname, 3)
+            self.assertTrue(embeddings_store.is_binary(fname))
+            self.assertEqual(sorted(store), ['a b', 'cat'])
+            np.testing.assert_array_equal(store['cat'], np.array([0.5, -1, 2], dtype=np.float32))
+            np.testing.assert_array_equal(store['a b'], [1, 2, 3])
+
+    def test_truncated(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            fname = os.path.join(tmp, 'dict.emb')
+            store = embeddings_store.EmbeddingsStore()
+            store['cat'] = [1, 2, 3]
+            store.save(fname)
+            path = fname + '.store'
+            with open(path, 'r+b') as f:
+                f.truncate(os.path.getsize(path) - 4)
+
+            with self.assertRaises(ValueError):
+                embeddings_store.load(fname, 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
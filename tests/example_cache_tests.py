@@ -0,0 +1,44 @@
+import unittest
+
+from deeppavlov.utils.example_cache import ExampleCache, caching
+
+
+class TestExampleCache(unittest.TestCase):
+    def test_cyclic_passes(self):
+        cache = ExampleCache(enabled=True, max_size=100)
+        built = []
+        for _ in range(2):
+            for key in range(150):
+                self.assertEqual(cache.get(key, lambda k: built.append(k) or -k, key), -key)
+
+        # the first 100 examples are kept and hit in the second pass
+        self.assertEqual(len(cache), 100)
+        self.assertEqual(cache.hits, 100)
+        self.assertEqual(cache.misses, 200)
+        self.assertEqual(built, list(range(150)) + list(range(100, 150)))
+
+    def test_disabled(self):
+        cache = ExampleCache(max_size=100)
+        cache.get('a', str, 'a')
+        self.assertEqual(len(cache), 0)
+
+    def test_caching(self):
+        class Model(object):
+            example_cache = ExampleCache()
+
+        class Agent(object):
+            example_cache = ExampleCache()
+            model = Model()
+
+        agent = Agent()
+        with caching(agent):
+            self.assertTrue(agent.example_cache.enabled)
+            self.assertTrue(agent.model.example_cache.enabled)
+        self.assertFalse(agent.example_cache.enabled)
+        self.assertFalse(agent.model.example_cache.enabled)
+        with caching(agent, enabled=False):
+            self.assertFalse(agent.example_cache.enabled)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+import os
+import struct
+import tempfile
+import unittest
+
+import numpy as np
+
+from deeppavlov.utils import fasttext_mmap
+
+
+def write_fasttext_bin(path, words, matrix, minn, maxn, bucket):
+    """Write a fasttext binary model (format version 12) with the given input matrix."""
+    dim = matrix.shape[1]
+    with open(path, 'wb') as f:
+        f.write(struct.pack('<ii', fasttext_mmap.FASTTEXT_MAGIC, 12))
+        # dim, ws, epoch, min_count, neg, word_ngrams, loss, model (skipgram), bucket, minn, maxn, lr_update_rate, t
+        f.write(struct.pack('<12id', dim, 5, 5, 1, 5, 1, 2, 2, bucket, minn, maxn, 100, 1e-4))
+        f.write(struct.pack('<3iqq', len(words), len(words), 0, 100, -1))
+        for word in words:
+            f.write(word + b'\0' + struct.pack('<qb', 10, 0))
+        f.write(b'\0')
+        f.write(struct.pack('<2q', *matrix.shape))
+        f.write(matrix.astype('<f4').tobytes())
+        # output matrix, not read
+        f.write(struct.pack('<?2q', False, 0, dim))
+
+
+class TestFastTextHash(unittest.TestCase):
+    def test_fasttext_hash(self):
+        # 32-bit FNV-1a
+        self.assertEqual(fasttext_mmap.fasttext_hash(b''), 0x811c9dc5)
+        self.assertEqual(fasttext_mmap.fasttext_hash(b'a'), 0xe40c292c)
+        self.assertEqual(fasttext_mmap.fasttext_hash(b'foobar'), 0xbf9cf968)
+        # fasttext casts bytes to int8 before xor, so non-ascii bytes are sign-extended
+        self.assertEqual(fasttext_mmap.fasttext_hash(b'\xc3'), ((0x811c9dc5 ^ 0xffffffc3) * 16777619) & 0xffffffff)
+
+    def test_subword_buckets(self):
+        h = fasttext_mmap.fasttext_hash
+        bucket = 2000000
+        self.assertEqual(fasttext_mmap.subword_buckets(b'ab', 3, 6, bucket),
+                         [h(b'<ab') % bucket, h(b'<ab>') % bucket, h(b'ab>') % bucket])
+        # single '<' and '>' are not ngrams, a multibyte character is one char
+        self.assertEqual(fasttext_mmap.subword_buckets('é'.encode('utf-8'), 1, 1, bucket),
+                         [h('é'.encode('utf-8')) % bucket])
+
+
+class TestFastTextMmap(unittest.TestCase):
+    def test_round_trip(self):
+        words = [b'cat', b'dog', 'ёж'.encode('utf-8')]
+        minn, maxn, bucket, dim = 2, 3, 50, 4
+        matrix = np.random.RandomState(0).rand(len(words) + bucket, dim).astype(np.float32)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            bin_path = os.path.join(tmp, 'model.bin')
+            write_fasttext_bin(bin_path, words, matrix, minn, maxn, bucket)
+            old_chunk_rows = fasttext_mmap.CHUNK_ROWS
+            # several chunks of rows
+            fasttext_mmap.CHUNK_ROWS = 5
+            try:
+                model = fasttext_mmap.load_model(bin_path)
+            finally:
+                fasttext_mmap.CHUNK_ROWS = old_chunk_rows
+
+            self.assertTrue(fasttext_mmap.is_converted(bin_path))
+            self.assertEqual((model.dim, model.minn, model.maxn, model.bucket), (dim, minn, maxn, bucket))
+            self.assertEqual(model.words, ['cat', 'dog', 'ёж'])
+            for i, word in enumerate(words):
+                rows = [i] + [len(words) + b for b in fasttext_mmap.subword_buckets(word, minn, maxn, bucket)]
+                self.assertIn(word.decode('utf-8'), model)
+                np.testing.assert_allclose(model[word.decode('utf-8')], matrix[rows].mean(axis=0), rtol=1e-6)
+            oov = [len(words) + b for b in fasttext_mmap.subword_buckets(b'cow', minn, maxn, bucket)]
+            self.assertNotIn('cow', model)
+            np.testing.assert_allclose(model['cow'], matrix[oov].mean(axis=0), rtol=1e-6)
+
+    def test_not_a_model(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            bin_path = os.path.join(tmp, 'model.bin')
+            write_fasttext_bin(bin_path, [b'cat'], np.zeros((3, 2), dtype=np.float32), 2, 3, 5)
+            with self.assertRaises(ValueError):
+                fasttext_mmap.convert(bin_path)
+
+
+if __name__ == '__main__':
+    unittest.main()
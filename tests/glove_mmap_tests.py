@@ -0,0 +1,100 @@
+import importlib.util
+import os
+import tempfile
+import unicodedata
+import unittest
+
+import numpy as np
+
+from deeppavlov.utils import glove_mmap
+
+GLOVE = {
+    'the': [0.1, 0.2, 0.3],
+    'cat': [-1.5, 2.0, 0.0],
+    'café': [3.0, -0.25, 1.0],
+    ',': [0.0, 0.0, 1.0],
+}
+
+
+def write_glove(path, vectors):
+    with open(path, 'w') as f:
+        for word, vector in vectors.items():
+            f.write(' '.join([word] + [str(v) for v in vector]) + '\n')
+
+
+class WordDict(object):
+    """Dictionary of words indexed by their position, the first word is the null token."""
+
+    def __init__(self, words):
+        self.words = ['__NULL__'] + words
+
+    def __getitem__(self, key):
+        if isinstance(key, int):
+            return self.words[key]
+        return self.words.index(key)
+
+    def __len__(self):
+        return len(self.words)
+
+
+class TestGloveMmap(unittest.TestCase):
+    def test_vectors(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            txt_path = os.path.join(tmp, 'glove.txt')
+            write_glove(txt_path, GLOVE)
+            vectors = glove_mmap.load_vectors(txt_path)
+
+            self.assertTrue(glove_mmap.is_converted(txt_path))
+            self.assertEqual(vectors.dim, 3)
+            self.assertEqual(len(vectors), len(GLOVE))
+            for word, vector in GLOVE.items():
+                np.testing.assert_array_equal(vectors[unicodedata.normalize('NFD', word)],
+                                              np.array(vector, dtype=np.float32))
+            self.assertNotIn('dog', vectors)
+            with self.assertRaises(KeyError):
+                vectors['dog']
+
+            # a changed source file is converted again
+            write_glove(txt_path, dict(GLOVE, dog=[1.0, 1.0, 1.0]))
+            os.utime(txt_path, (0, 0))
+            self.assertFalse(glove_mmap.is_converted(txt_path))
+            self.assertIn('dog', glove_mmap.load_vectors(txt_path))
+
+    def test_dimensions(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            txt_path = os.path.join(tmp, 'glove.txt')
+            write_glove(txt_path, {'the': [0.1, 0.2, 0.3], 'cat': [1.0, 2.0]})
+            with self.assertRaises(ValueError):
+                glove_mmap.convert(txt_path)
+
+
+@unittest.skipUnless(importlib.util.find_spec('keras'), 'keras is not installed')
+class TestSquadEmbeddings(unittest.TestCase):
+    def test_cache(self):
+        from deeppavlov.agents.squad.utils import load_embeddings
+        with tempfile.TemporaryDirectory() as tmp:
+            txt_path = os.path.join(tmp, 'glove.txt')
+            write_glove(txt_path, GLOVE)
+            opt = {'embedding_file': txt_path, 'word_embedding_dim': 3, 'model_file': os.path.join(tmp, 'squad')}
+            cache_file = opt['model_file'] + '.embeddings.npy'
+
+            embeddings = load_embeddings(opt, WordDict(['cat', 'café', 'dog']))
+            self.assertEqual(embeddings.shape, (4, 3))
+            np.testing.assert_array_equal(embeddings[0], [0, 0, 0])
+            np.testing.assert_array_equal(embeddings[1], np.array(GLOVE['cat'], dtype=np.float32))
+            np.testing.assert_array_equal(embeddings[2], np.array(GLOVE['café'], dtype=np.float32))
+            self.assertTrue(os.path.isfile(cache_file))
+
+            # the cached subset is reused for the same words
+            np.save(cache_file, np.full((4, 3), 7, dtype=np.float32))
+            np.testing.assert_array_equal(load_embeddings(opt, WordDict(['cat', 'café', 'dog'])), 7)
+
+            # and built again for other words
+            embeddings = load_embeddings(opt, WordDict(['the', 'cat', 'dog']))
+            np.testing.assert_array_equal(embeddings[1], np.array(GLOVE['the'], dtype=np.float32))
+            np.testing.assert_array_equal(embeddings[2], np.array(GLOVE['cat'], dtype=np.float32))
+            np.testing.assert_array_equal(np.load(cache_file), embeddings)
+
+
+if __name__ == '__main__':
+    unittest.main()
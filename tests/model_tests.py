@@ -1,6 +1,16 @@
 import unittest
 import build_utils as bu
 import datetime
+import os
+import tempfile
+
+from parlai.core.agents import Agent
+from parlai.core.dict import DictionaryAgent
+from parlai.core.params import ParlaiParser
+from parlai.core.worlds import DialogPartnerWorld
+
+from deeppavlov.tasks.paraphrases.metric import BinaryClassificationMetrics
+from deeppavlov.utils import stream
 
 
 def load_tests(loader, tests, pattern):
@@ -218,6 +228,74 @@ class TestIdleCoref(TestCoref):
     expected_score = 0
 
 
+class _LabelsTeacher(stream.StreamDialogTeacher):
+    """Teacher of tab separated labels and texts"""
+
+    def __init__(self, opt, shared=None):
+        self.id = 'labels_teacher'
+        self.metrics = BinaryClassificationMetrics('1')
+        super().__init__(opt, shared)
+
+    def stream_examples(self, path):
+        with open(path) as f:
+            for line in f:
+                label, text = line.rstrip('\n').split('\t')
+                yield (text, [label]), True
+
+
+class _PositiveAgent(Agent):
+    """Agent answering every example with the positive label"""
+
+    def act(self):
+        return {'id': self.getID(), 'text': '1'}
+
+
+class TestStreamValidation(unittest.TestCase):
+    def test_rounds(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'valid.txt')
+            with open(path, 'w') as f:
+                f.write(''.join('{}\ttext {}\n'.format(i % 2, i) for i in range(10)))
+            opt = {'datatype': 'valid:stream', 'datafile': path, 'shuffle_buffer_size': 0, 'stream_seed': 0}
+            world = DialogPartnerWorld(opt, [_LabelsTeacher(opt), _PositiveAgent(opt)])
+            evaluate = getattr(bu, '__evaluate_model')
+            first, world = evaluate(world, 1, 'valid', False)
+            second, world = evaluate(world, 1, 'valid', False)
+
+        self.assertEqual(first['cnt'], 10)
+        self.assertEqual(first, second)
+
+
+class TestShardedDictionary(unittest.TestCase):
+    def test_merge(self):
+        parser = ParlaiParser()
+        DictionaryAgent.add_cmdline_args(parser)
+        opt = parser.parse_args([])
+        texts = ['the cat sat on the mat', 'a dog sat', 'the dog and the cat', 'mat mat mat', 'a cat']
+        dictionary_freqs = getattr(bu, '__dictionary_freqs')
+        new_dictionary_counts = getattr(bu, '__new_dictionary_counts')
+        merge_dictionary_counts = getattr(bu, '__merge_dictionary_counts')
+
+        serial = DictionaryAgent(opt)
+        for text in texts:
+            serial.observe({'text': text, 'episode_done': True})
+            serial.act()
+
+        merged = DictionaryAgent(opt)
+        shards = 3
+        for shard in range(shards):
+            dictionary = DictionaryAgent(opt)
+            initial = dictionary_freqs(dictionary)
+            for text in texts[shard::shards]:
+                dictionary.observe({'text': text, 'episode_done': True})
+                dictionary.act()
+            merge_dictionary_counts(merged, new_dictionary_counts(dictionary, initial))
+
+        self.assertEqual(dict(merged.freq), dict(serial.freq))
+        self.assertEqual(set(merged.tok2ind), set(serial.tok2ind))
+        self.assertEqual({i: t for t, i in merged.tok2ind.items()}, dict(merged.ind2tok))
+
+
 if __name__ == '__main__':
     unittest.main()
 
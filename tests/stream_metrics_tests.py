@@ -0,0 +1,87 @@
+import unittest
+
+from deeppavlov.utils.stream_metrics import ChunkCounts, HistogramAUC, LogLoss
+
+# tags of sentences (ground truth, prediction)
+SENTENCES = [
+    (['B-PER', 'I-PER', 'O', 'B-LOC', 'O'], ['B-PER', 'I-PER', 'O', 'B-LOC', 'O']),
+    (['B-ORG', 'I-ORG', 'I-ORG', 'O', 'B-PER'], ['B-ORG', 'I-ORG', 'O', 'O', 'B-PER']),
+    (['O', 'B-LOC', 'I-LOC', 'O'], ['O', 'B-ORG', 'I-ORG', 'O']),
+    (['I-PER', 'I-PER', 'O', 'B-MISC', 'I-MISC'], ['B-PER', 'I-PER', 'B-MISC', 'I-MISC', 'I-MISC']),
+    (['B-LOC', 'B-LOC', 'O', 'O'], ['B-LOC', 'I-LOC', 'O', 'I-PER']),
+    (['O', 'O', 'B-ORG'], ['O', 'O', 'B-ORG']),
+    (['O', 'O', 'O'], ['B-PER', 'O', 'B-LOC']),
+]
+
+# output of deeppavlov/tasks/ner/conlleval for SENTENCES:
+# processed 29 tokens with 10 phrases; found: 12 phrases; correct: 5.
+# accuracy:  65.52%; precision:  41.67%; recall:  50.00%; FB1:  45.45
+
+
+class TestChunkCounts(unittest.TestCase):
+    def test_conlleval(self):
+        counts = ChunkCounts()
+        for true_tags, pred_tags in SENTENCES:
+            counts.update(true_tags, pred_tags)
+
+        self.assertEqual(counts.tokens, 29)
+        self.assertEqual(counts.found_correct, 10)
+        self.assertEqual(counts.found_guessed, 12)
+        self.assertEqual(counts.correct_chunks, 5)
+        self.assertEqual(round(counts.accuracy(), 2), 65.52)
+        self.assertEqual(round(counts.precision(), 2), 41.67)
+        self.assertEqual(round(counts.recall(), 2), 50.00)
+        self.assertEqual(round(counts.f1(), 2), 45.45)
+
+    def test_merge(self):
+        whole = ChunkCounts()
+        parts = [ChunkCounts(), ChunkCounts()]
+        for i, (true_tags, pred_tags) in enumerate(SENTENCES):
+            whole.update(true_tags, pred_tags)
+            parts[i % 2].update(true_tags, pred_tags)
+        merged = parts[0].merge(parts[1])
+
+        self.assertEqual(vars(merged), vars(whole))
+
+
+class TestHistogramAUC(unittest.TestCase):
+    def test_value(self):
+        auc = HistogramAUC()
+        for y, score in zip([1, 0, 1, 1, 0, 0], [0.9, 0.1, 0.35, 0.8, 0.4, 0.7]):
+            auc.update(y, score)
+
+        # 7 of 9 positive-negative pairs are ordered correctly
+        self.assertAlmostEqual(auc.value(), 7 / 9, places=12)
+
+    def test_ties(self):
+        auc = HistogramAUC()
+        for y, score in zip([1, 0, 1, 0], [0.5, 0.5, 1.0, 0.0]):
+            auc.update(y, score)
+
+        self.assertAlmostEqual(auc.value(), 0.875, places=12)
+
+    def test_one_class(self):
+        auc = HistogramAUC()
+        auc.update(1, 0.5)
+
+        with self.assertRaises(ValueError):
+            auc.value()
+
+
+class TestLogLoss(unittest.TestCase):
+    def test_value(self):
+        loss = LogLoss()
+        for y, probability in zip([1, 0, 1], [0.8, 0.3, 0.5]):
+            loss.update(y, probability)
+
+        self.assertAlmostEqual(loss.value(), 0.4243218919376292, places=12)
+
+    def test_clipping(self):
+        loss = LogLoss()
+        loss.update(1, 0.0)
+
+        self.assertAlmostEqual(loss.value(), 34.538776394910684, places=9)
+
+
+if __name__ == '__main__':
+    unittest.main()